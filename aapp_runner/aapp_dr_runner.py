@@ -458,10 +458,10 @@ class AappLvl1Processor(object):
 
             start_orbnum = None
             try:
-                import pyorbital.orbital as orb
-                sat = orb.Orbital(
+                from trollduction.orbits import get_orbital, get_orbit_number
+                sat = get_orbital(
                     TLE_SATNAME.get(self.platform_name, self.platform_name))
-                start_orbnum = sat.get_orbit_number(self.starttime)
+                start_orbnum = get_orbit_number(sat, self.starttime)
             except ImportError:
                 LOG.warning("Failed importing pyorbital, " +
                             "cannot calculate orbit number")
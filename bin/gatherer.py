@@ -29,6 +29,7 @@ from trollsift import Parser, compose
 from datetime import timedelta, datetime
 from trollduction.collectors import trigger
 from trollduction.collectors import region_collector
+from trollduction import orbits, snapshot
 import time
 import logging
 import logging.handlers
@@ -41,6 +42,9 @@ LOGGER = logging.getLogger(__name__)
 CONFIG = RawConfigParser()
 PUB = None
 
+# Seconds between the snapshots of the collections in progress
+SNAPSHOT_INTERVAL = 30
+
 
 def get_metadata(fname):
     """Parse metadata from the file.
@@ -57,7 +61,8 @@ def get_metadata(fname):
         res = parser.parse(fname)
         res.update(dict(CONFIG.items(section)))
 
-        for key in ["watcher", "pattern", "timeliness", "regions"]:
+        for key in ["watcher", "pattern", "timeliness", "regions",
+                    "tle_dir"]:
             res.pop(key, None)
 
         if "duration" in res and "end_time" not in res:
@@ -147,6 +152,10 @@ def arg_parse():
     parser.add_argument("-c", "--config-item",
                         help="config item to use (all by default). Can be specified multiply times",
                         action="append")
+    parser.add_argument("-s", "--snapshot",
+                        help="file to keep the collections in progress in, "
+                        "to restore them on restart",
+                        default=None)
     parser.add_argument("config", help="config file to be used")
 
     return parser.parse_args()
@@ -158,11 +167,21 @@ def setup(decoder):
 
     granule_triggers = []
 
+    # The TLE directory is shared by the whole process, so it is only
+    # taken from the DEFAULT section.
+    tle_dir = CONFIG.defaults().get("tle_dir")
+    if tle_dir:
+        orbits.set_tle_dir(tle_dir)
+
     for section in CONFIG.sections():
         regions = [get_area_def(region)
                    for region in CONFIG.get(section, "regions").split()]
 
         timeliness = timedelta(minutes=CONFIG.getint(section, "timeliness"))
+        if (CONFIG.has_option(section, "tle_dir") and
+                CONFIG.get(section, "tle_dir") != tle_dir):
+            LOGGER.warning("Ignoring the tle_dir of %s, it has to be set in "
+                           "the DEFAULT section", section)
         try:
             duration = timedelta(seconds=CONFIG.getfloat(section, "duration"))
         except NoOptionError:
@@ -195,16 +214,32 @@ def setup(decoder):
 
         else:
             LOGGER.debug("Using posttroll for %s", section)
+            try:
+                max_batch = CONFIG.getint(section, "max_batch")
+            except NoOptionError:
+                max_batch = 1
             granule_trigger = trigger.PostTrollTrigger(
                 collectors, terminator,
                 CONFIG.get(section, 'service').split(','),
                 CONFIG.get(section, 'topics').split(','),
-                publish_topic=publish_topic)
+                publish_topic=publish_topic, max_batch=max_batch)
+        if len(collectors) > 1:
+            granule_trigger.index_regions()
         granule_triggers.append(granule_trigger)
 
     return granule_triggers
 
 
+def save_snapshot(filename, sections, granule_triggers):
+    """Save the collections in progress of the *granule_triggers* of
+    *sections* to *filename*.
+    """
+    snapshot.save(filename,
+                  dict((section, granule_trigger.get_state())
+                       for section, granule_trigger in zip(sections,
+                                                           granule_triggers)))
+
+
 def main():
     """Main() for gatherer.
     """
@@ -258,17 +293,29 @@ def main():
     PUB = publisher.NoisyPublisher("gatherer")
 
     granule_triggers = setup(decoder)
+    # setup makes one trigger per section
+    sections = CONFIG.sections()
+
+    if opts.snapshot:
+        state = snapshot.load(opts.snapshot) or {}
+        for section, granule_trigger in zip(sections, granule_triggers):
+            granule_trigger.set_state(state.get(section, {}))
 
     PUB.start()
 
     for granule_trigger in granule_triggers:
         granule_trigger.start()
+    last_snapshot = time.time()
     try:
         while True:
             time.sleep(1)
             for granule_trigger in granule_triggers:
                 if not granule_trigger.is_alive():
                     raise RuntimeError
+            if (opts.snapshot and
+                    time.time() - last_snapshot > SNAPSHOT_INTERVAL):
+                save_snapshot(opts.snapshot, sections, granule_triggers)
+                last_snapshot = time.time()
     except KeyboardInterrupt:
         LOGGER.info("Shutting down...")
     except RuntimeError:
@@ -276,6 +323,8 @@ def main():
     finally:
         for granule_trigger in granule_triggers:
             granule_trigger.stop()
+        if opts.snapshot:
+            save_snapshot(opts.snapshot, sections, granule_triggers)
         PUB.stop()
 
 if __name__ == '__main__':
@@ -95,6 +95,7 @@ if __name__ == '__main__':
             "aborting!"
 
     trd = Trollduction(cfg)
+    trd.warm_up()
 
     def shutdown(*args):
         logger.info("l2processor shutting down")
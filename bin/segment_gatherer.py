@@ -34,6 +34,7 @@ import datetime as dt
 from collections import OrderedDict
 
 from posttroll import message, publisher
+from trollduction import snapshot
 from trollduction.listener import ListenerContainer
 from trollsift import Parser, compose
 
@@ -42,15 +43,20 @@ SLOT_READY = 1
 SLOT_READY_BUT_WAIT_FOR_MORE = 2
 SLOT_OBSOLETE_TIMEOUT = 3
 
+# Seconds between the snapshots of the slots
+SNAPSHOT_INTERVAL = 30
+
 
 class SegmentGatherer(object):
 
     """Gatherer for geostationary satellite segments and multifile polar
-    satellite granules."""
+    satellite granules. The slots in progress are kept in *snapshot_file*,
+    if given, and restored from it on start."""
 
-    def __init__(self, config, section):
+    def __init__(self, config, section, snapshot_file=None):
         self._config = config
         self._section = section
+        self._snapshot_file = snapshot_file
         topics = config.get(section, 'topics').split()
         self._listener = ListenerContainer(topics=topics)
         self._publisher = publisher.NoisyPublisher("segment_gatherer")
@@ -70,6 +76,26 @@ class SegmentGatherer(object):
         except (NoOptionError, ValueError):
             self._num_files_premature_publish = -1
 
+        # Parse the file lists once. Critical files that are required,
+        # otherwise production will fail. If there are no critical files,
+        # an empty list is used.
+        try:
+            self._critical_items = _parse_items(
+                config.get(section, "critical_files"))
+        except (NoOptionError, ValueError):
+            self._critical_items = []
+        # These files are wanted, but not critical to production
+        self._wanted_items = _parse_items(config.get(section, "wanted_files"))
+        # Name of all the files
+        self._all_items = _parse_items(config.get(section, "all_files"))
+
+        # Tags (such as processing time) varying between the files of a slot
+        try:
+            self._variable_tags = config.get(section,
+                                             'variable_tags').split(',')
+        except NoOptionError:
+            self._variable_tags = []
+
         self.slots = OrderedDict()
 
         self.time_name = config.get(section, 'time_name')
@@ -98,26 +124,14 @@ class SegmentGatherer(object):
         self.slots[time_slot] = {}
         self.slots[time_slot]['metadata'] = metadata.copy()
 
-        # Critical files that are required, otherwise production will fail.
-        # If there are no critical files, empty set([]) is used.
-        try:
-            critical_segments = self._config.get(self._section,
-                                                 "critical_files")
-            self.slots[time_slot]['critical_files'] = \
-                    self._compose_filenames(time_slot, critical_segments)
-        except (NoOptionError, ValueError):
-            self.slots[time_slot]['critical_files'] = set([])
-
-        # These files are wanted, but not critical to production
+        filenames = {}
+        self.slots[time_slot]['critical_files'] = \
+            self._compose_filenames(time_slot, self._critical_items,
+                                    filenames)
         self.slots[time_slot]['wanted_files'] = \
-            self._compose_filenames(time_slot,
-                                    self._config.get(self._section,
-                                                     "wanted_files"))
-        # Name of all the files
+            self._compose_filenames(time_slot, self._wanted_items, filenames)
         self.slots[time_slot]['all_files'] = \
-            self._compose_filenames(time_slot,
-                                    self._config.get(self._section,
-                                                     "all_files"))
+            self._compose_filenames(time_slot, self._all_items, filenames)
 
         self.slots[time_slot]['received_files'] = set([])
         self.slots[time_slot]['delayed_files'] = dict()
@@ -126,36 +140,28 @@ class SegmentGatherer(object):
         self.slots[time_slot]['files_till_premature_publish'] = \
             self._num_files_premature_publish
 
-    def _compose_filenames(self, time_slot, itm_str):
-        """Compose filename set()s based on a pattern and item string.
-        itm_str is formated like ':PRO,:EPI' or 'VIS006:8,VIS008:1-8,...'"""
+    def _compose_filenames(self, time_slot, items, filenames=None):
+        """Compose filename set()s based on a pattern and the (channel_name,
+        segment) *items*. The filenames already composed for the slot are
+        taken from the *filenames* dict, and the new ones added to it."""
 
-        # Empty set
-        result = set()
+        if filenames is None:
+            filenames = {}
 
-        # Get copy of metadata
-        meta = self.slots[time_slot]['metadata'].copy()
+        # Get copy of metadata, with the variable tags (such as processing
+        # time) replaced with wildcards, as these can't be forecasted.
+        meta = _copy_without_ignore_items(
+            self.slots[time_slot]['metadata'],
+            ignored_keys=self._variable_tags)
 
-        # Replace variable tags (such as processing time) with
-        # wildcards, as these can't be forecasted.
-        try:
-            meta = _copy_without_ignore_items(
-                meta, ignored_keys=self._config.get(self._section,
-                                                    'variable_tags').split(','))
-        except NoOptionError:
-            pass
-
-        for itm in itm_str.split(','):
-            channel_name, segments = itm.split(':')
-            segments = segments.split('-')
-            if len(segments) > 1:
-                segments = ['%d' % i for i in range(int(segments[0]),
-                                                    int(segments[-1]) + 1)]
-            meta['channel_name'] = channel_name
-            for seg in segments:
-                meta['segment'] = seg
-                fname = self._parser.globify(meta)
-                result.add(fname)
+        result = set()
+        for item in items:
+            try:
+                result.add(filenames[item])
+            except KeyError:
+                meta['channel_name'], meta['segment'] = item
+                filenames[item] = self._parser.globify(meta)
+                result.add(filenames[item])
 
         return result
 
@@ -188,6 +194,25 @@ class SegmentGatherer(object):
         """Set logger."""
         self.logger = logger
 
+    def save_snapshot(self):
+        """Save the slots in progress to the snapshot file."""
+        snapshot.save(self._snapshot_file,
+                      {"timeliness": self._timeliness, "slots": self.slots})
+
+    def load_snapshot(self):
+        """Restore the slots in progress from the snapshot file, moving
+        their timeouts to the current timeliness."""
+        state = snapshot.load(self._snapshot_file)
+        if not state:
+            return
+        shift = self._timeliness - state["timeliness"]
+        for slot in state["slots"].values():
+            if slot['timeout'] is not None:
+                slot['timeout'] += shift
+        self.slots = state["slots"]
+        self.logger.info("Restored %d slots from %s", len(self.slots),
+                         self._snapshot_file)
+
     def slot_ready(self, slot):
         """Determine if slot is ready to be published."""
         # If no files have been collected, return False
@@ -257,8 +282,16 @@ class SegmentGatherer(object):
     def run(self):
         """Run SegmentGatherer"""
         self._publisher.start()
+        if self._snapshot_file:
+            self.load_snapshot()
+        last_snapshot = time.time()
         self._loop = True
         while self._loop:
+            if (self._snapshot_file and
+                    time.time() - last_snapshot > SNAPSHOT_INTERVAL):
+                self.save_snapshot()
+                last_snapshot = time.time()
+
             # Check if there are slots ready for publication
             slots = self.slots.copy()
             for slot in slots:
@@ -292,8 +325,13 @@ class SegmentGatherer(object):
                 self.logger.info("New message received: %s", str(msg))
                 self.process(msg)
 
+        # The slots are saved only from here, where they are modified.
+        if self._snapshot_file:
+            self.save_snapshot()
+
     def stop(self):
-        """Stop gatherer."""
+        """Stop gatherer. The slots are saved when the run loop
+        exits."""
         self.logger.info("Stopping gatherer.")
         self._loop = False
         if self._listener is not None:
@@ -318,21 +356,22 @@ class SegmentGatherer(object):
 
         # Replace variable tags (such as processing time) with
         # wildcards, as these can't be forecasted.
-        try:
+        if self._variable_tags:
             mda = _copy_without_ignore_items(
-                mda, ignored_keys=self._config.get(self._section,
-                                                   'variable_tags').split(','))
-        except NoOptionError:
-            pass
+                mda, ignored_keys=self._variable_tags)
 
         mask = self._parser.globify(mda)
 
         if mask in slot['received_files']:
             return
 
-        # Add uid and uri
-        slot['metadata']['dataset'].append({'uri': msg.data['uri'],
-                                            'uid': msg.data['uid']})
+        # Add uid and uri, and the segment identification so that the
+        # consumers can pick only the segments they need
+        dataset_mda = {'uri': msg.data['uri'], 'uid': msg.data['uid']}
+        for key in ("channel_name", "segment"):
+            if key in mda:
+                dataset_mda[key] = mda[key]
+        slot['metadata']['dataset'].append(dataset_mda)
 
         # If critical files have been received but the slot is
         # not complete, add the file to list of delayed files
@@ -345,6 +384,21 @@ class SegmentGatherer(object):
         slot['received_files'].add(mask)
 
 
+def _parse_items(itm_str):
+    """Parse an item string formated like ':PRO,:EPI' or
+    'VIS006:8,VIS008:1-8,...' into a list of (channel_name, segment)
+    tuples, with the segment ranges expanded."""
+    items = []
+    for itm in itm_str.split(','):
+        channel_name, segments = itm.split(':')
+        segments = segments.split('-')
+        if len(segments) > 1:
+            segments = ['%d' % i for i in range(int(segments[0]),
+                                                int(segments[-1]) + 1)]
+        items.extend((channel_name, seg) for seg in segments)
+    return items
+
+
 def _copy_without_ignore_items(the_dict, ignored_keys=['ignore']):
     """
     get a copy of *the_dict* without entries having substring
@@ -370,6 +424,10 @@ def arg_parse():
                         action="store_true")
     parser.add_argument("-c", "--config", help="config file to be used")
     parser.add_argument("-C", "--config_item", help="config item to use")
+    parser.add_argument("-s", "--snapshot",
+                        help="file to keep the slots in progress in, to "
+                        "restore them on restart",
+                        default=None)
 
     return parser.parse_args()
 
@@ -411,7 +469,7 @@ def main():
     logger = logging.getLogger("segment_gatherer")
 
 
-    gatherer = SegmentGatherer(config, args.config_item)
+    gatherer = SegmentGatherer(config, args.config_item, args.snapshot)
     gatherer.set_logger(logger)
     gatherer.run()
 
@@ -2,8 +2,8 @@ import os
 from datetime import datetime, timedelta
 import re
 
-from pyorbital.orbital import Orbital
 from npp_runner import get_npp_stamp
+from trollduction.orbits import get_orbital, get_orbit_number
 
 import logging
 LOG = logging.getLogger(__name__)
@@ -63,14 +63,15 @@ def replace_orbitno(filename):
                                  "in file to determine orbit number")
                         time_val = good_time_val_[0]
 
-                    orbit_val = orbital_.get_orbit_number(time_val,
-                                                          tbus_style=TBUS_STYLE)
+                    orbit_val = get_orbit_number(orbital_, time_val,
+                                                 tbus_style=TBUS_STYLE)
                     obj.attrs.modify(orbit_key, [[orbit_val]])
                     counter_[0] += 1
 
     # Correct h5 attributes
-    orbital_ = Orbital(TLE_SATNAME[stamp.platform])
-    orbit = orbital_.get_orbit_number(stamp.start_time, tbus_style=TBUS_STYLE)
+    orbital_ = get_orbital(TLE_SATNAME[stamp.platform])
+    orbit = get_orbit_number(orbital_, stamp.start_time,
+                             tbus_style=TBUS_STYLE)
     LOG.info("Replacing orbit number %05d with %05d",
              stamp.orbit_number, orbit)
     fp = h5py.File(filename, 'r+')
@@ -6,7 +6,7 @@ import sys
 import h5py
 from datetime import datetime, timedelta
 import numpy as np
-import pyorbital.orbital as orb
+from trollduction.orbits import get_orbital, get_orbit_number
 
 import logging
 LOG = logging.getLogger(__name__)
@@ -83,11 +83,11 @@ def get_orbitnumbers_to_nppfile(npp_file):
     else:
         obstime = start_obstime
 
-    sat = orb.Orbital('SUOMI NPP')
+    sat = get_orbital('SUOMI NPP')
 
     # Get the start orbit number:
     orbits = {}
-    start_orbnum = sat.get_orbit_number(obstime)
+    start_orbnum = get_orbit_number(sat, obstime)
     orbits['start'] = start_orbnum
 
     # Get all orbit numbers for the swath.
@@ -99,7 +99,7 @@ def get_orbitnumbers_to_nppfile(npp_file):
         else:
             obstime = obstimes[key]
 
-        orbits[key] = sat.get_orbit_number(obstime)
+        orbits[key] = get_orbit_number(sat, obstime)
 
     print "Orbit numbers in swath:"
     for key in obstimes:
@@ -160,9 +160,7 @@ def get_npp_orbit_number(obstime):
     """Get the orbit number for the Suomi NPP RDR/SDR file given the
     observation start time. The orbit number"""
 
-    sat = orb.Orbital('SUOMI NPP')
-
-    return sat.get_orbit_number(obstime)
+    return get_orbit_number(get_orbital('SUOMI NPP'), obstime)
 
 
 # -------------------------
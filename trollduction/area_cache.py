@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cache of the area definitions and of the artefacts derived from them.
+
+The area definitions are parsed once from the area file (and again when the
+file changes), and carry their boundary polygon as *poly*, which is what
+trollsched uses to compute the coverage of the passes. The lon/lat grids are
+kept in memory only for the areas they are explicitly computed for, as they
+are big, but can be kept on disk as memory-mapped files for all the areas.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+from threading import Lock
+
+import numpy as np
+
+from mpop.projector import get_area_file
+from pyresample.utils import AreaNotFound, parse_area_file
+from trollsched.boundary import AreaDefBoundary
+
+LOGGER = logging.getLogger(__name__)
+
+_LOCK = Lock()
+_AREAS = {}
+_LONLATS = {}
+_MTIME = [None]
+_LONLAT_DIR = [None]
+
+
+def _check_area_file():
+    """Clear the cache if the area file changed.
+    """
+    try:
+        mtime = os.stat(get_area_file()).st_mtime
+    except OSError:
+        mtime = None
+    if mtime != _MTIME[0]:
+        if _MTIME[0] is not None:
+            LOGGER.info("Area file changed, clearing the area cache")
+        _AREAS.clear()
+        _LONLATS.clear()
+        _MTIME[0] = mtime
+
+
+def get_area_def(area_id):
+    """Get the definition of *area_id*, like mpop's *get_area_def*, but
+    parsing the area file only once.
+    """
+    with _LOCK:
+        _check_area_file()
+        try:
+            return _AREAS[area_id]
+        except KeyError:
+            pass
+    area_def = parse_area_file(get_area_file(), area_id)[0]
+    with _LOCK:
+        return _AREAS.setdefault(area_id, area_def)
+
+
+def get_boundary(area_def, frequency=500):
+    """Get the boundary polygon of *area_def*, computing it on first use.
+    """
+    try:
+        return area_def.poly
+    except AttributeError:
+        area_def.poly = AreaDefBoundary(area_def,
+                                        frequency=frequency).contour_poly
+        return area_def.poly
+
+
+def set_lonlat_dir(path):
+    """Keep the lon/lat grids of the areas in *path*, or nowhere if *path*
+    is None.
+    """
+    if path is not None and not os.path.isdir(path):
+        os.makedirs(path)
+    _LONLAT_DIR[0] = path
+
+
+def _get_area_hash(area_def):
+    """Get a hash of the definition of *area_def*.
+    """
+    return hashlib.md5(str((area_def.proj4_string,
+                            tuple(area_def.area_extent),
+                            area_def.x_size, area_def.y_size))).hexdigest()
+
+
+def _save_array(filename, arr):
+    """Save *arr* to *filename* atomically.
+    """
+    tempfd, tempname = tempfile.mkstemp(dir=os.path.dirname(filename))
+    try:
+        with os.fdopen(tempfd, "wb") as fd_:
+            np.save(fd_, arr)
+        os.chmod(tempname, int("644", 8))
+        os.rename(tempname, filename)
+    except (IOError, OSError):
+        LOGGER.exception("Could not save %s", filename)
+        try:
+            os.remove(tempname)
+        except OSError:
+            pass
+
+
+def _load_lonlats(basename):
+    """Map the lon/lat grids saved as *basename* copy-on-write: the pages
+    are shared with the disk cache, and changes to the arrays stay private
+    to them.
+    """
+    return (np.load(basename + "_lons.npy", mmap_mode="c"),
+            np.load(basename + "_lats.npy", mmap_mode="c"))
+
+
+def _map_lonlats(area_def):
+    """Get the lon/lat grids of *area_def* as float32 arrays mapped from
+    the disk cache, computing them first if needed. Each call maps them
+    anew, so the arrays can be modified without affecting other users.
+    """
+    basename = os.path.join(_LONLAT_DIR[0], "%s_%s" % (
+        area_def.area_id, _get_area_hash(area_def)))
+    try:
+        return _load_lonlats(basename)
+    except (IOError, ValueError):
+        pass
+    LOGGER.debug("Computing the lon/lat grids of %s", area_def.area_id)
+    lons, lats = area_def.get_lonlats()
+    _save_array(basename + "_lons.npy", lons.astype(np.float32))
+    _save_array(basename + "_lats.npy", lats.astype(np.float32))
+    try:
+        return _load_lonlats(basename)
+    except (IOError, ValueError):
+        return lons, lats
+
+
+def get_lonlats(area_def):
+    """Get the lon/lat grids of *area_def*, from the cache if they have been
+    computed with *cache_lonlats*, or from the disk cache if there is one.
+    """
+    with _LOCK:
+        try:
+            return _LONLATS[area_def.area_id]
+        except (KeyError, AttributeError):
+            pass
+    if _LONLAT_DIR[0] is not None and hasattr(area_def, "proj4_string"):
+        return _map_lonlats(area_def)
+    return area_def.get_lonlats()
+
+
+def attach_lonlats(area_def):
+    """Give *area_def* the lon/lat grids from the disk cache, if there is
+    one, so that the composites don't compute them again.
+    """
+    if (_LONLAT_DIR[0] is None or not hasattr(area_def, "proj4_string") or
+            getattr(area_def, "lons", None) is not None):
+        return
+    area_def.lons, area_def.lats = _map_lonlats(area_def)
+
+
+def cache_lonlats(area_id):
+    """Compute and keep the lon/lat grids of *area_id*.
+    """
+    area_def = get_area_def(area_id)
+    lonlats = area_def.get_lonlats()
+    with _LOCK:
+        _LONLATS[area_id] = lonlats
+    return lonlats
+
+
+def warm_up(area_ids, lonlats=False):
+    """Parse the *area_ids* and compute their boundaries, and their lon/lat
+    grids if *lonlats* is True (or if they are kept on disk). Return the ids
+    of the areas that were prepared.
+    """
+    ready = []
+    for idx, area_id in enumerate(area_ids):
+        try:
+            area_def = get_area_def(area_id)
+            get_boundary(area_def)
+            if lonlats:
+                cache_lonlats(area_id)
+            elif _LONLAT_DIR[0] is not None:
+                _map_lonlats(area_def)
+        except AreaNotFound:
+            LOGGER.warning("Area %s not defined, not warmed up", area_id)
+            continue
+        except Exception:
+            LOGGER.exception("Could not warm up area %s", area_id)
+            continue
+        ready.append(area_id)
+        LOGGER.debug("Area %s warmed up (%d/%d)",
+                     area_id, idx + 1, len(area_ids))
+    return ready
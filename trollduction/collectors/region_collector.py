@@ -26,9 +26,18 @@
 """
 
 import os
+from bisect import bisect_left
+from collections import OrderedDict
 from datetime import timedelta, datetime
+from threading import Lock
 
-from trollsched.satpass import Pass
+import numpy as np
+from pyproj import Proj
+from pyorbital import geoloc, geoloc_instrument_definitions
+from trollsched.boundary import Boundary
+
+from trollduction.area_cache import get_boundary
+from trollduction.orbits import get_orbital, get_orbit_number
 
 import logging
 
@@ -36,6 +45,251 @@ LOG = logging.getLogger(__name__)
 
 PLOT = False
 
+# Number of granules evaluated at once on each side of the first one
+BATCH_SIZE = 16
+# Longest pass over a region
+MAX_PASS_DURATION = timedelta(minutes=120)
+# Tolerance when matching granules to the planned ones
+TIME_TOLERANCE = timedelta(seconds=3)
+
+_PLANS = OrderedDict()
+_MAX_PLANS = 256
+_SWATHS = OrderedDict()
+_MAX_SWATHS = 16
+_LOCK = Lock()
+
+
+def get_swath_points(orb, instrument, start_time, scans_nb, frequency):
+    """Get the lons and lats of 5 pixels across *scans_nb* scans,
+    *frequency* seconds apart from *start_time*, with a single orbit
+    propagation. The first and last pixels are the edges of the swath.
+    """
+    scan_angle = 55.37
+    if instrument == "modis":
+        scan_angle = 55.0
+    elif instrument == "viirs":
+        scan_angle = 55.84
+    scan_points = np.array([0, 512, 1024, 1536, 2047])
+    sgeom = geoloc_instrument_definitions.avhrr(scans_nb, scan_points,
+                                                scan_angle=scan_angle,
+                                                frequency=frequency)
+    times = sgeom.times(start_time)
+    pixel_pos = geoloc.compute_pixels((orb.tle._line1, orb.tle._line2),
+                                      sgeom, times)
+    lons, lats, _ = geoloc.get_lonlatalt(pixel_pos, times)
+    return (lons.reshape(-1, len(scan_points)),
+            lats.reshape(-1, len(scan_points)))
+
+
+def get_granule_steps(granule_duration):
+    """Get the number of scans sampled in a granule of *granule_duration*
+    for the coverage checks, and the time in seconds between them.
+    """
+    duration = granule_duration.total_seconds()
+    steps = max(2, int(np.ceil(duration / 10.0)))
+    return steps, duration / steps
+
+
+def get_granule_swath(platform, instrument, start_time, granule_duration):
+    """Get the swath points of the granule of *platform* starting at
+    *start_time*, as sampled for the coverage checks. The points of the
+    latest granules are cached, so that the region index and all the
+    regions checking a granule share one orbit propagation.
+    """
+    key = (platform, instrument, start_time, granule_duration)
+    with _LOCK:
+        try:
+            return _SWATHS[key]
+        except KeyError:
+            pass
+    steps, frequency = get_granule_steps(granule_duration)
+    swath = get_swath_points(get_orbital(platform), instrument, start_time,
+                             steps + 1, frequency)
+    with _LOCK:
+        _SWATHS[key] = swath
+        while len(_SWATHS) > _MAX_SWATHS:
+            _SWATHS.popitem(last=False)
+    return swath
+
+
+def iter_covering_granules(orb, instrument, region, first_time,
+                           granule_duration, count, backwards=False,
+                           swath=None):
+    """Check which of the *count* granules starting from *first_time* cover
+    *region*, yielding True or False for each of them, from the last one if
+    *backwards* is True. The *swath* points of the granules can be given if
+    they are already computed.
+
+    The swath is computed for all the granules at once. Granules having
+    sampled pixels inside the region are covering it, the others are
+    checked with polygon intersections, one by one.
+    """
+    steps, frequency = get_granule_steps(granule_duration)
+    if swath is None:
+        swath = get_swath_points(orb, instrument, first_time,
+                                 count * steps + 1, frequency)
+    lons, lats = swath
+    xcoords, ycoords = Proj(**region.proj_dict)(lons, lats)
+    x_min, y_min, x_max, y_max = region.area_extent
+    inside = ((xcoords >= x_min) & (xcoords <= x_max) &
+              (ycoords >= y_min) & (ycoords <= y_max))
+    indices = range(count)
+    if backwards:
+        indices.reverse()
+    for idx in indices:
+        rows = slice(idx * steps, (idx + 1) * steps + 1)
+        if np.any(inside[rows]):
+            yield True
+            continue
+        contour_lons = np.concatenate((lons[rows, -1], lons[rows, 0][::-1]))
+        contour_lats = np.concatenate((lats[rows, -1], lats[rows, 0][::-1]))
+        inter = Boundary(contour_lons, contour_lats).contour_poly.intersection(
+            get_boundary(region))
+        yield inter is not None and inter.area() > 0
+
+
+def predict_granules(platform, instrument, region, start_time,
+                     granule_duration, orbit_number=None):
+    """Predict the start times of the granules of the pass of *platform*
+    over *region*, from the granule starting at *start_time*.
+
+    The granules are evaluated by batches, and the predictions are cached
+    per platform, instrument, orbit number, region and granule duration.
+    """
+    orb = get_orbital(platform)
+    if orbit_number is None:
+        orbit_number = get_orbit_number(orb, start_time)
+    key = (platform, instrument, orbit_number, region.area_id,
+           granule_duration)
+    with _LOCK:
+        planned = _PLANS.get(key)
+    if planned is not None and any(abs(start_time - ptime) < TIME_TOLERANCE
+                                   for ptime in planned):
+        LOG.debug("Reusing the granules planned for %s", str(key))
+        return set(planned)
+
+    planned = set([start_time])
+    max_steps = int(MAX_PASS_DURATION.total_seconds() //
+                    granule_duration.total_seconds())
+    for direction in [1, -1]:
+        step = 1
+        while step <= max_steps:
+            count = min(BATCH_SIZE, max_steps - step + 1)
+            if direction > 0:
+                first_time = start_time + step * granule_duration
+            else:
+                first_time = (start_time -
+                              (step + count - 1) * granule_duration)
+            covering = iter_covering_granules(orb, instrument, region,
+                                              first_time, granule_duration,
+                                              count, backwards=direction < 0)
+            for idx, covers in enumerate(covering):
+                if not covers:
+                    break
+                planned.add(start_time +
+                            direction * (step + idx) * granule_duration)
+            else:
+                step += count
+                continue
+            break
+
+    with _LOCK:
+        _PLANS[key] = frozenset(planned)
+        while len(_PLANS) > _MAX_PLANS:
+            _PLANS.popitem(last=False)
+    return planned
+
+
+class Collection(object):
+
+    """A collection of the granules of one pass of *platform* over a region,
+    planned to start at the *planned_granule_times*.
+
+    The planned granule times are kept sorted, with flags telling which have
+    been received and a pointer to the latest missing one, so that matching
+    a granule and checking the completion of the swath don't depend on the
+    number of granules.
+    """
+
+    def __init__(self, platform, planned_granule_times, granule_duration,
+                 timeliness):
+        self.platform = platform
+        self.granule_duration = granule_duration
+        self.timeliness = timeliness
+        self.granule_times = set()
+        self.granules = []
+        self.planned_granule_times = sorted(planned_granule_times)
+        self._received = [False] * len(self.planned_granule_times)
+        self._latest_missing = len(self.planned_granule_times) - 1
+        self.timeout = (self.planned_granule_times[-1] +
+                        granule_duration + timeliness)
+
+    def find_planned(self, start_time):
+        """Get the index of the planned granule starting at *start_time*, or
+        None.
+        """
+        idx = bisect_left(self.planned_granule_times,
+                          start_time - TIME_TOLERANCE)
+        if (idx < len(self.planned_granule_times) and
+                abs(self.planned_granule_times[idx] - start_time) <
+                TIME_TOLERANCE):
+            return idx
+        return None
+
+    def is_in_pass(self, start_time):
+        """Check if *start_time* is within the planned pass, give or take a
+        granule.
+        """
+        return (self.planned_granule_times[0] - self.granule_duration <
+                start_time <
+                self.planned_granule_times[-1] + self.granule_duration)
+
+    def add_unplanned(self, granule_metadata):
+        """Add the granule of *granule_metadata*, covering the region but
+        not matching any planned granule.
+        """
+        self.granule_times.add(granule_metadata['start_time'])
+        self.granules.append(granule_metadata)
+
+    def is_received(self, idx):
+        """Check if the planned granule *idx* has been received.
+        """
+        return self._received[idx]
+
+    def add(self, idx, granule_metadata):
+        """Add the granule of *granule_metadata* as the planned granule
+        *idx*.
+        """
+        self._received[idx] = True
+        self.granule_times.add(self.planned_granule_times[idx])
+        self.granules.append(granule_metadata)
+        while (self._latest_missing >= 0 and
+               self._received[self._latest_missing]):
+            self._latest_missing -= 1
+
+    def is_swath_complete(self):
+        '''Check if the swath is complete, adjusting the timeout to the
+        latest missing granule otherwise.
+        '''
+        if self._latest_missing < 0:
+            return True
+        new_timeout = (self.planned_granule_times[self._latest_missing] +
+                       self.granule_duration +
+                       self.timeliness)
+        if new_timeout < self.timeout:
+            self.timeout = new_timeout
+            LOG.info("Adjusted timeout: %s", self.timeout.isoformat())
+        return False
+
+    def update_timeout(self, timeliness):
+        """Compute the timeout again with *timeliness*, from the latest
+        missing granule.
+        """
+        self.timeliness = timeliness
+        self.timeout = (self.planned_granule_times[self._latest_missing] +
+                        self.granule_duration + timeliness)
+
+
 class RegionCollector(object):
 
     """This is the region collector. It collects granules that overlap on a
@@ -43,22 +297,47 @@ class RegionCollector(object):
 
     *timeliness* defines the max allowed age of the granule.
 
+    Several collections can be in progress at once, one per pass of each
+    platform over the region, each with its own timeout. The *timeout* of
+    the collector is the earliest of them, and *finish* terminates the
+    corresponding collection.
     """
 
     def __init__(self, region,
                  timeliness=timedelta(seconds=600),
                  granule_duration=None):
         self.region = region  # area def
-        self.granule_times = set()
-        self.granules = []
-        self.planned_granule_times = set()
+        self.collections = {}
         self.timeliness = timeliness
-        self.timeout = None
         self.granule_duration = granule_duration
 
     def __call__(self, granule_metadata):
         return self.collect(granule_metadata)
 
+    @property
+    def timeout(self):
+        """The earliest timeout of the collections, or None.
+        """
+        timeouts = [collection.timeout
+                    for collection in self.collections.values()]
+        if timeouts:
+            return min(timeouts)
+        return None
+
+    @property
+    def granules(self):
+        """The granules of all the collections in progress.
+        """
+        return [granule for collection in self.collections.values()
+                for granule in collection.granules]
+
+    @property
+    def planned_granule_times(self):
+        """The planned granule times of all the collections in progress.
+        """
+        return sorted(ptime for collection in self.collections.values()
+                      for ptime in collection.planned_granule_times)
+
     def collect(self, granule_metadata):
         """ 
             Parameters:
@@ -77,94 +356,99 @@ class RegionCollector(object):
         LOG.debug("Adding area ID to metadata: %s", str(self.region.area_id))
         granule_metadata['collection_area_id'] = self.region.area_id
 
-        for ptime in self.planned_granule_times:
-            if abs(start_time - ptime) < timedelta(seconds=3) and \
-               ptime not in self.granule_times:
-                self.granule_times.add(ptime)
-                self.granules.append(granule_metadata)
-                LOG.info("Added %s (%s) granule to area %s",
+        for key, collection in self.collections.items():
+            if collection.platform != platform:
+                continue
+            idx = collection.find_planned(start_time)
+            if idx is None:
+                continue
+            if collection.is_received(idx):
+                LOG.debug("Granule %s (%s) already collected for area %s",
+                          platform, str(start_time), self.region.area_id)
+                return
+            collection.add(idx, granule_metadata)
+            LOG.info("Added %s (%s) granule to area %s",
+                     platform,
+                     str(start_time),
+                     self.region.area_id)
+            # If last granule return swath and cleanup
+            if collection.is_swath_complete():
+                LOG.info("Collection finished for area: %s",
+                         str(self.region.area_id))
+                return self.finish(key)
+            return
+
+        # Get corners from input data
+
+        granule_duration = self.granule_duration
+        if granule_duration is None:
+            granule_duration = end_time - start_time
+            LOG.debug("Estimated granule duration to %s",
+                      str(granule_duration))
+
+        sensor = granule_metadata["sensor"]
+        if isinstance(sensor, (list, tuple)):
+            sensor = sensor[0]
+        swath = get_granule_swath(platform, sensor, start_time,
+                                  end_time - start_time)
+        covers = next(iter_covering_granules(None, sensor, self.region,
+                                             start_time,
+                                             end_time - start_time, 1,
+                                             swath=swath))
+
+        # Granules of a pass being collected, but off the planned times, are
+        # added to its collection
+        if covers:
+            for key, collection in self.collections.items():
+                if (collection.platform != platform or
+                        not collection.is_in_pass(start_time)):
+                    continue
+                if start_time in collection.granule_times:
+                    LOG.debug("Granule %s (%s) already collected for area %s",
+                              platform, str(start_time), self.region.area_id)
+                    return
+                collection.add_unplanned(granule_metadata)
+                LOG.info("Added unplanned %s (%s) granule to area %s",
                          platform,
                          str(start_time),
                          self.region.area_id)
-                # If last granule return swath and cleanup
-                # if self.granule_times == self.planned_granule_times:
-                if self.is_swath_complete():
+                if collection.is_swath_complete():
                     LOG.info("Collection finished for area: %s",
                              str(self.region.area_id))
-                    return self.finish()
-                else:
-                    try:
-                        new_timeout = (max(self.planned_granule_times -
-                                           self.granule_times) +
-                                       self.granule_duration +
-                                       self.timeliness)
-                    except ValueError:
-                        LOG.error("Calculation of new timeout failed, "
-                                  "keeping previous timeout.")
-                        LOG.error("Planned: %s", self.planned_granule_times)
-                        LOG.error("Received: %s", self.granule_times)
-                        return
-
-                    if new_timeout < self.timeout:
-                        self.timeout = new_timeout
-                        LOG.info("Adjusted timeout: %s",
-                                 self.timeout.isoformat())
-
-                    return
-
-        # Get corners from input data
-
-        if self.granule_duration is None:
-            self.granule_duration = end_time - start_time
-            LOG.debug("Estimated granule duration to %s",
-                      str(self.granule_duration))
-
-        granule_pass = Pass(platform, start_time, end_time,
-                            instrument=granule_metadata["sensor"])
+                    return self.finish(key)
+                return
 
         # If file is within region, make pass prediction to know what to wait
         # for
-        if granule_pass.area_coverage(self.region) > 0:
-            self.granule_times.add(start_time)
-            self.granules.append(granule_metadata)
+        if covers:
+            LOG.info("Added %s (%s) granule to area %s",
+                     platform,
+                     str(start_time),
+                     self.region.area_id)
 
             # Computation of the predicted granules within the region
 
-            if not self.planned_granule_times:
-                self.planned_granule_times.add(start_time)
-                LOG.info("Added %s (%s) granule to area %s",
-                         platform,
-                         str(start_time),
-                         self.region.area_id)
-                LOG.debug("Predicting granules covering %s",
-                          self.region.area_id)
-                gr_time = start_time
-                while True:
-                    gr_time += self.granule_duration
-                    gr_pass = Pass(platform, gr_time,
-                                   gr_time + self.granule_duration,
-                                   instrument=granule_metadata["sensor"])
-                    if not gr_pass.area_coverage(self.region) > 0:
-                        break
-                    self.planned_granule_times.add(gr_time)
-
-                gr_time = start_time
-                while True:
-                    gr_time -= self.granule_duration
-                    gr_pass = Pass(platform, gr_time,
-                                   gr_time + self.granule_duration,
-                                   instrument=granule_metadata["sensor"])
-                    if not gr_pass.area_coverage(self.region) > 0:
-                        break
-                    self.planned_granule_times.add(gr_time)
-
-                LOG.info("Planned granules for %s: %s", self.region.name,
-                         str(sorted(self.planned_granule_times)))
-                self.timeout = (max(self.planned_granule_times) +
-                                self.granule_duration +
-                                self.timeliness)
-                LOG.info("Planned timeout for %s: %s", self.region.name,
-                         self.timeout.isoformat())
+            LOG.debug("Predicting granules covering %s",
+                      self.region.area_id)
+            collection = Collection(platform, predict_granules(
+                platform, sensor, self.region, start_time,
+                granule_duration, granule_metadata.get("orbit_number")),
+                granule_duration, self.timeliness)
+            collection.add(collection.find_planned(start_time),
+                           granule_metadata)
+            key = (platform, collection.planned_granule_times[0])
+            self.collections[key] = collection
+
+            LOG.info("Planned granules for %s: %s", self.region.name,
+                     str(collection.planned_granule_times))
+            LOG.info("Planned timeout for %s: %s", self.region.name,
+                     collection.timeout.isoformat())
+
+            # If last granule return swath and cleanup
+            if collection.is_swath_complete():
+                LOG.debug("Collection finished for area: %s",
+                          str(self.region.area_id))
+                return self.finish(key)
 
         else:
             try:
@@ -182,50 +466,29 @@ class RegionCollector(object):
                     LOG.debug("Keys in granule_metadata = %s",
                               str(granule_metadata.keys()))
 
-        # If last granule return swath and cleanup
-        if self.is_swath_complete():
-            LOG.debug("Collection finished for area: %s",
-                      str(self.region.area_id))
-            return self.finish()
-
-    def is_swath_complete(self):
-        '''Check if the swath is complete'''
-        if self.granule_times:
-            if self.planned_granule_times.issubset(self.granule_times):
-                return True
-            try:
-                new_timeout = (max(self.planned_granule_times -
-                                   self.granule_times) +
-                               self.granule_duration +
-                               self.timeliness)
-            except ValueError:
-                LOG.error("Calculation of new timeout failed, "
-                          "keeping previous timeout.")
-                LOG.error("Planned: %s", self.planned_granule_times)
-                LOG.error("Received: %s", self.granule_times)
-                return False
-            if new_timeout < self.timeout:
-                self.timeout = new_timeout
-                LOG.info("Adjusted timeout: %s", self.timeout.isoformat())
-
-        return False
-
+    def restore(self, collections):
+        """Restore the *collections* in progress, from a snapshot, with the
+        timeouts computed again.
+        """
+        for collection in collections.values():
+            collection.update_timeout(self.timeliness)
+        self.collections = collections
 
     def cleanup(self):
         '''Clear members.
         '''
-        self.granule_times = set()
-        self.granules = []
-        self.planned_granule_times = set()
-        self.timeout = None
+        self.collections = {}
 
-    def finish(self):
-        '''Finish collection, add area ID to metadata, cleanup and return
-        granule metadata.
+    def finish(self, key=None):
+        '''Finish the collection *key*, or the one with the earliest timeout,
+        and return its granule metadata.
         '''
-        granules = self.granules
-        self.cleanup()
-        return granules
+        if key is None:
+            if not self.collections:
+                return []
+            key = min(self.collections,
+                      key=lambda key: self.collections[key].timeout)
+        return self.collections.pop(key).granules
 
 
 def read_granule_metadata(filename):
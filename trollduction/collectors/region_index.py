@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Spatial index of the regions, to dispatch the granules only to the
+collectors of the regions they can cover.
+
+The regions and granule footprints are approximated by boxes in lon/lat,
+extended to polar caps when they reach a pole. The boxes are only a
+prefilter: the collectors still compute the exact coverage.
+"""
+
+import logging
+
+import numpy as np
+from pyproj import Proj
+
+from trollduction.collectors.region_collector import get_granule_swath
+
+LOG = logging.getLogger(__name__)
+
+# Latitude from which a footprint is considered to reach the pole
+POLAR_LATITUDE = 80
+
+
+class LonLatBox(object):
+
+    """Box in lon/lat around the points *lons* and *lats*, enlarged by
+    *margin* degrees. The box is a polar cap if *north_pole* or
+    *south_pole* is True.
+    """
+
+    def __init__(self, lons, lats, margin=2.0,
+                 north_pole=False, south_pole=False):
+        self.lat_min = max(np.min(lats) - margin, -90)
+        self.lat_max = min(np.max(lats) + margin, 90)
+        if north_pole:
+            self.lat_max = 90
+        if south_pole:
+            self.lat_min = -90
+        if north_pole or south_pole:
+            self.lon_intervals = [(-180, 180)]
+        else:
+            self.lon_intervals = get_lon_intervals(lons, margin)
+
+    def intersects(self, other):
+        """Check if the box intersects the *other* box.
+        """
+        if self.lat_min > other.lat_max or other.lat_min > self.lat_max:
+            return False
+        for start, end in self.lon_intervals:
+            for other_start, other_end in other.lon_intervals:
+                if start <= other_end and other_start <= end:
+                    return True
+        return False
+
+    def __repr__(self):
+        return "LonLatBox(%.1f, %.1f, %s)" % (self.lat_min, self.lat_max,
+                                              str(self.lon_intervals))
+
+
+def get_lon_intervals(lons, margin=0):
+    """Get the smallest longitude intervals containing *lons*, split at the
+    dateline, and enlarged by *margin* degrees.
+    """
+    lons = np.unique((np.asanyarray(lons).ravel() + 180) % 360 - 180)
+    if lons.size == 0:
+        return []
+    gaps = np.diff(np.concatenate((lons, [lons[0] + 360])))
+    idx = np.argmax(gaps)
+    if gaps[idx] <= 2 * margin:
+        return [(-180, 180)]
+    start = (lons[(idx + 1) % lons.size] - margin + 180) % 360 - 180
+    end = (lons[idx] + margin + 180) % 360 - 180
+    if start <= end:
+        return [(start, end)]
+    return [(start, 180), (-180, end)]
+
+
+def get_region_box(region, margin=2.0):
+    """Get the lon/lat box of the *region* area definition.
+    """
+    lons, lats = region.get_boundary_lonlats()
+    lons = np.concatenate((lons.side1, lons.side2, lons.side3, lons.side4))
+    lats = np.concatenate((lats.side1, lats.side2, lats.side3, lats.side4))
+    valid = np.isfinite(lons) & np.isfinite(lats) & (np.abs(lats) <= 90)
+
+    proj = Proj(**region.proj_dict)
+    x_min, y_min, x_max, y_max = region.area_extent
+    poles = []
+    for lat in [90, -90]:
+        xcoord, ycoord = proj(0, lat)
+        poles.append(x_min <= xcoord <= x_max and y_min <= ycoord <= y_max)
+    return LonLatBox(lons[valid], lats[valid], margin,
+                     north_pole=poles[0], south_pole=poles[1])
+
+
+def get_granule_box(metadata, margin=2.0):
+    """Get the lon/lat box of the footprint of the granule described by
+    *metadata*.
+    """
+    start_time = metadata["start_time"]
+    sensor = metadata["sensor"]
+    if isinstance(sensor, (list, tuple)):
+        sensor = sensor[0]
+    lons, lats = get_granule_swath(metadata["platform_name"], sensor,
+                                   start_time,
+                                   metadata["end_time"] - start_time)
+    return LonLatBox(lons, lats, margin,
+                     north_pole=np.max(lats) > POLAR_LATITUDE,
+                     south_pole=np.min(lats) < -POLAR_LATITUDE)
+
+
+class RegionIndex(object):
+
+    """Index of the lon/lat boxes of the *regions*.
+    """
+
+    def __init__(self, regions, margin=2.0):
+        self.margin = margin
+        self.boxes = {}
+        for region in regions:
+            self.boxes[region.area_id] = get_region_box(region, margin)
+            LOG.debug("Box of %s: %s", region.area_id,
+                      str(self.boxes[region.area_id]))
+
+    def select(self, collectors, metadata):
+        """Select the *collectors* that may need the granule of *metadata*:
+        those whose region box intersects the footprint of the granule, and
+        those already collecting. All of them are selected if the footprint
+        can't be computed.
+        """
+        try:
+            box = get_granule_box(metadata, self.margin)
+        except Exception:
+            LOG.debug("Can't compute the granule footprint, "
+                      "using all the collectors", exc_info=True)
+            return collectors
+
+        selected = [collector for collector in collectors
+                    if collector.granules or
+                    self.boxes[collector.region.area_id].intersects(box)]
+        LOG.debug("Granule dispatched to %d collectors out of %d",
+                  len(selected), len(collectors))
+        return selected
@@ -27,9 +27,14 @@
 
 from pyinotify import (ProcessEvent, Notifier, WatchManager,
                        IN_CLOSE_WRITE, IN_MOVED_TO)
+import heapq
 import logging
+import Queue
+import re
+from collections import OrderedDict
+import copy
 from datetime import datetime
-from fnmatch import fnmatch
+from fnmatch import fnmatch, translate
 import os.path
 from posttroll.subscriber import NSSubscriber
 
@@ -44,6 +49,45 @@ def total_seconds(tdef):
              (tdef.seconds + tdef.days * 24 * 3600) * 10 ** 6) / 10.0 ** 6)
 
 
+class PatternMatcher(object):
+
+    """Match paths against the glob *patterns*.
+
+    The patterns are compiled into one regular expression per directory, so
+    that a path is only matched against the patterns of its directory.
+    Patterns with wildcards in their directory are matched as a whole.
+    """
+
+    def __init__(self, patterns):
+        by_dir = OrderedDict()
+        self.glob_patterns = []
+        for pattern in patterns:
+            dirname, basename = os.path.split(pattern)
+            translations = by_dir.setdefault(dirname, [])
+            if re.search(r"[*?[]", dirname):
+                self.glob_patterns.append(pattern)
+            else:
+                translations.append(translate(basename))
+        self.dirs = list(by_dir.keys())
+        self.regexes = dict((dirname, re.compile("|".join(translations)))
+                            for dirname, translations in by_dir.items()
+                            if translations)
+
+    def match(self, path):
+        """Check if *path* matches one of the patterns.
+        """
+        dirname, basename = os.path.split(path)
+        try:
+            if self.regexes[dirname].match(basename):
+                return True
+        except KeyError:
+            pass
+        for pattern in self.glob_patterns:
+            if fnmatch(path, pattern):
+                return True
+        return False
+
+
 class Trigger(object):
 
     """Abstract trigger class.
@@ -53,6 +97,15 @@ class Trigger(object):
         self.collectors = collectors
         self.terminator = terminator
         self.publish_topic = publish_topic
+        self.region_index = None
+
+    def index_regions(self):
+        """Dispatch the granules only to the collectors of the regions they
+        can cover.
+        """
+        from trollduction.collectors.region_index import RegionIndex
+        self.region_index = RegionIndex([collector.region
+                                         for collector in self.collectors])
 
     def _do(self, metadata):
         """Execute the collectors and terminator.
@@ -60,78 +113,234 @@ class Trigger(object):
         if not metadata:
             LOG.warning("No metadata")
             return
-        for collector in self.collectors:
+        collectors = self.collectors
+        if self.region_index is not None:
+            collectors = self.region_index.select(collectors, metadata)
+        for collector in collectors:
             res = collector(metadata.copy())
+            self._collected(collector)
             if res:
                 return self.terminator(res, publish_topic=self.publish_topic)
 
+    def _collected(self, collector):
+        """Called after *collector* has been given a granule.
+        """
+        pass
+
+
+from threading import Thread, Event, Condition, Lock
+
+
+class TimeoutScheduler(object):
+
+    """Handle the timeouts of the collectors of several triggers with a
+    single thread.
+
+    The timeouts are kept in a heap. Entries are not removed when the
+    collectors adjust or clear their timeouts, but skipped when they reach
+    the top of the heap and don't match the timeout of their collector
+    anymore.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._scheduled = {}
+        self._triggers = set()
+        self._counter = 0
+        self._cond = Condition()
+        self._thread = None
+
+    def register(self, trigger):
+        """Handle the timeouts of *trigger*, starting the thread if needed.
+        """
+        with self._cond:
+            self._triggers.add(trigger)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self.run)
+                self._thread.setDaemon(True)
+                self._thread.start()
+        for collector in trigger.collectors:
+            self.schedule(trigger, collector)
+
+    def unregister(self, trigger):
+        """Stop handling the timeouts of *trigger*. Return the thread if it
+        is stopping, as no trigger is left.
+        """
+        with self._cond:
+            self._triggers.discard(trigger)
+            self._cond.notify()
+            if not self._triggers:
+                return self._thread
+
+    def is_registered(self, trigger):
+        """Check if the timeouts of *trigger* are handled.
+        """
+        with self._cond:
+            return (trigger in self._triggers and
+                    self._thread is not None and self._thread.is_alive())
+
+    def schedule(self, trigger, collector):
+        """Schedule the current timeout of *collector*, if it has one.
+        """
+        timeout = collector.timeout
+        if timeout is None:
+            return
+        with self._cond:
+            if self._scheduled.get(collector) == timeout:
+                return
+            self._scheduled[collector] = timeout
+            self._counter += 1
+            heapq.heappush(self._heap,
+                           (timeout, self._counter, trigger, collector))
+            if self._heap[0][1] == self._counter:
+                self._cond.notify()
+
+    def _is_valid(self, entry):
+        """Check if the heap *entry* is still the timeout of its collector.
+        """
+        timeout, _, trigger, collector = entry
+        return (trigger in self._triggers and
+                self._scheduled.get(collector) == timeout and
+                collector.timeout == timeout)
+
+    def run(self):
+        """Wait for the next timeout, and have its trigger handle it.
+        """
+        while True:
+            with self._cond:
+                if not self._triggers:
+                    break
+                while self._heap and not self._is_valid(self._heap[0]):
+                    entry = heapq.heappop(self._heap)
+                    if self._scheduled.get(entry[3]) == entry[0]:
+                        del self._scheduled[entry[3]]
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = total_seconds(self._heap[0][0] - datetime.utcnow())
+                if delay > 0:
+                    LOG.debug("Waiting %s seconds until timeout", str(delay))
+                    self._cond.wait(delay)
+                    continue
+                timeout, _, trigger, collector = heapq.heappop(self._heap)
+                del self._scheduled[collector]
+            try:
+                trigger.handle_timeout(collector)
+            except Exception:
+                LOG.exception("Could not handle the timeout of %s",
+                              str(collector))
+
 
-from threading import Thread, Event
+SCHEDULER = TimeoutScheduler()
 
 
-class FileTrigger(Trigger, Thread):
+class FileTrigger(Trigger):
 
     """File trigger, acting upon inotify events.
+
+    The timeouts of the collectors are handled by *scheduler*, shared by all
+    the triggers by default.
     """
 
-    def __init__(self, collectors, terminator, decoder, publish_topic=None):
-        Thread.__init__(self)
+    def __init__(self, collectors, terminator, decoder, publish_topic=None,
+                 scheduler=None):
         Trigger.__init__(self, collectors, terminator,
                          publish_topic=publish_topic)
         self.decoder = decoder
-        self._running = True
-        self.new_file = Event()
+        self.scheduler = scheduler or SCHEDULER
+        self._lock = Lock()
+        self._thread = None
+        self._touched = None
 
     def _do(self, pathname):
         mda = self.decoder(pathname)
         LOG.debug("mda: %s", str(mda))
         Trigger._do(self, mda)
 
+    def _collected(self, collector):
+        if self._touched is not None:
+            self._touched.add(collector)
+        else:
+            self.scheduler.schedule(self, collector)
+
     def add_file(self, pathname):
         """On arrival of a file.
         """
-        self._do(pathname)
-        self.new_file.set()
+        with self._lock:
+            self._do(pathname)
 
-    def run(self):
-        """The timeouts are handled here.
-        """
-        # The wait for new files is handled through the event mechanism of the
-        # threading module:
-        # - first a new file arrives, and an event is triggered
-        # - then the new timeouts are computed
-        # - if a timeout occurs during the wait, the wait is interrupted and
-        #   the timeout is handled.
-        while self._running:
-            timeouts = [(collector, collector.timeout)
-                        for collector in self.collectors
-                        if collector.timeout is not None]
-
-            if timeouts:
-                next_timeout = min(timeouts, key=(lambda(x): x[1]))
-                if next_timeout[1] and (next_timeout[1] < datetime.utcnow()):
-                    LOG.warning("Timeout detected, terminating collector")
-                    LOG.debug("Area: %s, timeout: %s",
-                              next_timeout[0].region,
-                              str(next_timeout[1]))
-                    self.terminator(next_timeout[0].finish(),
-                                    publish_topic=self.publish_topic)
-                else:
-                    LOG.debug("Waiting %s seconds until timeout",
-                              str(total_seconds(next_timeout[1] -
-                                                datetime.utcnow())))
-                    self.new_file.wait(total_seconds(next_timeout[1] -
-                                                     datetime.utcnow()))
-                    self.new_file.clear()
-            else:
-                self.new_file.wait()
-                self.new_file.clear()
+    def add_files(self, pathnames):
+        """On arrival of several files at once. The timeouts of the
+        collectors are rescheduled once, after all the files are added.
+        """
+        with self._lock:
+            self._touched = set()
+            try:
+                for pathname in pathnames:
+                    self._do(pathname)
+            finally:
+                touched, self._touched = self._touched, None
+                for collector in touched:
+                    self.scheduler.schedule(self, collector)
+
+    def get_state(self):
+        """Get a copy of the collections in progress, by area id.
+        """
+        with self._lock:
+            return copy.deepcopy(dict((collector.region.area_id,
+                                       collector.collections)
+                                      for collector in self.collectors))
+
+    def set_state(self, state):
+        """Restore the collections in progress from *state*, as given by
+        *get_state*.
+        """
+        with self._lock:
+            for collector in self.collectors:
+                collections = state.get(collector.region.area_id)
+                if collections:
+                    LOG.info("Restoring %d collections for %s",
+                             len(collections), collector.region.area_id)
+                    collector.restore(collections)
+                self.scheduler.schedule(self, collector)
+
+    def handle_timeout(self, collector):
+        """Terminate *collector* if its timeout is reached.
+        """
+        with self._lock:
+            if (collector.timeout is None or
+                    collector.timeout > datetime.utcnow()):
+                return
+            LOG.warning("Timeout detected, terminating collector")
+            LOG.debug("Area: %s, timeout: %s",
+                      collector.region,
+                      str(collector.timeout))
+            self.terminator(collector.finish(),
+                            publish_topic=self.publish_topic)
+        # the collector may have other collections in progress
+        self.scheduler.schedule(self, collector)
+
+    def start(self):
+        """Start handling the timeouts.
+        """
+        self.scheduler.register(self)
+
+    def is_alive(self):
+        """Check if the timeouts are being handled.
+        """
+        return self.scheduler.is_registered(self)
 
     def stop(self):
         """Stopping everything.
         """
-        self._running = False
-        self.new_file.set()
+        self._thread = self.scheduler.unregister(self)
+
+    def join(self, timeout=None):
+        """Wait for the timeout thread to finish, if this trigger was the
+        last one using it.
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
 
 
 class InotifyTrigger(ProcessEvent, FileTrigger):
@@ -144,29 +353,25 @@ class InotifyTrigger(ProcessEvent, FileTrigger):
         ProcessEvent.__init__(self)
         FileTrigger.__init__(self, collectors, terminator, decoder,
                              publish_topic=publish_topic)
-        self.input_dirs = []
-        for pattern in patterns:
-            self.input_dirs.append(os.path.dirname(pattern))
+        self.matcher = PatternMatcher(patterns)
+        self.input_dirs = self.matcher.dirs
         self.patterns = patterns
-        self.new_file = Event()
 
     def process_IN_CLOSE_WRITE(self, event):
         """On closing a file.
         """
-        for pattern in self.patterns:
-            if fnmatch(event.src_path, pattern):
-                LOG.debug("New file detected (close write): %s",
-                          event.pathname)
-                self.add_file(event.pathname)
+        if self.matcher.match(event.pathname):
+            LOG.debug("New file detected (close write): %s",
+                      event.pathname)
+            self.add_file(event.pathname)
 
     def process_IN_MOVED_TO(self, event):
         """On moving a file into the directory.
         """
-        for pattern in self.patterns:
-            if fnmatch(event.src_path, pattern):
-                LOG.debug("New file detected (moved to): %s",
-                          event.pathname)
-                self.add_file(event.pathname)
+        if self.matcher.match(event.pathname):
+            LOG.debug("New file detected (moved to): %s",
+                      event.pathname)
+            self.add_file(event.pathname)
 
     def loop(self):
         """The main function.
@@ -208,25 +413,21 @@ try:
             FileSystemEventHandler.__init__(self)
             FileTrigger.__init__(self, collectors, terminator, decoder,
                                  publish_topic=publish_topic)
-            self.input_dirs = []
-            for pattern in patterns:
-                self.input_dirs.append(os.path.dirname(pattern))
+            self.matcher = PatternMatcher(patterns)
+            self.input_dirs = self.matcher.dirs
             self.patterns = patterns
 
-            self.new_file = Event()
             self.observer = self.cases.get(observer_class_name, Observer)()
 
         def on_created(self, event):
             """On creating a file.
             """
             try:
-                for pattern in self.patterns:
-                    if fnmatch(event.src_path, pattern):
-                        LOG.debug("New file detected (created): %s",
-                                  event.src_path)
-                        self.add_file(event.src_path)
-                        LOG.debug("Done adding")
-                        return
+                if self.matcher.match(event.src_path):
+                    LOG.debug("New file detected (created): %s",
+                              event.src_path)
+                    self.add_file(event.src_path)
+                    LOG.debug("Done adding")
             except Exception as e:
                 LOG.exception(
                     "Something wrong happened in the event processing: %s",
@@ -259,10 +460,10 @@ try:
 
         def __init__(self, patterns, observer_class_name="Observer"):
             FileSystemEventHandler.__init__(self)
-            self.input_dirs = []
-            for pattern in patterns:
-                self.input_dirs.append(os.path.dirname(pattern))
-                LOG.debug("watching " + str(os.path.dirname(pattern)))
+            self.matcher = PatternMatcher(patterns)
+            self.input_dirs = self.matcher.dirs
+            for idir in self.input_dirs:
+                LOG.debug("watching " + str(idir))
             self.patterns = patterns
 
             self.new_file = Event()
@@ -272,13 +473,11 @@ try:
             """On creating a file.
             """
             try:
-                for pattern in self.patterns:
-                    if fnmatch(event.src_path, pattern):
-                        LOG.debug(
-                            "New file detected (created): " + event.src_path)
-                        self.process(event.src_path)
-                        LOG.debug("Done processing file")
-                        return
+                if self.matcher.match(event.src_path):
+                    LOG.debug(
+                        "New file detected (created): " + event.src_path)
+                    self.process(event.src_path)
+                    LOG.debug("Done processing file")
             except:
                 LOG.exception(
                     "Something wrong happened in the event processing!")
@@ -334,16 +533,27 @@ except ImportError:
 class AbstractMessageProcessor(Thread):
 
     """Process Messages
+
+    If *max_batch* is more than 1, the messages are received in a separate
+    thread, and all those ready (up to *max_batch*) are processed together
+    with *process_batch*.
     """
 
-    def __init__(self, services, topics):
+    def __init__(self, services, topics, max_batch=1):
         Thread.__init__(self)
         self.nssub = NSSubscriber(services, topics, True)
         self.sub = None
         self.loop = True
+        self.max_batch = max_batch
+        self._queue = Queue.Queue()
+        self._reader = None
 
     def start(self):
         self.sub = self.nssub.start()
+        if self.max_batch > 1:
+            self._reader = Thread(target=self._read)
+            self._reader.setDaemon(True)
+            self._reader.start()
         Thread.start(self)
 
     def process(self, msg):
@@ -352,8 +562,14 @@ class AbstractMessageProcessor(Thread):
         del msg
         raise NotImplementedError("process is not implemented!")
 
-    def run(self):
-        """Run the trigger.
+    def process_batch(self, msgs):
+        """Process the messages *msgs*, received together.
+        """
+        for msg in msgs:
+            self.process(msg)
+
+    def _read(self):
+        """Queue the received messages, and None when done.
         """
         try:
             for msg in self.sub.recv(2):
@@ -361,7 +577,47 @@ class AbstractMessageProcessor(Thread):
                     break
                 if msg is None:
                     continue
-                self.process(msg)
+                self._queue.put(msg)
+        finally:
+            self._queue.put(None)
+
+    def _get_batch(self):
+        """Get the next batch of messages, waiting for the first one. The
+        batch ends with None if the reception is finished.
+        """
+        msgs = [self._queue.get(True, 2)]
+        while msgs[-1] is not None and len(msgs) < self.max_batch:
+            try:
+                msgs.append(self._queue.get_nowait())
+            except Queue.Empty:
+                break
+        return msgs
+
+    def run(self):
+        """Run the trigger.
+        """
+        try:
+            if self._reader is None:
+                for msg in self.sub.recv(2):
+                    if not self.loop:
+                        break
+                    if msg is None:
+                        continue
+                    self.process(msg)
+                return
+            while self.loop:
+                try:
+                    msgs = self._get_batch()
+                except Queue.Empty:
+                    continue
+                done = msgs[-1] is None
+                if done:
+                    msgs.pop()
+                if msgs:
+                    LOG.debug("Processing %d messages", len(msgs))
+                    self.process_batch(msgs)
+                if done:
+                    break
         finally:
             self.stop()
 
@@ -374,13 +630,15 @@ class AbstractMessageProcessor(Thread):
 
 class PostTrollTrigger(FileTrigger):
 
-    """Get posttroll messages.
+    """Get posttroll messages, up to *max_batch* at once.
     """
 
     def __init__(self, collectors, terminator, services, topics,
-                 publish_topic=None):
-        self.msgproc = AbstractMessageProcessor(services, topics)
+                 publish_topic=None, max_batch=1):
+        self.msgproc = AbstractMessageProcessor(services, topics,
+                                                max_batch=max_batch)
         self.msgproc.process = self.add_file
+        self.msgproc.process_batch = self.add_files
         FileTrigger.__init__(self, collectors, terminator, self.decode_message,
                              publish_topic=publish_topic)
 
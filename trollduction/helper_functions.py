@@ -304,3 +304,54 @@ def overlapping_timeinterval(start_end_times, timelist):
             return tstart, tend
 
     return False
+
+
+def get_grid_offset(parent, child, tolerance=1e-3):
+    """Get the (row, column) offset of the *child* area definition in the
+    pixel grid of the *parent* area definition, or None if *child* is not a
+    grid-aligned sub-window of *parent*.
+    """
+    try:
+        if parent.proj_dict != child.proj_dict:
+            return None
+        pixel_size_x, pixel_size_y = parent.pixel_size_x, parent.pixel_size_y
+    except AttributeError:
+        return None
+    if (abs(child.pixel_size_x - pixel_size_x) > tolerance * pixel_size_x or
+            abs(child.pixel_size_y - pixel_size_y) >
+            tolerance * pixel_size_y):
+        return None
+
+    col = (child.area_extent[0] - parent.area_extent[0]) / pixel_size_x
+    row = (parent.area_extent[3] - child.area_extent[3]) / pixel_size_y
+    if (abs(col - round(col)) > tolerance or
+            abs(row - round(row)) > tolerance):
+        return None
+    row, col = int(round(row)), int(round(col))
+    if (row < 0 or col < 0 or row + child.y_size > parent.y_size or
+            col + child.x_size > parent.x_size):
+        return None
+    return row, col
+
+
+def get_downsampling_ratio(parent, child, tolerance=1e-3):
+    """Get the integer ratio between the sizes of the *parent* and *child*
+    area definitions if they have the same projection and extent, or None.
+    """
+    try:
+        if parent.proj_dict != child.proj_dict:
+            return None
+        pixel_size_x, pixel_size_y = child.pixel_size_x, child.pixel_size_y
+    except AttributeError:
+        return None
+    for idx, pixel_size in enumerate([pixel_size_x, pixel_size_y,
+                                      pixel_size_x, pixel_size_y]):
+        if (abs(parent.area_extent[idx] - child.area_extent[idx]) >
+                tolerance * pixel_size):
+            return None
+    if parent.x_size % child.x_size or parent.y_size % child.y_size:
+        return None
+    ratio = parent.x_size // child.x_size
+    if ratio < 2 or parent.y_size // child.y_size != ratio:
+        return None
+    return ratio
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Row-streamed image writing.
+
+The images are converted to 8 bits and encoded one block of rows at the
+time, so that the complete 8 bit image is never held in memory.
+"""
+
+import logging
+
+import numpy as np
+
+try:
+    from osgeo import gdal, osr
+except ImportError:
+    gdal = None
+
+try:
+    import png
+except ImportError:
+    png = None
+
+LOGGER = logging.getLogger(__name__)
+
+MODES = ["L", "LA", "RGB", "RGBA", "P", "PA"]
+
+
+def can_stream(img, fformat):
+    """Check if *img* can be streamed to the *fformat* file format.
+    """
+    if getattr(img, "mode", None) not in MODES:
+        return False
+    fformat = fformat.lower()
+    if fformat in ["tif", "tiff"]:
+        return gdal is not None
+    if fformat == "png":
+        return png is not None
+    return False
+
+
+def get_band_count(img):
+    """Get the number of bands to write for *img*, alpha included.
+    """
+    if img.fill_value is None and not img.mode.endswith("A"):
+        return len(img.channels) + 1
+    return len(img.channels)
+
+
+def finalize_rows(img, start, stop):
+    """Get the bands for rows *start* to *stop* of *img* as 8 bit arrays.
+
+    This follows the conventions of the mpop images: masked pixels get the
+    fill value if there is one, otherwise they are made transparent through
+    an alpha band.
+    """
+    blocks = [chn[start:stop] for chn in img.channels]
+    bands = [(np.ma.getdata(block).clip(0, 1) * 255).astype(np.uint8)
+             for block in blocks]
+
+    if img.fill_value is not None:
+        for band, block, fill in zip(bands, blocks, img.fill_value):
+            band[np.ma.getmaskarray(block)] = int(fill * 255)
+        return bands
+
+    if img.mode.endswith("A"):
+        alpha = bands.pop()
+        alpha_mask = np.ma.getmaskarray(blocks.pop())
+    else:
+        alpha = np.empty_like(bands[0])
+        alpha.fill(255)
+        alpha_mask = False
+
+    # pixels are transparent only if all the channels are masked
+    mask = np.ma.getmaskarray(blocks[0]).copy()
+    for block in blocks[1:]:
+        mask &= np.ma.getmaskarray(block)
+    alpha[mask | alpha_mask] = 0
+    bands.append(alpha)
+    return bands
+
+
+def _geotiff_stream_save(img, filename, rows, compression, tiled, blocksize):
+    """Save *img* to a tiled or striped geotiff, *rows* lines at the time.
+    """
+    height, width = img.channels[0].shape
+    nbands = get_band_count(img)
+
+    g_opts = []
+    if compression:
+        g_opts.append("COMPRESS=DEFLATE")
+        g_opts.append("ZLEVEL=" + str(compression))
+    if tiled:
+        g_opts.append("TILED=YES")
+        g_opts.append("BLOCKXSIZE=" + str(blocksize))
+        g_opts.append("BLOCKYSIZE=" + str(blocksize))
+        # write whole rows of tiles
+        rows = max(blocksize, rows - rows % blocksize)
+    else:
+        g_opts.append("BLOCKYSIZE=" + str(rows))
+    if nbands in [2, 4]:
+        g_opts.append("ALPHA=YES")
+
+    raster = gdal.GetDriverByName("GTiff")
+    dst_ds = raster.Create(filename, width, height, nbands, gdal.GDT_Byte,
+                           g_opts)
+
+    area = img.area
+    try:
+        dst_ds.SetGeoTransform([area.area_extent[0], area.pixel_size_x, 0,
+                                area.area_extent[3], 0, -area.pixel_size_y])
+        srs = osr.SpatialReference()
+        srs.ImportFromProj4(area.proj4_string)
+        srs.SetProjCS(area.proj_id)
+        try:
+            srs.SetWellKnownGeogCS(area.proj_dict['ellps'])
+        except KeyError:
+            pass
+        dst_ds.SetProjection(srs.ExportToWkt())
+    except AttributeError:
+        LOGGER.exception("Could not load geographic data, invalid area")
+
+    if img.fill_value is not None:
+        for idx, fill in enumerate(img.fill_value):
+            dst_ds.GetRasterBand(idx + 1).SetNoDataValue(int(fill * 255))
+
+    for start in range(0, height, rows):
+        bands = finalize_rows(img, start, start + rows)
+        for idx, band in enumerate(bands):
+            dst_ds.GetRasterBand(idx + 1).WriteArray(band, 0, start)
+        del bands
+
+    tags = dict(getattr(img, "tags", {}))
+    try:
+        tags['TIFFTAG_DATETIME'] = img.time_slot.strftime("%Y:%m:%d %H:%M:%S")
+    except AttributeError:
+        pass
+    dst_ds.SetMetadata(tags, '')
+
+    # Close the dataset
+    dst_ds = None
+
+
+def _png_stream_save(img, filename, rows, compression):
+    """Save *img* to png, encoding *rows* lines at the time.
+    """
+    height, width = img.channels[0].shape
+    nbands = get_band_count(img)
+
+    def row_generator():
+        """Generate the interleaved rows of the image.
+        """
+        for start in range(0, height, rows):
+            bands = finalize_rows(img, start, start + rows)
+            block = np.dstack(bands).reshape((bands[0].shape[0],
+                                              width * nbands))
+            del bands
+            for row in block:
+                yield row
+
+    writer = png.Writer(width, height,
+                        greyscale=(nbands < 3),
+                        alpha=(nbands in [2, 4]),
+                        bitdepth=8,
+                        compression=compression)
+    with open(filename, "wb") as fd_:
+        writer.write(fd_, row_generator())
+
+
+def stream_save(img, filename, fformat, rows=512, compression=6,
+                tiled=False, blocksize=256):
+    """Save *img* to *filename* in *fformat*, converting and encoding *rows*
+    lines at the time. For geotiffs, *tiled* gives tiles of *blocksize*
+    pixels instead of stripes.
+    """
+    if img.mode == "P":
+        img.convert("RGB")
+    elif img.mode == "PA":
+        img.convert("RGBA")
+
+    LOGGER.debug("Streaming %s to %s, %d rows at the time",
+                 img.mode, filename, rows)
+    if fformat.lower() in ["tif", "tiff"]:
+        _geotiff_stream_save(img, filename, rows, int(compression),
+                             tiled, blocksize)
+    elif fformat.lower() == "png":
+        _png_stream_save(img, filename, rows, int(compression))
+    else:
+        raise ValueError("Can't stream to %s format" % fformat)
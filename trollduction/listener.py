@@ -26,25 +26,147 @@
 from posttroll.subscriber import NSSubscriber
 from Queue import Queue
 from threading import Thread
+from datetime import datetime
+from fnmatch import fnmatch
+import heapq
+import itertools
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+EPOCH = datetime(1970, 1, 1)
+
+
+def get_data_time(msg):
+    '''Get the time of the data announced in *msg*, or None.
+    '''
+    try:
+        data_time = msg.data.get("start_time") or msg.data.get("nominal_time")
+    except AttributeError:
+        return None
+    if isinstance(data_time, datetime):
+        return data_time
+    return None
+
+
+class PriorityMessageQueue(Queue):
+
+    '''Queue giving out the messages by priority, then the most recent data
+    first.
+
+    *priorities* is a list of (subject pattern, priority) pairs, the first
+    matching pattern giving the priority of a message. Lower values are
+    served first, and unmatched messages get 0. Messages for data older
+    than *max_age* (a timedelta) are dropped if *stale_policy* is "drop",
+    or served after all the fresh ones if it is "defer".
+    '''
+
+    def __init__(self, priorities=None, max_age=None, stale_policy="defer",
+                 maxsize=0):
+        self.priorities = priorities or []
+        self.max_age = max_age
+        self.stale_policy = stale_policy
+        self._counter = itertools.count()
+        Queue.__init__(self, maxsize)
+
+    def get_priority(self, msg):
+        '''Get the priority of *msg* from its subject.
+        '''
+        for pattern, priority in self.priorities:
+            if fnmatch(msg.subject, pattern):
+                return priority
+        return 0
+
+    def _is_stale(self, data_time):
+        '''Check if data from *data_time* is past the maximum age.
+        '''
+        return (self.max_age is not None and data_time is not None and
+                datetime.utcnow() - data_time > self.max_age)
+
+    def _prune(self):
+        '''Drop or defer the messages that became stale while waiting.
+        '''
+        if self.max_age is None:
+            return
+        changed = False
+        for entry in self.queue[:]:
+            if entry[0] or not self._is_stale(entry[-2]):
+                continue
+            changed = True
+            msg = entry[-1]
+            if self.stale_policy == "drop":
+                logger.warning("Dropping stale message %s for data from %s",
+                               msg.subject, str(entry[-2]))
+                self.queue.remove(entry)
+                self.unfinished_tasks -= 1
+                if self.unfinished_tasks == 0:
+                    self.all_tasks_done.notify_all()
+            else:
+                logger.info("Deferring stale message %s for data from %s",
+                            msg.subject, str(entry[-2]))
+                entry[0] = True
+        if changed:
+            heapq.heapify(self.queue)
+
+    # The methods below override the Queue ones, and are called with the
+    # queue mutex held.
+
+    def _init(self, maxsize):
+        self.queue = []
+
+    def _qsize(self, len=len):
+        self._prune()
+        return len(self.queue)
+
+    def _put(self, msg):
+        data_time = get_data_time(msg)
+        if data_time is None:
+            age_key = -time.time()
+        else:
+            age_key = -(data_time - EPOCH).total_seconds()
+        # staleness is checked when pruning
+        heapq.heappush(self.queue, [False,
+                                    self.get_priority(msg),
+                                    age_key,
+                                    next(self._counter),
+                                    time.time(),
+                                    data_time,
+                                    msg])
+
+    def _get(self):
+        entry = heapq.heappop(self.queue)
+        msg = entry[-1]
+        logger.debug("Message %s waited %.1f s in the queue, %d left",
+                     msg.subject, time.time() - entry[4], len(self.queue))
+        if entry[0]:
+            logger.warning("Processing stale message %s for data from %s",
+                           msg.subject, str(entry[-2]))
+        return msg
+
 
 class ListenerContainer(object):
 
     '''Container for listener instance
     '''
 
-    def __init__(self, topics=None):
+    def __init__(self, topics=None, priorities=None, max_age=None,
+                 stale_policy="defer"):
         self.listener = None
         self.queue = None
         self.thread = None
+        self.priorities = priorities
+        self.max_age = max_age
+        self.stale_policy = stale_policy
 
         if topics is not None:
             # Create queue for the messages
-            self.queue = Queue()  # Pipe()
+            if priorities is None and max_age is None:
+                self.queue = Queue()  # Pipe()
+            else:
+                self.queue = PriorityMessageQueue(priorities=priorities,
+                                                  max_age=max_age,
+                                                  stale_policy=stale_policy)
 
             # Create a Listener instance
             self.listener = Listener(topics=topics, queue=self.queue)
@@ -53,13 +175,18 @@ class ListenerContainer(object):
             self.thread.setDaemon(True)
             self.thread.start()
 
-    def restart_listener(self, topics):
-        '''Restart listener after configuration update.
+    def restart_listener(self, topics, **kwargs):
+        '''Restart listener after configuration update. The queue options
+        are kept unless given in *kwargs*.
         '''
         if self.listener is not None:
             if self.listener.running:
                 self.stop()
-        self.__init__(topics=topics)
+        options = {"priorities": self.priorities,
+                   "max_age": self.max_age,
+                   "stale_policy": self.stale_policy}
+        options.update(kwargs)
+        self.__init__(topics=topics, **options)
 
     def stop(self):
         '''Stop listener.'''
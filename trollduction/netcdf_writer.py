@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Chunked NetCDF4/CF writer for data dumps.
+
+The channels are written one at the time, with the given chunk shape, and
+released as soon as they are on disk. When h5py is available, the file is
+written with it, the chunks being packed and compressed in a pool of threads
+and written directly to the file. Otherwise netCDF4 is used.
+"""
+
+import logging
+import zlib
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from netCDF4 import Dataset, date2num
+from mpop.satout.cfscene import TIME_UNITS, proj2cf
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+LOGGER = logging.getLogger(__name__)
+
+CF_DATA_TYPE = np.int16
+FILL_VALUE = np.iinfo(CF_DATA_TYPE).min
+
+# name of the hdf5 dimension scales that are not netCDF variables
+NC_DIMENSION = "This is a netCDF dimension but not a netCDF variable.%10d"
+
+
+def get_scaling(data):
+    """Get the scale factor and offset packing *data* in 16 bit integers.
+    """
+    if np.ma.count_masked(data) == data.size:
+        return 1, 0
+    chn_max = data.max()
+    chn_min = data.min()
+    scale = (chn_max - chn_min) / (2 ** 16 - 2.0)
+    # Handle the case where all data has the same value.
+    if scale == 0:
+        scale = 1
+    offset = (chn_max + chn_min) / 2.0
+    return scale, offset
+
+
+def pack(data, scaling, dtype):
+    """Convert *data* to *dtype*, packing it with *scaling* if not None.
+    """
+    if scaling is None:
+        return np.ma.filled(data, np.nan).astype(dtype)
+    scale, offset = scaling
+    packed = ((np.ma.getdata(data) - offset) / scale).astype(dtype)
+    packed[np.ma.getmaskarray(data)] = FILL_VALUE
+    return packed
+
+
+def iter_chunks(shape, chunks):
+    """Iterate over the (row, col) offsets of the chunks of an array.
+    """
+    for row in range(0, shape[0], chunks[0]):
+        for col in range(0, shape[1], chunks[1]):
+            yield row, col
+
+
+def compress_chunk(args):
+    """Pack and compress the chunk at *offset* of *data*.
+
+    Edge chunks are padded to the full chunk shape, as hdf5 expects.
+    """
+    data, offset, chunks, scaling, dtype, complevel = args
+    row, col = offset
+    block = pack(data[row:row + chunks[0], col:col + chunks[1]], scaling,
+                 dtype)
+    if block.shape != chunks:
+        padded = np.zeros(chunks, dtype=dtype)
+        padded[:block.shape[0], :block.shape[1]] = block
+        block = padded
+    return offset, zlib.compress(block.tostring(), complevel)
+
+
+class _NetCDF4File(object):
+
+    """Write *filename* with netCDF4, one row of chunks at the time.
+    """
+
+    def __init__(self, filename):
+        self.rootgrp = Dataset(filename, 'w')
+
+    def set_attr(self, key, val):
+        """Set the global attribute *key*.
+        """
+        self.rootgrp.setncattr(key, val)
+
+    def create_dimension(self, name, size, coords=None, attrs=None):
+        """Create the dimension *name*, with *coords* as coordinate variable
+        if given.
+        """
+        self.rootgrp.createDimension(name, size)
+        if coords is not None:
+            self.create_variable(name, coords.dtype, (name, ), attrs=attrs)
+            self.rootgrp.variables[name][:] = coords
+
+    def create_variable(self, name, dtype, dims=(), chunks=None, complevel=0,
+                        fill_value=None, attrs=None, value=None):
+        """Create the variable *name*, and assign *value* if given.
+        """
+        var = self.rootgrp.createVariable(name, dtype, dims,
+                                          zlib=complevel > 0,
+                                          complevel=complevel,
+                                          shuffle=False,
+                                          chunksizes=chunks,
+                                          fill_value=fill_value)
+        var.set_auto_maskandscale(False)
+        for key, val in (attrs or {}).items():
+            var.setncattr(key, val)
+        if value is not None:
+            var.assignValue(value)
+
+    def write(self, name, data, scaling):
+        """Write *data* to the variable *name*.
+        """
+        var = self.rootgrp.variables[name]
+        rows = var.chunking()[0]
+        for row in range(0, data.shape[0], rows):
+            var[row:row + rows, :] = pack(data[row:row + rows], scaling,
+                                          var.dtype)
+
+    def close(self):
+        """Close the file.
+        """
+        self.rootgrp.close()
+
+
+class _H5File(object):
+
+    """Write *filename* with h5py, following the netCDF4 conventions, and
+    compress the chunks with *nthreads* threads.
+    """
+
+    def __init__(self, filename, nthreads):
+        self.h5f = h5py.File(filename, 'w')
+        self.pool = ThreadPool(nthreads)
+        self.dims = {}
+
+    def set_attr(self, key, val):
+        """Set the global attribute *key*.
+        """
+        self.h5f.attrs[key] = val
+
+    def create_dimension(self, name, size, coords=None, attrs=None):
+        """Create the dimension *name*, with *coords* as coordinate variable
+        if given.
+        """
+        if coords is None:
+            dset = self.h5f.create_dataset(name, (size, ), dtype=np.float32)
+            h5py.h5ds.set_scale(dset.id, NC_DIMENSION % size)
+        else:
+            dset = self.h5f.create_dataset(name, data=coords)
+            h5py.h5ds.set_scale(dset.id, name)
+            for key, val in (attrs or {}).items():
+                dset.attrs[key] = val
+        self.dims[name] = dset
+
+    def create_variable(self, name, dtype, dims=(), chunks=None, complevel=0,
+                        fill_value=None, attrs=None, value=None):
+        """Create the variable *name*, and assign *value* if given.
+        """
+        if not dims:
+            dset = self.h5f.create_dataset(
+                name, data=np.array(value or 0, dtype=dtype))
+        else:
+            dset = self.h5f.create_dataset(
+                name, tuple(len(self.dims[dim]) for dim in dims), dtype=dtype,
+                chunks=chunks, compression=(complevel and "gzip") or None,
+                compression_opts=complevel or None, fillvalue=fill_value)
+            for idx, dim in enumerate(dims):
+                dset.dims[idx].attach_scale(self.dims[dim])
+        if fill_value is not None:
+            dset.attrs.create("_FillValue", fill_value, dtype=dtype)
+        for key, val in (attrs or {}).items():
+            dset.attrs[key] = val
+
+    def write(self, name, data, scaling):
+        """Write *data* to the variable *name*, compressing the chunks in
+        the thread pool and writing them as they come.
+        """
+        dset = self.h5f[name]
+        complevel = dset.compression_opts
+        jobs = [(data, offset, dset.chunks, scaling, dset.dtype, complevel)
+                for offset in iter_chunks(data.shape, dset.chunks)]
+        for offset, chunk in self.pool.imap(compress_chunk, jobs):
+            dset.id.write_direct_chunk(offset, chunk)
+
+    def close(self):
+        """Close the file.
+        """
+        self.pool.close()
+        self.pool.join()
+        self.h5f.close()
+
+
+class ChunkedCFWriter(object):
+
+    """Write the loaded channels of *scene* to NetCDF4/CF, with *chunks* as
+    chunk shape and *nthreads* threads for the compression.
+
+    Only references to the channel data are kept, so the scene can be
+    unloaded as soon as the writer is created. They are released once the
+    data is saved.
+    """
+
+    def __init__(self, scene, chunks=(512, 512), nthreads=1):
+        self.info = scene.info.copy()
+        self.info.pop("time", None)
+        self.info["Conventions"] = "CF-1.5"
+        self.info["platform"] = scene.fullname
+        self.info["instrument"] = scene.instrument_name
+        self.time_slot = scene.time_slot
+        self.chunks = tuple(chunks)
+        self.nthreads = nthreads
+
+        self._channels = []
+        for chn in scene.channels:
+            if not chn.is_loaded():
+                continue
+            area = chn.area
+            if area is None or isinstance(area, str):
+                area = scene.area
+            self._channels.append({"name": chn.name,
+                                   "data": chn.data,
+                                   "area": area,
+                                   "units": chn.info.get("units", ""),
+                                   "wavelength_range": chn.wavelength_range,
+                                   "resolution": chn.resolution})
+
+    def __str__(self):
+        return "ChunkedCFWriter(%s)" % ", ".join(chn["name"]
+                                                 for chn in self._channels)
+
+    def _get_chunks(self, shape):
+        """Get the chunk shape for an array of *shape*.
+        """
+        return (min(self.chunks[0], shape[0]), min(self.chunks[1], shape[1]))
+
+    def _define_area(self, ncfile, area, idx, layout, complevel):
+        """Define the dimensions and coordinates for *area*, return the
+        attributes linking the data variables to them.
+        """
+        y_name, x_name = "y" + str(idx), "x" + str(idx)
+        try:
+            proj_dict = area.proj_dict
+        except AttributeError:
+            # swath data, go for lons and lats
+            lons, lats = area.lons, area.lats
+            ncfile.create_dimension(y_name, lons.shape[0])
+            ncfile.create_dimension(x_name, lons.shape[1])
+            for name, data, units in (("lon", lons, "degrees_east"),
+                                      ("lat", lats, "degrees_north")):
+                ncfile.create_variable(
+                    name + str(idx), np.float32, (y_name, x_name),
+                    chunks=self._get_chunks(data.shape), complevel=complevel,
+                    attrs={"units": units,
+                           "standard_name": {"lon": "longitude",
+                                             "lat": "latitude"}[name]})
+                layout.append((name + str(idx), data, None))
+            return {"coordinates": "lat%d lon%d" % (idx, idx)}
+
+        cf_attrs = proj2cf(proj_dict)
+        ncfile.create_variable("grid_mapping_" + str(idx), np.int32,
+                               attrs=cf_attrs)
+
+        x_coords, y_coords = area.proj_x_coords, area.proj_y_coords
+        units = "m"
+        if cf_attrs["grid_mapping_name"] == "geostationary":
+            x_coords = x_coords / float(cf_attrs["perspective_point_height"])
+            y_coords = y_coords / float(cf_attrs["perspective_point_height"])
+            units = "rad"
+        ncfile.create_dimension(y_name, area.y_size, y_coords,
+                                {"units": units,
+                                 "standard_name": "projection_y_coordinate"})
+        ncfile.create_dimension(x_name, area.x_size, x_coords,
+                                {"units": units,
+                                 "standard_name": "projection_x_coordinate"})
+        return {"grid_mapping": "grid_mapping_" + str(idx)}
+
+    def _define(self, ncfile, complevel):
+        """Define the content of the file, write the small variables and
+        return the layout of the data still to write.
+        """
+        for key, val in self.info.items():
+            if isinstance(val, datetime):
+                val = val.isoformat()
+            if isinstance(val, (str, unicode, int, long, float)):
+                ncfile.set_attr(key, val)
+
+        ncfile.create_variable("time", np.float64,
+                               attrs={"units": TIME_UNITS,
+                                      "standard_name": "time"},
+                               value=date2num(self.time_slot, TIME_UNITS))
+
+        layout = []
+        areas = []
+        area_attrs = []
+        for chn in self._channels:
+            for idx, area in enumerate(areas):
+                if area is chn["area"]:
+                    break
+            else:
+                idx = len(areas)
+                areas.append(chn["area"])
+                area_attrs.append(self._define_area(ncfile, chn["area"],
+                                                    idx, layout, complevel))
+
+            scaling = get_scaling(chn["data"])
+            attrs = {"scale_factor": scaling[0],
+                     "add_offset": scaling[1],
+                     "long_name": chn["name"],
+                     "units": chn["units"] or "",
+                     "nominal_wavelength": chn["wavelength_range"][1],
+                     "resolution": chn["resolution"]}
+            attrs.update(area_attrs[idx])
+            ncfile.create_variable("channel_" + chn["name"], CF_DATA_TYPE,
+                                   ("y" + str(idx), "x" + str(idx)),
+                                   chunks=self._get_chunks(chn["data"].shape),
+                                   complevel=complevel,
+                                   fill_value=FILL_VALUE, attrs=attrs)
+            layout.append(("channel_" + chn["name"], chn["data"], scaling))
+        return layout
+
+    def save(self, filename, fformat=None, compression=6, **kwargs):
+        """Save the data to *filename*, with the *compression* level. The
+        data is kept until the file is complete, so that a failed save can be
+        retried, and released then.
+        """
+        del fformat, kwargs
+        if any(chn["data"] is None for chn in self._channels):
+            raise IOError("The data of %s is already saved and released" %
+                          str(self))
+        complevel = int(compression)
+        if h5py is not None and self.nthreads > 1 and complevel > 0:
+            ncfile = _H5File(filename, self.nthreads)
+        else:
+            ncfile = _NetCDF4File(filename)
+
+        try:
+            layout = self._define(ncfile, complevel)
+            for var_name, data, scaling in layout:
+                LOGGER.debug("Writing %s", var_name)
+                ncfile.write(var_name, data, scaling)
+        finally:
+            ncfile.close()
+
+        for chn in self._channels:
+            chn["data"] = None
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cache of the orbit propagators.
+
+The pyorbital *Orbital* objects are created once per platform and TLE
+epoch, and shared by everything in the process. The TLEs are read from a
+local directory if one is set, and again only when a newer file appears
+there. Otherwise they are read as pyorbital does (from the files of the TLES
+environment variable, or from internet), every TLE_MAX_AGE.
+"""
+
+import glob
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+
+from pyorbital.orbital import Orbital
+from trollsched.satpass import tle_names
+
+LOGGER = logging.getLogger(__name__)
+
+# How long the TLEs are used before being read again, without TLE directory
+TLE_MAX_AGE = timedelta(hours=6)
+# How often the TLE directory is checked for new files
+DIR_CHECK_INTERVAL = timedelta(minutes=1)
+# Size of the time buckets of the orbit number lookups, dividing a minute
+ORBIT_NUMBER_BUCKET = 10
+
+_LOCK = Lock()
+_ORBITALS = {}
+_ORBIT_NUMBERS = OrderedDict()
+_MAX_ORBIT_NUMBERS = 1024
+_TLE_DIR = [None]
+_TLE_FILES = [None, None]
+
+
+def set_tle_dir(path):
+    """Read the TLEs from the files in *path*, or as pyorbital does if *path*
+    is None.
+    """
+    with _LOCK:
+        _TLE_DIR[0] = path
+        _TLE_FILES[:] = [None, None]
+        _ORBITALS.clear()
+
+
+def get_tle_files():
+    """Get the files of the TLE directory, newest first, and their
+    modification times.
+    """
+    now = datetime.utcnow()
+    with _LOCK:
+        if _TLE_FILES[1] is not None and now - _TLE_FILES[1] < \
+                DIR_CHECK_INTERVAL:
+            return _TLE_FILES[0]
+        tle_dir = _TLE_DIR[0]
+    files = []
+    for filename in glob.glob(os.path.join(tle_dir, "*")):
+        try:
+            files.append((os.stat(filename).st_mtime, filename))
+        except OSError:
+            continue
+    files.sort(reverse=True)
+    with _LOCK:
+        _TLE_FILES[:] = [files, now]
+    return files
+
+
+def _read_orbital(platform, files):
+    """Read the orbital of *platform* from the newest of the TLE *files*
+    that has it.
+    """
+    name = tle_names.get(platform, platform)
+    for _, filename in files:
+        try:
+            return Orbital(name, tle_file=filename)
+        except (KeyError, IOError, StopIteration):
+            LOGGER.debug("No TLE for %s in %s", platform, filename)
+    raise KeyError("Found no TLE for %s in %s" % (platform, _TLE_DIR[0]))
+
+
+def get_orbital(platform):
+    """Get the orbital of *platform*.
+    """
+    now = datetime.utcnow()
+    if _TLE_DIR[0] is not None:
+        files = get_tle_files()
+        source = files[0] if files else None
+    else:
+        files = None
+        source = None
+
+    with _LOCK:
+        try:
+            orb, orb_source, read_time = _ORBITALS[platform]
+            if files is not None:
+                if orb_source == source:
+                    return orb
+            elif now - read_time < TLE_MAX_AGE:
+                return orb
+        except KeyError:
+            orb = None
+
+    if files is not None:
+        new_orb = _read_orbital(platform, files)
+    else:
+        new_orb = Orbital(tle_names.get(platform, platform))
+    # keep the same object if the TLE didn't change, so that what is
+    # cached for it stays valid
+    if orb is not None and orb.tle.epoch == new_orb.tle.epoch:
+        new_orb = orb
+    else:
+        LOGGER.debug("Read TLE of %s, epoch %s", platform,
+                     str(new_orb.tle.epoch))
+    with _LOCK:
+        _ORBITALS[platform] = new_orb, source, now
+    return new_orb
+
+
+def get_orbit_number(orb, utc_time, tbus_style=False):
+    """Get the orbit number of *orb* at *utc_time*.
+
+    The orbit numbers are kept per ORBIT_NUMBER_BUCKET seconds, for the
+    buckets that don't cross the ascending node.
+    """
+    bucket = utc_time.replace(second=(utc_time.second -
+                                      utc_time.second % ORBIT_NUMBER_BUCKET),
+                              microsecond=0)
+    key = (orb.satellite_name, str(orb.tle.epoch), bucket, tbus_style)
+    with _LOCK:
+        cached = key in _ORBIT_NUMBERS
+        orbit_number = _ORBIT_NUMBERS.get(key)
+    if not cached:
+        first = orb.get_orbit_number(bucket, tbus_style=tbus_style)
+        last = orb.get_orbit_number(
+            bucket + timedelta(seconds=ORBIT_NUMBER_BUCKET),
+            tbus_style=tbus_style)
+        orbit_number = first if first == last else None
+        with _LOCK:
+            _ORBIT_NUMBERS[key] = orbit_number
+            while len(_ORBIT_NUMBERS) > _MAX_ORBIT_NUMBERS:
+                _ORBIT_NUMBERS.popitem(last=False)
+    if orbit_number is None:
+        # the bucket crosses the ascending node
+        return orb.get_orbit_number(utc_time, tbus_style=tbus_style)
+    return orbit_number
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cached overlays.
+
+The overlays (coastlines, borders, or anything pycoast can draw from an
+overlay configuration file) are rendered once per area as transparent RGBA
+layers, kept in memory and optionally on disk, and blended onto the images.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from ConfigParser import ConfigParser
+from threading import Lock
+
+import numpy as np
+from PIL import Image
+
+from mpop import CONFIG_PATH
+from trollduction.area_cache import get_area_def
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_coast_dir():
+    """Get the directory of the shapefiles from the mpop config.
+    """
+    conf = ConfigParser()
+    conf.read(os.path.join(CONFIG_PATH, "mpop.cfg"))
+    return conf.get('shapes', 'dir')
+
+
+def get_resolution(area):
+    """Choose the resolution of the shapefiles for *area*, like mpop does.
+    """
+    x_resolution = ((area.area_extent[2] - area.area_extent[0]) /
+                    area.x_size)
+    y_resolution = ((area.area_extent[3] - area.area_extent[1]) /
+                    area.y_size)
+    res = min(x_resolution, y_resolution)
+
+    if res > 25000:
+        return "c"
+    elif res > 5000:
+        return "l"
+    elif res > 1000:
+        return "i"
+    elif res > 200:
+        return "h"
+    return "f"
+
+
+def render_coasts(area, color, width=0.5):
+    """Render the coastlines and borders of *area* in *color* as an RGBA
+    layer.
+    """
+    from pycoast import ContourWriterAGG
+    cw_ = ContourWriterAGG(get_coast_dir())
+    resolution = get_resolution(area)
+    img = Image.new("RGBA", (area.x_size, area.y_size), (0, 0, 0, 0))
+    cw_.add_coastlines(img, area, outline=color,
+                       resolution=resolution, width=width)
+    cw_.add_borders(img, area, outline=color,
+                    resolution=resolution, width=width)
+    return np.array(img)
+
+
+def render_config(area, config_file):
+    """Render the overlays of *config_file* for *area* as an RGBA layer.
+    """
+    try:
+        import aggdraw
+        from pycoast import ContourWriterAGG
+        cw_ = ContourWriterAGG(get_coast_dir())
+    except ImportError:
+        LOGGER.warning("AGGdraw lib not installed...width and opacity "
+                       "properties are not available for overlays.")
+        from pycoast import ContourWriter
+        cw_ = ContourWriter(get_coast_dir())
+    foreground = cw_.add_overlay_from_config(config_file, area)
+    return np.array(foreground.convert("RGBA"))
+
+
+def blend(img, layer):
+    """Blend the RGBA *layer* onto the channels of *img*.
+
+    As with the mpop overlays, the masks of the image are lost: masked
+    pixels get the fill value, or 0.
+    """
+    alpha = layer[:, :, 3] / 255.0
+    if img.mode == "L":
+        colors = [np.dot(layer[:, :, :3], [0.299, 0.587, 0.114]) / 255.0]
+    else:
+        colors = [layer[:, :, idx] / 255.0 for idx in range(3)]
+
+    fill_value = img.fill_value or [0] * len(img.channels)
+    for idx, color in enumerate(colors):
+        chn = np.ma.filled(img.channels[idx], fill_value[idx]).clip(0, 1)
+        img.channels[idx] = np.ma.array(chn * (1 - alpha) + color * alpha)
+
+
+class OverlayCache(object):
+
+    """Cache of the overlay layers, keeping at most *max_layers* of them in
+    memory, and all of them in *cache_dir* if given.
+    """
+
+    def __init__(self, cache_dir=None, max_layers=16):
+        self.cache_dir = cache_dir
+        self.max_layers = max_layers
+        self._layers = OrderedDict()
+        self._lock = Lock()
+
+    def _get_key(self, area, overlay):
+        """Get the cache key for *overlay* on *area*.
+
+        The key changes with the definition of the area, and with the
+        modification time of overlay configuration files.
+        """
+        if overlay.startswith("#"):
+            spec = overlay.lower()
+        else:
+            spec = (os.path.abspath(overlay), os.stat(overlay).st_mtime)
+        digest = hashlib.md5(str((area.proj4_string,
+                                  tuple(area.area_extent),
+                                  area.x_size, area.y_size,
+                                  spec))).hexdigest()
+        return area.area_id + "_" + digest
+
+    def _load(self, key):
+        """Load the layer *key* from disk, or return None.
+        """
+        if self.cache_dir is None:
+            return None
+        filename = os.path.join(self.cache_dir, key + ".npy")
+        try:
+            return np.load(filename)
+        except (IOError, ValueError):
+            return None
+
+    def _save(self, key, layer):
+        """Save the layer *key* to disk.
+        """
+        if self.cache_dir is None:
+            return
+        filename = os.path.join(self.cache_dir, key + ".npy")
+        try:
+            tempfd, tempname = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(tempfd, "wb") as fd_:
+                np.save(fd_, layer)
+            os.rename(tempname, filename)
+        except (IOError, OSError):
+            LOGGER.exception("Could not save overlay to %s", filename)
+
+    def get_layer(self, area, overlay, color=None):
+        """Get the RGBA layer of *overlay* for *area*, *overlay* being a
+        color in #RRGGBB format (given as a tuple in *color*) or the path to
+        an overlay configuration file.
+        """
+        key = self._get_key(area, overlay)
+        with self._lock:
+            try:
+                layer = self._layers.pop(key)
+            except KeyError:
+                layer = self._load(key)
+                if layer is None:
+                    LOGGER.debug("Rendering overlay %s for %s",
+                                 overlay, area.area_id)
+                    if overlay.startswith("#"):
+                        layer = render_coasts(area, color)
+                    else:
+                        layer = render_config(area, overlay)
+                    self._save(key, layer)
+            self._layers[key] = layer
+            while len(self._layers) > self.max_layers:
+                self._layers.popitem(last=False)
+        return layer
+
+    def add_overlay(self, img, overlay, color=None):
+        """Add *overlay* to *img*, like the *add_overlay* (for colors) and
+        *add_overlay_config* (for files) methods of the mpop images.
+        """
+        if img.area is None:
+            raise ValueError("Area of image is None, can't add overlay.")
+        if isinstance(img.area, str):
+            img.area = get_area_def(img.area)
+
+        if overlay.startswith("#"):
+            if img.mode not in ["L", "RGB"]:
+                img.add_overlay(color)
+                return
+        elif img.mode != "RGB":
+            img.convert("RGB")
+
+        blend(img, self.get_layer(img.area, overlay, color))
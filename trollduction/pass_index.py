@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent index of the processed passes and products.
+
+The index is kept in an sqlite database, and mirrored in memory so that
+the lookups don't touch the disk. Entries older than the retention window
+are removed.
+"""
+
+import logging
+import sqlite3
+from datetime import datetime, timedelta
+from threading import Lock
+
+LOGGER = logging.getLogger(__name__)
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def _make_key(platform_name, start_time, area=None, product=None):
+    """Make the key for the given pass, area and product.
+    """
+    return (str(platform_name), start_time.strftime(TIME_FORMAT),
+            area or "", product or "")
+
+
+def _make_pass_key(platform_name, start_time, collection_area_id=None):
+    """Make the key for the given pass, collected for *collection_area_id*.
+    """
+    return (str(platform_name), start_time.strftime(TIME_FORMAT),
+            collection_area_id or "")
+
+
+class PassIndex(object):
+
+    """Index of what has been processed, stored in *filename*. The entries
+    are kept for the *retention* timedelta after the start time of the pass.
+
+    The products are recorded by area, and the passes completely done
+    separately, by the area they were collected for (if any).
+    """
+
+    def __init__(self, filename, retention=timedelta(hours=24)):
+        self.filename = filename
+        self.retention = retention
+        self._lock = Lock()
+        self._done = set()
+        self._passes = set()
+        self._waiting = {}
+        self._con = sqlite3.connect(filename, check_same_thread=False)
+        with self._con:
+            self._con.execute("CREATE TABLE IF NOT EXISTS processed "
+                              "(platform_name TEXT, start_time TEXT, "
+                              "area TEXT, product TEXT, "
+                              "PRIMARY KEY (platform_name, start_time, "
+                              "area, product))")
+            self._con.execute("CREATE TABLE IF NOT EXISTS passes "
+                              "(platform_name TEXT, start_time TEXT, "
+                              "collection_area TEXT, "
+                              "PRIMARY KEY (platform_name, start_time, "
+                              "collection_area))")
+        self.cleanup()
+
+    def is_done(self, platform_name, start_time, area=None, product=None):
+        """Check if the *product* in *area* has been processed.
+        """
+        return _make_key(platform_name, start_time,
+                         area, product) in self._done
+
+    def mark_done(self, platform_name, start_time, area=None, product=None):
+        """Record the *product* in *area* as processed, and the passes
+        waiting for it if it was their last product.
+        """
+        key = _make_key(platform_name, start_time, area, product)
+        with self._lock:
+            if key in self._done:
+                return
+            with self._con:
+                self._con.execute("INSERT OR IGNORE INTO processed "
+                                  "VALUES (?, ?, ?, ?)", key)
+            self._done.add(key)
+            for pass_key, remaining in self._waiting.items():
+                remaining.discard(key)
+                if not remaining:
+                    del self._waiting[pass_key]
+                    self._add_pass(pass_key)
+
+    def is_pass_done(self, platform_name, start_time,
+                     collection_area_id=None):
+        """Check if the pass, collected for *collection_area_id*, has been
+        completely processed.
+        """
+        return _make_pass_key(platform_name, start_time,
+                              collection_area_id) in self._passes
+
+    def mark_pass_done(self, platform_name, start_time,
+                       collection_area_id=None, products=()):
+        """Record the pass, collected for *collection_area_id*, as processed
+        once all its *products*, as (platform_name, start_time, area,
+        product) keys, are done. Until then, the pass is only waited for in
+        memory, so that it is processed again after a restart.
+        """
+        pass_key = _make_pass_key(platform_name, start_time,
+                                  collection_area_id)
+        with self._lock:
+            remaining = set(_make_key(*key) for key in products) - self._done
+            if remaining:
+                LOGGER.debug("Pass %s waiting for %d products",
+                             str(pass_key), len(remaining))
+                self._waiting[pass_key] = remaining
+            else:
+                self._waiting.pop(pass_key, None)
+                self._add_pass(pass_key)
+
+    def _add_pass(self, pass_key):
+        """Record *pass_key* as done. The lock has to be held.
+        """
+        if pass_key in self._passes:
+            return
+        with self._con:
+            self._con.execute("INSERT OR IGNORE INTO passes "
+                              "VALUES (?, ?, ?)", pass_key)
+        self._passes.add(pass_key)
+
+    def cleanup(self):
+        """Forget the entries older than the retention window, and load the
+        other ones.
+        """
+        oldest = (datetime.utcnow() - self.retention).strftime(TIME_FORMAT)
+        with self._lock:
+            with self._con:
+                removed = 0
+                for table in ["processed", "passes"]:
+                    cur = self._con.execute("DELETE FROM %s "
+                                            "WHERE start_time < ?" % table,
+                                            (oldest, ))
+                    removed += max(cur.rowcount, 0)
+            if removed > 0:
+                LOGGER.debug("Removed %d old entries from %s", removed,
+                             self.filename)
+            self._done = set(tuple(row) for row in self._con.execute(
+                "SELECT platform_name, start_time, area, product "
+                "FROM processed"))
+            self._passes = set(tuple(row) for row in self._con.execute(
+                "SELECT platform_name, start_time, collection_area "
+                "FROM passes"))
+            for pass_key in self._waiting.keys():
+                if pass_key[1] < oldest:
+                    del self._waiting[pass_key]
+
+    def close(self):
+        """Close the index.
+        """
+        with self._lock:
+            self._con.close()
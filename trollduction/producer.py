@@ -39,8 +39,11 @@ TODO:
 from .listener import ListenerContainer
 from mpop.satellites import GenericFactory as GF
 import time
-from mpop.projector import get_area_def
-from threading import Thread
+import copy
+import functools
+import weakref
+from datetime import datetime, timedelta
+from threading import Thread, Lock
 from pyorbital import astronomy
 import numpy as np
 import os
@@ -48,7 +51,11 @@ import Queue
 import logging
 import logging.handlers
 from fnmatch import fnmatch
-from trollduction import helper_functions
+from trollduction import helper_functions, image_writer, area_cache
+from trollduction.area_cache import get_area_def
+from trollduction.pass_index import PassIndex
+from trollduction.overlays import OverlayCache
+from trollduction.spool import SpoolMover, clean_spool
 from trollsift import compose
 from urlparse import urlparse, urlunsplit
 import socket
@@ -56,6 +63,9 @@ import shutil
 from mpop.satout.cfscene import CFScene
 from posttroll.publisher import Publish
 from posttroll.message import Message
+from pyproj import Proj
+from pyresample import kd_tree
+from pyresample.geometry import AreaDefinition, SwathDefinition
 from pyresample.utils import AreaNotFound
 from trollsched.satpass import Pass
 from trollsched.boundary import Boundary, AreaDefBoundary
@@ -82,6 +92,8 @@ from struct import error as StructError
 
 LOGGER = logging.getLogger(__name__)
 
+EARTH_RADIUS = 6371000.0
+
 # Config watcher stuff
 
 import pyinotify
@@ -368,15 +380,118 @@ def coverage(scene, area):
         return coverages[0]
 
 
-def generic_covers(scene, area_item):
+def get_coarse_area(area, size):
+    """Get a version of *area* with the same extent, but at most *size*
+    pixels wide and high.
+    """
+    ratio = int(np.ceil(max(area.x_size, area.y_size) / float(size)))
+    if ratio <= 1:
+        return area
+    return AreaDefinition(area.area_id, area.name, area.proj_id,
+                          area.proj_dict,
+                          int(np.ceil(area.x_size / float(ratio))),
+                          int(np.ceil(area.y_size / float(ratio))),
+                          area.area_extent)
+
+
+def get_decimated_lonlats(area, step):
+    """Get the lons and lats of every *step* pixel of *area*.
+    """
+    try:
+        proj = Proj(**area.proj_dict)
+    except AttributeError:
+        lons, lats = area.get_lonlats()
+        return lons[::step, ::step], lats[::step, ::step]
+    cols = np.arange(0, area.x_size, step) + 0.5
+    rows = np.arange(0, area.y_size, step) + 0.5
+    xcoords, ycoords = np.meshgrid(
+        area.area_extent[0] + area.pixel_size_x * cols,
+        area.area_extent[3] - area.pixel_size_y * rows)
+    return proj(xcoords, ycoords, inverse=True)
+
+
+def get_spacing(lons, lats):
+    """Get the typical distance in meters between neighbouring points of
+    the *lons* and *lats* grids.
+    """
+    lons = np.deg2rad(lons)
+    lats = np.deg2rad(lats)
+    xyz = np.dstack((np.cos(lats) * np.cos(lons),
+                     np.cos(lats) * np.sin(lons),
+                     np.sin(lats))) * EARTH_RADIUS
+    dists = np.concatenate(
+        (np.sqrt(np.sum((xyz[1:, :] - xyz[:-1, :]) ** 2, axis=2)).ravel(),
+         np.sqrt(np.sum((xyz[:, 1:] - xyz[:, :-1]) ** 2, axis=2)).ravel()))
+    dists = dists[np.isfinite(dists)]
+    if dists.size == 0:
+        return 0
+    return np.percentile(dists, 95)
+
+
+def raster_coverage(scene, area, size=100):
+    """Estimate the coverage of *area* by the loaded channels of *scene*:
+    the valid data mask of each channel resolution is decimated, projected
+    on a version of *area* at most *size* pixels wide and high, and the
+    covered pixels are counted.
+
+    This is much faster than intersecting polygons, and doesn't care about
+    the poles or the dateline, but is only as precise as the coarse area.
+    """
+    coarse_area = get_coarse_area(area, size)
+    coverages = []
+    for shape in set(channel.shape for channel in scene.channels
+                     if channel.is_loaded()):
+        mask = None
+        for channel in scene.channels:
+            if channel.is_loaded() and channel.shape == shape:
+                chn_mask = np.ma.getmaskarray(channel.data)
+                if mask is None:
+                    mask = chn_mask
+                else:
+                    mask = np.logical_or(mask, chn_mask)
+                chn_area = channel.area
+
+        step = max(1, max(shape) // (2 * size))
+        lons, lats = get_decimated_lonlats(chn_area, step)
+        lons = np.ma.filled(lons, np.nan).astype(np.float64)
+        lats = np.ma.filled(lats, np.nan).astype(np.float64)
+        valid = (np.logical_not(mask[::step, ::step]) &
+                 (np.abs(lons) <= 180) & (np.abs(lats) <= 90))
+        if not np.any(valid):
+            coverages.append(0.0)
+            continue
+        lons[np.abs(lons) > 180] = np.nan
+        lats[np.abs(lats) > 90] = np.nan
+        radius = max(get_spacing(lons, lats), 1000)
+
+        swath = SwathDefinition(lons[valid], lats[valid])
+        covered = kd_tree.resample_nearest(swath,
+                                           np.ones(valid.sum(),
+                                                   dtype=np.uint8),
+                                           coarse_area,
+                                           radius_of_influence=radius,
+                                           fill_value=0)
+        coverages.append(np.count_nonzero(covered) / float(covered.size))
+    return min(coverages)
+
+
+def generic_covers(scene, area_item, method="polygon"):
     """Check if scene covers area_item with high enough percentage.
+
+    The coverage is computed with polygon intersections, or estimated on
+    a coarse raster if the *coverage_method* attribute of the area (or
+    *method*) is "raster".
     """
     area_def = get_area_def(area_item.attrib['id'])
     min_coverage = float(area_item.attrib.get('min_coverage', 0))
     if min_coverage == 0:
         return True
     min_coverage /= 100.0
-    cov = coverage(scene, area_def)
+    method = area_item.attrib.get("coverage_method", method)
+    if method == "raster":
+        cov = raster_coverage(scene, area_def)
+    else:
+        cov = coverage(scene, area_def)
     if cov <= min_coverage:
         LOGGER.info("Coverage too small %.1f%% (out of %.1f%%) with %s",
                     cov * 100, min_coverage * 100,
@@ -388,20 +503,134 @@ def generic_covers(scene, area_item):
         return True
 
 
+def get_segment_numbers(area_defs, segment_area, num_segments,
+                        north_first=False):
+    """Get the numbers of the segments of *segment_area*, split in
+    *num_segments* horizontal stripes, that cover the union of *area_defs*.
+
+    Segments are numbered from 1, starting from the south unless
+    *north_first* is True. None is returned if one of the areas reaches
+    outside *segment_area*, in which case all the segments are needed.
+    """
+    first_line, last_line = None, None
+    for area_def in area_defs:
+        lons, lats = area_def.get_boundary_lonlats()
+        lons = np.concatenate((lons.side1, lons.side2, lons.side3, lons.side4))
+        lats = np.concatenate((lats.side1, lats.side2, lats.side3, lats.side4))
+        lines = segment_area.get_xy_from_lonlat(lons, lats)[1]
+        if np.ma.is_masked(lines):
+            return None
+        if first_line is None:
+            first_line, last_line = lines.min(), lines.max()
+        else:
+            first_line = min(first_line, lines.min())
+            last_line = max(last_line, lines.max())
+    if first_line is None:
+        return None
+
+    segment_height = segment_area.y_size / float(num_segments)
+    last_segment = min(int(last_line // segment_height), num_segments - 1)
+    segments = set(range(int(first_line // segment_height) + 1,
+                         last_segment + 2))
+    if not north_first:
+        segments = set(num_segments + 1 - seg for seg in segments)
+    return segments
+
+
+def derive_scene(scene, area_def, func):
+    """Make a copy of the projected *scene* on *area_def*, the data of the
+    channels being computed with *func*.
+    """
+    res = copy.copy(scene)
+    # cached sun zenith angles are for the parent area
+    res.__dict__.pop("sun_zen", None)
+    res.area = area_def
+    res.channels = []
+    for chn in scene.channels:
+        new_chn = copy.copy(chn)
+        # setting an area definition keeps the area id copied from the
+        # parent channel, resetting to None clears it
+        new_chn.area = None
+        new_chn.area = area_def
+        if chn.is_loaded():
+            new_chn.data = func(chn.data)
+        res.channels.append(new_chn)
+    try:
+        if res._CompositerClass is not None:
+            res.image = res._CompositerClass(weakref.proxy(res))
+    except AttributeError:
+        pass
+    return res
+
+
+def crop_scene(scene, area_def, offset):
+    """Make a copy of the projected *scene* on the *area_def* sub-window of
+    its grid, at the (row, column) *offset*. The data is not copied.
+    """
+    row, col = offset
+    return derive_scene(scene, area_def,
+                        lambda data: data[row:row + area_def.y_size,
+                                          col:col + area_def.x_size])
+
+
+def downsample(data, ratio, method="decimate"):
+    """Downsample *data* by *ratio*, picking the central pixel of each block
+    ("decimate") or averaging the valid pixels of each block ("average").
+    """
+    if method == "decimate":
+        return data[ratio // 2::ratio, ratio // 2::ratio]
+    elif method == "average":
+        rows, cols = data.shape[0] // ratio, data.shape[1] // ratio
+        blocks = np.ma.asarray(data).reshape((rows, ratio, cols, ratio))
+        total = blocks.sum(axis=3).sum(axis=1)
+        count = blocks.count(axis=3).sum(axis=1)
+        res = np.ma.array(np.ma.filled(total, 0) / np.maximum(count, 1.0),
+                          mask=(count == 0))
+        if np.issubdtype(data.dtype, np.integer):
+            res = np.ma.round(res).astype(data.dtype)
+        return res
+    raise ValueError("Unknown downsampling method " + str(method))
+
+
+def downsample_scene(scene, area_def, ratio, method="decimate"):
+    """Make a copy of the projected *scene* on *area_def*, which has the
+    same extent and a *ratio* times lower resolution, using the downsampling
+    *method*.
+    """
+    return derive_scene(scene, area_def,
+                        lambda data: downsample(data, ratio, method))
+
+
 class DataProcessor(object):
 
     """Process the data.
     """
 
-    def __init__(self, publish_topic=None, port=0):
+    def __init__(self, publish_topic=None, port=0, pass_index=None):
         self.global_data = None
         self.local_data = None
         self.product_config = None
         self._publish_topic = publish_topic
         self._data_ok = True
-        self.writer = DataWriter(publish_topic=self._publish_topic, port=port)
+        self._product_keys = []
+        self.pass_index = pass_index
+        self.writer = DataWriter(publish_topic=self._publish_topic, port=port,
+                                 pass_index=pass_index)
         self.writer.start()
 
+    def set_pass_index(self, pass_index):
+        '''Set the index of the processed products, used to skip them.
+        '''
+        self.pass_index = pass_index
+        self.writer.pass_index = pass_index
+
+    def write(self, obj, item, params):
+        '''Queue *obj* for writing, and remember its index key.
+        '''
+        if "index_key" in params:
+            self._product_keys.append(params["index_key"])
+        self.writer.write(obj, item, params)
+
     def set_publish_topic(self, publish_topic):
         '''Set published topic.'''
         self._publish_topic = publish_topic
@@ -471,6 +700,88 @@ class DataProcessor(object):
 
         return global_data
 
+    def select_segments(self, datasets):
+        """Select the segments in *datasets* that cover the areas to produce.
+
+        The selection is done only if the *segment_area* and
+        *segment_counts* options are given in the product config, and
+        applies only to the dataset items having a numeric *segment*.
+        """
+        try:
+            segment_area = self.product_config.attrib["segment_area"]
+            segment_counts = self.product_config.attrib["segment_counts"]
+        except KeyError:
+            return datasets
+        if any(item.tag == "dump" for item in self.product_config.prodlist):
+            LOGGER.debug("Unprojected dump requested, using all segments")
+            return datasets
+
+        try:
+            segment_area = get_area_def(segment_area)
+            area_defs = [get_area_def(area_id)
+                         for area_id in set(self.get_area_def_names())]
+        except AreaNotFound:
+            LOGGER.exception("Can't select segments, using all of them")
+            return datasets
+
+        counts = {}
+        for itm in segment_counts.split(","):
+            channel_name, num_segments = itm.split(":")
+            counts[channel_name.strip()] = int(num_segments)
+        north_first = self.product_config.attrib.get(
+            "segment_order", "south_first").lower() == "north_first"
+
+        segment_numbers = {}
+        selected = []
+        for mda in datasets:
+            try:
+                segment = int(str(mda["segment"]).strip("_"))
+            except (KeyError, ValueError):
+                # prologue, epilogue or unknown segment
+                selected.append(mda)
+                continue
+            channel_name = str(mda.get("channel_name", "")).strip("_")
+            num_segments = counts.get(channel_name, counts.get(""))
+            if num_segments is None:
+                selected.append(mda)
+                continue
+            if num_segments not in segment_numbers:
+                segment_numbers[num_segments] = \
+                    get_segment_numbers(area_defs, segment_area,
+                                        num_segments, north_first)
+                LOGGER.debug("Segments needed out of %d: %s", num_segments,
+                             str(segment_numbers[num_segments]))
+            if (segment_numbers[num_segments] is None or
+                    segment in segment_numbers[num_segments]):
+                selected.append(mda)
+
+        LOGGER.info("Using %d segments out of %d", len(selected),
+                    len(datasets))
+        return selected
+
+    def get_index_key(self, area, product):
+        """Get the key of *product* in *area* (None for unprojected data) in
+        the index of processed products.
+        """
+        if area is None:
+            area_name = None
+        else:
+            area_name = area.attrib.get("name", area.attrib.get("id"))
+        return (self.global_data.info["platform_name"],
+                self.global_data.info["time"],
+                area_name,
+                product.attrib.get("name", product.tag))
+
+    def is_done(self, area, product):
+        """Check if *product* in *area* has already been processed.
+        """
+        if self.pass_index is None:
+            return False
+        try:
+            return self.pass_index.is_done(*self.get_index_key(area, product))
+        except (KeyError, AttributeError):
+            return False
+
     def save_to_netcdf(self, data, item, params):
         """Save data to netCDF4.
         """
@@ -480,9 +791,17 @@ class DataProcessor(object):
             params["area"] = data.area
             data.add_to_history(
                 "Saved as netcdf4/cf by pytroll/mpop.")
-            cfscene = CFScene(data)
+            if "chunks" in item.attrib:
+                from trollduction.netcdf_writer import ChunkedCFWriter
+                chunks = [int(size)
+                          for size in item.attrib["chunks"].split("x")]
+                cfscene = ChunkedCFWriter(
+                    data, chunks=(chunks * 2)[:2],
+                    nthreads=int(item.attrib.get("compression_threads", 1)))
+            else:
+                cfscene = CFScene(data)
 
-            self.writer.write(cfscene, item, params)
+            self.write(cfscene, item, params)
             LOGGER.info("Sent netcdf/cf scene to writer.")
         except IOError:
             LOGGER.error("Saving unprojected data to NetCDF failed!")
@@ -494,21 +813,25 @@ class DataProcessor(object):
                 data.unload(*loaded_channels)
 
     def run(self, product_config, msg):
-        """Process the data
+        """Process the data. Return the index keys of the products queued
+        for writing (none if they were already done), or None if the data
+        was skipped.
         """
 
         self.product_config = product_config
+        self._product_keys = []
 
         if msg.type == "file":
             uri = msg.data['uri']
         elif msg.type == "dataset":
-            uri = [mda['uri'] for mda in msg.data['dataset']]
+            uri = [mda['uri']
+                   for mda in self.select_segments(msg.data['dataset'])]
         elif msg.type == 'collection':
             all_areas = self.get_area_def_names()
             if not msg.data['collection_area_id'] in all_areas:
                 LOGGER.info('Collection does not contain data for '
                             'current areas. Skipping.')
-                return
+                return None
             if 'dataset' in msg.data['collection'][0]:
                 uri = []
                 for dataset in msg.data['collection']:
@@ -517,7 +840,7 @@ class DataProcessor(object):
                 uri = [mda['uri'] for mda in msg.data['collection']]
         else:
             LOGGER.warning("Can't run on %s messages", msg.type)
-            return
+            return None
         # TODO collections and collections of datasets
 
         LOGGER.info('New data available: %s', uri)
@@ -529,10 +852,11 @@ class DataProcessor(object):
         except IOError as err:
             LOGGER.info(str(err))
             LOGGER.info("Skipping...")
-            return
+            return None
 
         self.global_data = self.create_scene_from_message(msg)
         self._data_ok = True
+        produced = False
 
         nprocs = int(self.product_config.attrib.get("nprocs", 1))
         proj_method = self.product_config.attrib.get("proj_method", "nearest")
@@ -555,11 +879,16 @@ class DataProcessor(object):
 
         for area_item in self.product_config.prodlist:
             if area_item.tag == "dump":
+                if self.is_done(None, area_item):
+                    LOGGER.info("Unprojected data already dumped, skipping")
+                    produced = True
+                    continue
                 try:
                     self.global_data.load(filename=filename, **keywords)
-                    self.save_to_netcdf(self.global_data,
-                                        area_item,
-                                        self.get_parameters(area_item))
+                    params = self.get_parameters(area_item)
+                    params["index_key"] = self.get_index_key(None, area_item)
+                    self.save_to_netcdf(self.global_data, area_item, params)
+                    produced = True
                 except (IndexError, IOError, DecodeError, StructError):
                     LOGGER.exception("Incomplete or corrupted input data.")
 
@@ -576,8 +905,17 @@ class DataProcessor(object):
             skip = []
             skip_group = True
             do_generic_coverage = False
+            coverage_method = self.product_config.attrib.get(
+                "coverage_method", "polygon")
 
             for area_item in group.data:
+                if all(self.is_done(area_item, product)
+                       for product in area_item):
+                    LOGGER.info("All products already done for area %s, "
+                                "skipping", area_item.attrib['name'])
+                    skip.append(area_item)
+                    produced = True
+                    continue
                 try:
                     if not covers(self.global_data.overpass, area_item):
                         skip.append(area_item)
@@ -621,49 +959,84 @@ class DataProcessor(object):
                 self._data_ok = False
                 break
 
-            for area_item in group.data:
+            # Areas that can be derived from other areas (sub-windows or
+            # lower resolutions) are computed from them, so project the
+            # parents first and keep them until their children are done.
+            parents = self.get_parent_areas([area_item for area_item
+                                             in group.data
+                                             if area_item not in skip])
+            children = {}
+            for child, (parent, _) in parents.items():
+                children.setdefault(parent, []).append(child)
+            projected = {}
+
+            for area_item in sorted(group.data,
+                                    key=lambda item: item in parents):
                 if area_item in skip:
                     continue
                 elif (do_generic_coverage and
-                      not generic_covers(self.global_data, area_item)):
+                      not generic_covers(self.global_data, area_item,
+                                         coverage_method)):
                     continue
 
-                # reproject to local domain
-                LOGGER.debug("Projecting data to area %s",
-                             area_item.attrib['name'])
-                try:
+                parent, derive = parents.get(area_item, (None, None))
+                if parent in projected:
+                    LOGGER.debug("Deriving data for area %s from area %s",
+                                 area_item.attrib['name'],
+                                 parent.attrib['name'])
+                    self.local_data = derive(
+                        projected[parent],
+                        copy.copy(get_area_def(area_item.attrib["id"])))
+                    children[parent].remove(area_item)
+                    if not children[parent]:
+                        del projected[parent]
+                else:
+                    # reproject to local domain
+                    LOGGER.debug("Projecting data to area %s",
+                                 area_item.attrib['name'])
+                    products = list(area_item)
+                    for child in children.get(area_item, []):
+                        products.extend(child)
                     try:
-                        actual_srch_radius = \
-                                int(area_item.attrib["srch_radius"])
-                        LOGGER.debug("Overriding search radius %s with %s",
-                                     str(srch_radius), str(actual_srch_radius))
-                    except KeyError:
-                        LOGGER.debug("Using search radius %s", str(srch_radius))
-                        actual_srch_radius = srch_radius
-
-                    self.local_data = \
-                        self.global_data.project(
-                            area_item.attrib["id"],
-                            channels=self.get_req_channels(area_item),
-                            mode=proj_method, nprocs=nprocs,
-                            precompute=precompute,
-                            radius=actual_srch_radius)
-                except ValueError:
-                    LOGGER.warning("No data in this area")
-                    continue
-                except AreaNotFound:
-                    LOGGER.warning("Area %s not defined, skipping!",
-                                   area_item.attrib['id'])
-                    continue
+                        actual_srch_radius = self.product_config.get_plan(
+                            area_item).srch_radius
+                        if actual_srch_radius is not None:
+                            LOGGER.debug("Overriding search radius %s with %s",
+                                         str(srch_radius),
+                                         str(actual_srch_radius))
+                        else:
+                            LOGGER.debug("Using search radius %s",
+                                         str(srch_radius))
+                            actual_srch_radius = srch_radius
+
+                        self.local_data = \
+                            self.global_data.project(
+                                area_item.attrib["id"],
+                                channels=self.get_req_channels(products),
+                                mode=proj_method, nprocs=nprocs,
+                                precompute=precompute,
+                                radius=actual_srch_radius)
+                    except ValueError:
+                        LOGGER.warning("No data in this area")
+                        continue
+                    except AreaNotFound:
+                        LOGGER.warning("Area %s not defined, skipping!",
+                                       area_item.attrib['id'])
+                        continue
 
-                LOGGER.info('Data reprojected for area: %s',
-                            area_item.attrib['name'])
+                    LOGGER.info('Data reprojected for area: %s',
+                                area_item.attrib['name'])
+                    if area_item in children:
+                        projected[area_item] = self.local_data
 
                 # Draw requested images for this area.
                 self.draw_images(area_item)
+                produced = True
                 del self.local_data
                 self.local_data = None
 
+            del projected
+
             if group.get("unload", "").lower() in ["yes", "true", "1"]:
                 loaded_channels = [chn.name for chn
                                    in self.global_data.loaded_channels()]
@@ -689,6 +1062,10 @@ class DataProcessor(object):
                            uri)
             raise IOError
 
+        if not produced:
+            return None
+        return self._product_keys
+
     def release_memory(self):
         """Run garbage collection for diagnostics"""
         if mem_top is not None:
@@ -724,18 +1101,84 @@ class DataProcessor(object):
                             product.attrib['id'])
         return reqs
 
+    def get_parent_areas(self, area_items):
+        """Find the items of *area_items* that can be derived from the
+        projected data of other items instead of being projected themselves:
+        the grid-aligned sub-windows of other areas are cropped from them,
+        and the areas with the same extent as others at a lower resolution
+        are downsampled from them if their *downsample* attribute (or common
+        option) is "decimate" or "average".
+
+        Returns a dictionary of child items to (parent item, function
+        computing the child scene from the parent scene and child area).
+        """
+        area_defs = []
+        for area_item in area_items:
+            try:
+                area_defs.append((area_item,
+                                  get_area_def(area_item.attrib["id"])))
+            except AreaNotFound:
+                continue
+
+        parents = {}
+        for idx, (child, child_def) in enumerate(area_defs):
+            best = None
+            for pidx, (parent, parent_def) in enumerate(area_defs):
+                size = parent_def.x_size * parent_def.y_size
+                child_size = child_def.x_size * child_def.y_size
+                if (pidx == idx or size < child_size or
+                        (size == child_size and pidx > idx) or
+                        parent.attrib.get("srch_radius") !=
+                        child.attrib.get("srch_radius")):
+                    continue
+                offset = helper_functions.get_grid_offset(parent_def,
+                                                          child_def)
+                if offset is not None and (best is None or size > best[0]):
+                    best = (size, parent, offset)
+            if best is not None:
+                LOGGER.debug("Area %s will be cropped from area %s",
+                             child.attrib["id"], best[1].attrib["id"])
+                parents[child] = (best[1],
+                                  functools.partial(crop_scene,
+                                                    offset=best[2]))
+
+        # Largest areas first, so that the downsampled areas are derived
+        # from projected ones only.
+        area_defs.sort(key=lambda item: item[1].x_size * item[1].y_size,
+                       reverse=True)
+        for child, child_def in area_defs:
+            method = child.attrib.get(
+                "downsample", self.product_config.attrib.get("downsample"))
+            if (method not in ["decimate", "average"] or child in parents or
+                    child in [parent for parent, _ in parents.values()]):
+                continue
+            best = None
+            for parent, parent_def in area_defs:
+                if parent is child or parent in parents:
+                    continue
+                ratio = helper_functions.get_downsampling_ratio(parent_def,
+                                                                child_def)
+                if ratio is not None and (best is None or ratio < best[0]):
+                    best = (ratio, parent)
+            if best is not None:
+                LOGGER.debug("Area %s will be downsampled from area %s "
+                             "(%s by %d)", child.attrib["id"],
+                             best[1].attrib["id"], method, best[0])
+                parents[child] = (best[1],
+                                  functools.partial(downsample_scene,
+                                                    ratio=best[0],
+                                                    method=method))
+        return parents
+
     def get_area_def_names(self, group=None):
         '''Collect and return area definition names from product
         config to a list.
         '''
 
-        prodlist = group or self.product_config.prodlist
+        if group is None:
+            return list(self.product_config.area_ids)
 
-        def_names = [item.attrib["id"]
-                     for item in prodlist
-                     if item.tag == "area"]
-
-        return def_names
+        return [self.product_config.get_plan(item).id for item in group]
 
     def check_satellite(self, config):
         '''Check if the current configuration allows the use of this
@@ -791,9 +1234,16 @@ class DataProcessor(object):
         '''
 
         params = self.get_parameters(area)
+        area_plan = self.product_config.get_plan(area)
         # Create images for each color composite
-        for product in area:
+        for product, plan in zip(area, area_plan.products):
+            if product.tag in ["dump", "product"] and \
+                    self.is_done(area, product):
+                LOGGER.info("Product %s already done for area %s, skipping",
+                            plan.name or plan.tag, area_plan.name)
+                continue
             params.update(self.get_parameters(product))
+            params["index_key"] = self.get_index_key(area, product)
             if product.tag == "dump":
                 try:
                     self.save_to_netcdf(self.local_data,
@@ -811,54 +1261,41 @@ class DataProcessor(object):
                 continue
 
             # Check if Sun zenith angle limits match this product
-            if 'sunzen_night_minimum' in product.attrib or \
-                    'sunzen_day_maximum' in product.attrib:
-                if 'sunzen_xy_loc' in product.attrib:
-                    xy_loc = [int(x) for x in
-                              product.attrib['sunzen_xy_loc'].split(',')]
-                    lonlat = None
-                else:
-                    xy_loc = None
-                    if 'sunzen_lonlat' in product.attrib:
-                        lonlat = [float(x) for x in
-                                  product.attrib['sunzen_lonlat'].split(',')]
-                    else:
-                        lonlat = None
-                if not self.check_sunzen(product.attrib,
-                                         area_def=get_area_def(
-                                             area.attrib['id']),
-                                         xy_loc=xy_loc, lonlat=lonlat):
+            if plan.sunzen:
+                if not self.check_sunzen(dict(plan.sunzen),
+                                         area_def=get_area_def(area_plan.id),
+                                         xy_loc=plan.sunzen_xy_loc,
+                                         lonlat=plan.sunzen_lonlat):
                     # If the return value is False, skip this product
                     continue
 
             try:
                 # Check if this combination is defined
-                func = getattr(self.local_data.image, product.attrib['id'])
-                LOGGER.debug("Generating composite \"%s\"",
-                             product.attrib['id'])
+                func = getattr(self.local_data.image, plan.id)
+                # The composites may need the lon/lat grids, take them from
+                # the disk cache if there is one.
+                area_cache.attach_lonlats(self.local_data.area)
+                LOGGER.debug("Generating composite \"%s\"", plan.id)
                 img = func()
                 img.info.update(self.global_data.info)
-                img.info["product_name"] = \
-                    product.attrib.get("name", product.attrib["id"])
+                img.info["product_name"] = plan.name
             except AttributeError as err:
                 # Log incorrect product funcion name
                 LOGGER.error('Incorrect product id: %s for area %s (%s)',
-                             product.attrib['id'], area.attrib['name'], str(err))
+                             plan.id, area_plan.name, str(err))
             except KeyError as err:
                 # log missing channel
                 LOGGER.warning('Missing channel on product %s for area %s: %s',
-                               product.attrib['name'], area.attrib['name'],
-                               str(err))
+                               plan.name, area_plan.name, str(err))
             except Exception:
                 # log other errors
                 LOGGER.exception('Error on product %s for area %s',
-                                 product.attrib['name'],
-                                 area.attrib['name'])
+                                 plan.name, area_plan.name)
             else:
-                self.writer.write(img, product, params)
+                self.write(img, product, params)
 
         # log and publish completion of this area def
-        LOGGER.info('Area %s completed', area.attrib['name'])
+        LOGGER.info('Area %s completed', area_plan.name)
 
     def check_sunzen(self, config, area_def=None, xy_loc=None, lonlat=None,
                      data_name='local_data'):
@@ -892,7 +1329,7 @@ class DataProcessor(object):
         # Check availability of coordinates, load if necessary
         if data.area.lons is None:
             LOGGER.debug('Load coordinates for %s', data_name)
-            data.area.lons, data.area.lats = data.area.get_lonlats()
+            data.area.lons, data.area.lats = area_cache.get_lonlats(data.area)
 
         # Check availability of Sun zenith angles, calculate if necessary
         try:
@@ -946,7 +1383,21 @@ class DataProcessor(object):
         return True
 
 
-def _create_message(obj, filename, uri, params, publish_topic=None, uid=None):
+def get_pass_key(mda):
+    """Get the (platform name, time slot, collection area id) key of the
+    pass described by *mda*, or None if it can't be identified. The area id
+    is None for data not collected for an area.
+    """
+    time_slot = (mda.get('start_time') or
+                 mda.get('nominal_time') or
+                 mda.get('end_time'))
+    if "platform_name" not in mda or not isinstance(time_slot, datetime):
+        return None
+    return mda["platform_name"], time_slot, mda.get("collection_area_id")
+
+
+def _create_message(obj, filename, uri, params, publish_topic=None, uid=None,
+                    compression=None):
     """Create posttroll message.
     """
     to_send = obj.info.copy()
@@ -976,6 +1427,8 @@ def _create_message(obj, filename, uri, params, publish_topic=None, uid=None):
     # FIXME: fishy: what if the uri already has a scheme ?
     to_send["uri"] = urlunsplit(("file", "", uri, "", ""))
     to_send["uid"] = uid or os.path.basename(filename)
+    if compression is not None:
+        to_send["compression"] = compression
     # we should have more info on format...
     fformat = os.path.splitext(filename)[1][1:]
     if fformat.startswith("tif"):
@@ -1086,11 +1539,18 @@ class DataWriter(Thread):
     we don't want to block processing.
     """
 
-    def __init__(self, publish_topic=None, port=0):
+    def __init__(self, publish_topic=None, port=0, pass_index=None):
         Thread.__init__(self)
         self.prod_queue = Queue.Queue()
         self._publish_topic = publish_topic
         self._port = port
+        self.pass_index = pass_index
+        self._overlays = None
+        self._backlog = False
+        self._mover = None
+        self._spool_dirs = set()
+        self._pub_lock = Lock()
+        self._placed_lock = Lock()
         self._loop = True
 
     def set_publish_topic(self, publish_topic):
@@ -1133,46 +1593,61 @@ class DataWriter(Thread):
                         if key in local_params:
                             local_params[key] = aliases.get(params[key],
                                                             params[key])
+                    failed = False
+                    spooled = []
                     for item, copies in sorted_items.items():
                         attrib = dict(item)
-                        if attrib.get("overlay", "").startswith("#"):
-                            obj.add_overlay(hash_color(attrib.get("overlay")))
-                        elif len(attrib.get("overlay", "")) > 0:
-                            LOGGER.debug("Adding overlay from config file")
-                            obj.add_overlay_config(attrib["overlay"])
+                        self._add_overlay(obj, attrib.get("overlay", ""),
+                                          local_params)
                         fformat = attrib.get("format")
 
                         # Actually save the data to disk.
                         saved = False
+                        compression = None
+                        spool_dir = params.get("spool_dir")
+                        if spool_dir and spool_dir not in self._spool_dirs:
+                            clean_spool(spool_dir)
+                            self._spool_dirs.add(spool_dir)
+                        placements = []
                         for copy in copies:
                             output_dir = copy.attrib.get("output_dir",
                                                          params["output_dir"])
 
                             fname = compose(os.path.join(output_dir, copy.text),
                                             local_params)
-                            tempfd, tempname = tempfile.mkstemp(dir=os.path.dirname(fname))
-                            os.chmod(tempname, default_mode)
-                            os.close(tempfd)
+                            # The spooled file is saved once and placed
+                            # at all the destinations by the movers.
+                            if not saved or not spool_dir:
+                                tempfd, tempname = tempfile.mkstemp(
+                                    dir=spool_dir or os.path.dirname(fname))
+                                os.chmod(tempname, default_mode)
+                                os.close(tempfd)
                             LOGGER.debug("Saving %s", fname)
                             if not saved:
+                                compression = self.get_compression(
+                                    copy.attrib, local_params)
                                 try:
-                                    obj.save(tempname,
-                                             fformat=fformat,
-                                             compression=copy.attrib.get("compression", 6))
+                                    self._save(obj, tempname, fformat,
+                                               copy.attrib, compression)
                                 except IOError:  # retry once
                                     try:
-                                        obj.save(tempname,
-                                                 fformat=fformat,
-                                                 compression=copy.attrib.get("compression", 6))
+                                        self._save(obj, tempname, fformat,
+                                                   copy.attrib, compression)
                                     except IOError:
                                         LOGGER.exception("Can't save file %s", fname)
+                                        failed = True
                                         continue
-                                os.rename(tempname, fname)
-
-                                LOGGER.info("Saved %s to %s", str(obj), fname)
-                                saved = fname
+                                if spool_dir:
+                                    LOGGER.info("Spooled %s to %s",
+                                                str(obj), tempname)
+                                    saved = tempname
+                                else:
+                                    os.rename(tempname, fname)
+                                    LOGGER.info("Saved %s to %s",
+                                                str(obj), fname)
+                                    saved = fname
                                 uid = os.path.basename(fname)
-                            else:
+                            elif not spool_dir:
                                 LOGGER.info("Copied/Linked %s to %s", saved, fname)
                                 link_or_copy(saved, fname, tempname)
                                 saved = fname
@@ -1181,26 +1656,40 @@ class DataWriter(Thread):
                                 thsize = [int(val) for val
                                           in copy.attrib[
                                     "thumbnail_size"].split("x")]
-                                copy.attrib["thumbnail_size"] = thsize
                                 thname = \
                                     compose(os.path.join(
                                         output_dir,
                                         copy.attrib["thumbnail_name"]),
                                         local_params)
-                                copy.attrib["thumbnail_name"] = thname
-                                thumbnail(fname, thname, thsize, fformat)
+                                thumbnail(saved, thname, thsize, fformat)
 
                             msg = _create_message(obj, os.path.basename(fname),
                                                   fname, params,
                                                   publish_topic=self._publish_topic,
-                                                  uid=uid)
-                            pub.send(str(msg))
-                            LOGGER.debug("Sent message %s", str(msg))
+                                                  uid=uid,
+                                                  compression=compression)
+                            if spool_dir:
+                                placements.append((fname, msg))
+                            else:
+                                self._send(pub, msg)
+                        if placements:
+                            spooled.append((saved, placements))
+                    index_key = None
+                    if self.pass_index is not None and not failed:
+                        index_key = params.get("index_key")
+                    if spooled:
+                        # The product is done when the movers have placed
+                        # all its files.
+                        pending = [sum(len(placements)
+                                       for _, placements in spooled)]
+                        placed = functools.partial(self._placed, pub,
+                                                   index_key, pending)
+                        for saved, placements in spooled:
+                            self._get_mover(params, default_mode).place(
+                                saved, placements, placed)
+                    elif index_key is not None:
+                        self.pass_index.mark_done(*index_key)
                 except Exception as e:
-                    for item in file_items:
-                        if "thumbnail_size" in item.attrib:
-                            item.attrib["thumbnail_size"] = str(
-                                item.attrib["thumbnail_size"])
                     LOGGER.exception("Something wrong happened saving "
                                      "%s to %s: %s (%s)",
                                      str(obj),
@@ -1211,16 +1700,154 @@ class DataWriter(Thread):
                 finally:
                     self.prod_queue.task_done()
 
+    def _send(self, pub, msg):
+        """Publish *msg*, the publisher being shared with the spool movers.
+        """
+        with self._pub_lock:
+            pub.send(str(msg))
+        LOGGER.debug("Sent message %s", str(msg))
+
+    def _placed(self, pub, index_key, pending, fname, msg):
+        """Announce *fname* once the spool movers have put it in place, and
+        mark *index_key* as done when the *pending* count of destinations of
+        the product drops to zero.
+        """
+        try:
+            self._send(pub, msg)
+        except Exception:
+            LOGGER.exception("Could not send the message for %s", fname)
+        with self._placed_lock:
+            pending[0] -= 1
+            complete = pending[0] == 0
+        if complete and index_key is not None:
+            self.pass_index.mark_done(*index_key)
+
+    def _get_mover(self, params, mode):
+        """Get the movers of the spooled files, starting them on first use
+        with the *spool_workers*, *spool_retries* and *spool_retry_delay*
+        options.
+        """
+        if self._mover is None:
+            self._mover = SpoolMover(
+                workers=int(params.get("spool_workers", 2)),
+                retries=int(params.get("spool_retries", 3)),
+                retry_delay=float(params.get("spool_retry_delay", 10)),
+                mode=mode)
+        return self._mover
+
+    def _add_overlay(self, obj, overlay, params):
+        """Add *overlay* to the image *obj*, using the cached overlays if the
+        *cache_overlays* or *overlay_cache_dir* options are given.
+        """
+        if not overlay:
+            return
+        color = None
+        if overlay.startswith("#"):
+            color = hash_color(overlay)
+
+        overlays = self._get_overlay_cache(params)
+        if overlays is not None:
+            LOGGER.debug("Adding cached overlay %s", overlay)
+            overlays.add_overlay(obj, overlay, color)
+        elif color is not None:
+            obj.add_overlay(color)
+        else:
+            LOGGER.debug("Adding overlay from config file")
+            obj.add_overlay_config(overlay)
+
+    def _get_overlay_cache(self, params):
+        """Get the overlay cache, or None if the *cache_overlays* and
+        *overlay_cache_dir* options are not given.
+        """
+        cache_dir = params.get("overlay_cache_dir")
+        if not (cache_dir or params.get("cache_overlays", "").lower() in
+                ["true", "yes", "1"]):
+            return None
+        if (self._overlays is None or
+                self._overlays.cache_dir != cache_dir):
+            self._overlays = OverlayCache(cache_dir)
+        return self._overlays
+
+    def warm_up_overlay(self, area_def, overlay, params):
+        """Render *overlay* for *area_def* in advance, if the overlays are
+        cached. Return True if it was.
+        """
+        overlays = self._get_overlay_cache(params)
+        if overlays is None or not overlay:
+            return False
+        color = None
+        if overlay.startswith("#"):
+            color = hash_color(overlay)
+        overlays.get_layer(area_def, overlay, color)
+        return True
+
+    def get_compression(self, attrib, params):
+        """Get the compression level for the file item *attrib*.
+
+        When the *backlog_compression* option is given, the level is lowered
+        to it while more than *backlog_size* items are waiting to be
+        written, or when the item waited more than *backlog_age* seconds.
+        """
+        try:
+            compression = int(attrib.get("compression", 6))
+        except ValueError:
+            LOGGER.warning("Invalid compression level %s, using 6",
+                           attrib["compression"])
+            compression = 6
+        if "backlog_compression" not in params:
+            return compression
+
+        depth = self.prod_queue.qsize()
+        age = time.time() - params.get("queued_time", time.time())
+        backlog = (("backlog_size" in params and
+                    depth >= int(params["backlog_size"])) or
+                   ("backlog_age" in params and
+                    age >= float(params["backlog_age"])))
+        if backlog != self._backlog:
+            self._backlog = backlog
+            if backlog:
+                LOGGER.warning("Writer backlog (%d items waiting, %.1f s "
+                               "wait), lowering compression to %s",
+                               depth, age, params["backlog_compression"])
+            else:
+                LOGGER.info("Writer backlog cleared, restoring compression")
+        if not backlog:
+            return compression
+        try:
+            return min(compression, int(params["backlog_compression"]))
+        except ValueError:
+            return compression
+
+    @staticmethod
+    def _save(obj, filename, fformat, attrib, compression=6):
+        """Save *obj* to *filename* with the *compression* level. If the
+        *stream_rows* attribute is given, images are converted and encoded
+        that many rows at the time.
+        """
+        if ("stream_rows" in attrib and
+                image_writer.can_stream(obj, fformat)):
+            image_writer.stream_save(obj, filename, fformat,
+                                     rows=int(attrib["stream_rows"]),
+                                     compression=compression,
+                                     tiled=attrib.get("tiled", "").lower() in
+                                     ["true", "yes", "1"])
+        else:
+            obj.save(filename, fformat=fformat, compression=compression)
+
     def write(self, obj, item, params):
         """Write to queue."""
         l = []
         l.append(item)
-        self.prod_queue.put((obj, l, params.copy()))
+        params = params.copy()
+        params["queued_time"] = time.time()
+        self.prod_queue.put((obj, l, params))
 
     def stop(self):
         """Stop the data writer."""
         LOGGER.info("stopping data writer")
         self._loop = False
+        if self._mover is not None:
+            self._mover.stop()
 
 
 class Trollduction(object):
@@ -1246,6 +1873,7 @@ class Trollduction(object):
 
         self._previous_pass = {"platform_name": None,
                                "start_time": None}
+        self.pass_index = None
 
         # read everything from the Trollduction config file
         try:
@@ -1264,7 +1892,8 @@ class Trollduction(object):
 
         self.data_processor = \
             DataProcessor(publish_topic=self.td_config.get('publish_topic'),
-                          port=int(self.td_config.get('port', 0)))
+                          port=int(self.td_config.get('port', 0)),
+                          pass_index=self.pass_index)
 
     def update_td_config_from_file(self, fname, config_item=None):
         '''Read Trollduction config file and use the new parameters.
@@ -1279,22 +1908,53 @@ class Trollduction(object):
         LOGGER.info('Trollduction configuration read successfully.')
 
         # Initialize/restart listener
+        queue_options = self.get_queue_options()
         if self.listener is None:
             self.listener = \
-                ListenerContainer(topics=self.td_config['topics'].split(','))
+                ListenerContainer(topics=self.td_config['topics'].split(','),
+                                  **queue_options)
 #            self.listener = ListenerContainer()
             LOGGER.info("Listener started")
         else:
             #            self.listener.restart_listener('file')
-            self.listener.restart_listener(self.td_config['topics'].split(','))
+            self.listener.restart_listener(self.td_config['topics'].split(','),
+                                           **queue_options)
             LOGGER.info("Listener restarted")
 
+        if (self.pass_index is None and
+                "processed_index" in self.td_config):
+            retention = timedelta(
+                hours=float(self.td_config.get("processed_retention", 24)))
+            self.pass_index = PassIndex(self.td_config["processed_index"],
+                                        retention=retention)
+            LOGGER.info("Using index of processed passes %s",
+                        self.td_config["processed_index"])
+
+        if "lonlat_cache_dir" in self.td_config:
+            area_cache.set_lonlat_dir(self.td_config["lonlat_cache_dir"])
+
         try:
             self.update_product_config(self.td_config['product_config_file'])
         except KeyError:
             LOGGER.exception("Key 'product_config_file' is "
                              "missing from Trollduction config")
 
+    def get_queue_options(self):
+        '''Get the options of the message queue from the configuration.
+        '''
+        priorities = None
+        if self.td_config.get('priorities'):
+            priorities = []
+            for item in self.td_config['priorities'].split(','):
+                pattern, priority = item.strip().rsplit(':', 1)
+                priorities.append((pattern, int(priority)))
+        max_age = None
+        if self.td_config.get('max_age'):
+            max_age = timedelta(minutes=float(self.td_config['max_age']))
+        return {"priorities": priorities,
+                "max_age": max_age,
+                "stale_policy": self.td_config.get('stale_policy', 'defer')}
+
     def update_product_config(self, fname):
         '''Update area definitions, associated product names, output
         filename prototypes and other relevant information from the
@@ -1302,7 +1962,10 @@ class Trollduction(object):
         '''
         import xml_read
 
-        self.product_config = xml_read.ProductList(fname)
+        product_config = xml_read.get_product_list(fname)
+        if product_config is self.product_config:
+            return
+        self.product_config = product_config
 
         # add checks, or do we just assume the config to be valid at
         # this point?
@@ -1312,6 +1975,47 @@ class Trollduction(object):
 
         LOGGER.info('Product config read from %s', fname)
 
+    def warm_up(self):
+        '''Prepare the areas of the product list before the first pass:
+        parse their definitions, compute their boundaries, and render their
+        cached overlays. The lon/lat grids are computed too if the
+        *warm_up_lonlats* option is true.
+        '''
+        if self.product_config is None:
+            return
+        start = time.time()
+        area_items = [item for item in self.product_config.prodlist
+                      if item.tag == "area"]
+        area_ids = list(set(item.attrib["id"] for item in area_items))
+        LOGGER.info("Warming up %d areas", len(area_ids))
+        lonlats = self.td_config.get("warm_up_lonlats",
+                                     "false").lower() in ["true", "yes", "1"]
+        ready = set(area_cache.warm_up(area_ids, lonlats=lonlats))
+
+        writer = self.data_processor.writer
+        num_overlays = 0
+        for area_item in area_items:
+            if area_item.attrib["id"] not in ready:
+                continue
+            area_def = get_area_def(area_item.attrib["id"])
+            overlays = set()
+            for product in area_item:
+                for item in product:
+                    overlays.add(item.attrib.get("overlay", ""))
+            for overlay in overlays:
+                try:
+                    if writer.warm_up_overlay(area_def, overlay,
+                                              self.product_config.attrib):
+                        num_overlays += 1
+                except Exception:
+                    LOGGER.exception("Could not render overlay %s for %s",
+                                     overlay, area_item.attrib["id"])
+            LOGGER.debug("Overlays of area %s warmed up",
+                         area_item.attrib["id"])
+
+        LOGGER.info("Warm-up done in %.1f s: %d areas, %d overlays",
+                    time.time() - start, len(ready), num_overlays)
+
     def cleanup(self):
         '''Cleanup Trollduction before shutdown.
         '''
@@ -1359,6 +2063,13 @@ class Trollduction(object):
                 if (msg.type in ["file", 'collection', 'dataset'] and
                     sensors.intersection(
                         self.td_config['instruments'].split(','))):
+                    pass_key = get_pass_key(msg.data)
+                    if (self.pass_index is not None and
+                            pass_key is not None and
+                            self.pass_index.is_pass_done(*pass_key)):
+                        LOGGER.info("Pass %s %s (area %s) was already "
+                                    "processed. Skipping.", *pass_key)
+                        continue
                     try:
                         if self.td_config.get('process_only_once',
                                               "false").lower() in \
@@ -1388,10 +2099,25 @@ class Trollduction(object):
                     self.update_product_config(
                         self.td_config['product_config_file'])
 
+                    checkpoint = None
+                    if self.pass_index is None:
+                        # Record the progress on this message, so that the
+                        # retry resumes where the failed attempt stopped.
+                        checkpoint = PassIndex(":memory:")
+                        self.data_processor.set_pass_index(checkpoint)
                     retried = False
                     while True:
                         try:
-                            self.data_processor.run(self.product_config, msg)
+                            product_keys = self.data_processor.run(
+                                self.product_config, msg)
+                            # The pass is done when all its products are
+                            # saved (or placed, when spooled).
+                            if (product_keys is not None and
+                                    self.pass_index is not None and
+                                    pass_key is not None):
+                                self.pass_index.mark_pass_done(
+                                    *pass_key, products=product_keys)
+                                self.pass_index.cleanup()
                             break
                         except IOError:
                             if retried:
@@ -1403,7 +2129,12 @@ class Trollduction(object):
                                 break
                             else:
                                 retried = True
-                                LOGGER.info("Retrying once in 2 seconds.")
+                                LOGGER.info("Retrying once in 2 seconds, "
+                                            "skipping the products already "
+                                            "done.")
                                 time.sleep(2)
+                    if checkpoint is not None:
+                        self.data_processor.set_pass_index(None)
+                        checkpoint.close()
         finally:
             self.shutdown()
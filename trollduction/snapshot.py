@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Snapshots of the state of the gatherers.
+
+The state is pickled to a file, atomically, so that it can be restored when
+the gatherer restarts.
+"""
+
+import cPickle as pickle
+import logging
+import os
+import tempfile
+
+LOGGER = logging.getLogger(__name__)
+
+
+def save(filename, state):
+    """Save *state* to *filename*, replacing the previous snapshot only once
+    the new one is complete.
+    """
+    tempfd, tempname = tempfile.mkstemp(dir=os.path.dirname(
+        os.path.abspath(filename)))
+    try:
+        with os.fdopen(tempfd, "wb") as fd_:
+            pickle.dump(state, fd_, pickle.HIGHEST_PROTOCOL)
+            fd_.flush()
+            os.fsync(fd_.fileno())
+        os.rename(tempname, filename)
+    except Exception:
+        LOGGER.exception("Could not save snapshot to %s", filename)
+        try:
+            os.remove(tempname)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def load(filename):
+    """Load the snapshot in *filename*, or return None if there is none or
+    it can't be read.
+    """
+    try:
+        with open(filename, "rb") as fd_:
+            return pickle.load(fd_)
+    except IOError:
+        LOGGER.debug("No snapshot in %s", filename)
+    except Exception:
+        LOGGER.exception("Could not load snapshot from %s", filename)
+    return None
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Local spool for the output files.
+
+The files are written to a local spool directory first, and moved to their
+(possibly slow, remote) destinations in the background.
+"""
+
+import logging
+import os
+import Queue
+import shutil
+import tempfile
+import time
+from threading import Thread
+
+LOGGER = logging.getLogger(__name__)
+
+
+def place_file(src, dst, mode=None):
+    """Copy *src* to *dst* through a temporary file in the destination
+    directory, so that *dst* appears only when it is complete and synced to
+    disk.
+    """
+    tempfd, tempname = tempfile.mkstemp(dir=os.path.dirname(dst))
+    try:
+        with os.fdopen(tempfd, "wb") as out_fd:
+            with open(src, "rb") as in_fd:
+                shutil.copyfileobj(in_fd, out_fd, 1024 * 1024)
+            out_fd.flush()
+            os.fsync(out_fd.fileno())
+        if mode is not None:
+            os.chmod(tempname, mode)
+        os.rename(tempname, dst)
+    except (IOError, OSError):
+        try:
+            os.remove(tempname)
+        except OSError:
+            pass
+        raise
+
+
+def clean_spool(spool_dir):
+    """Remove the files left in *spool_dir* by a previous run. Their
+    products were not recorded as done, so they are made again when their
+    pass is processed again.
+    """
+    for filename in os.listdir(spool_dir):
+        path = os.path.join(spool_dir, filename)
+        if not os.path.isfile(path):
+            continue
+        try:
+            os.remove(path)
+            LOGGER.warning("Removed %s left in the spool", path)
+        except OSError as err:
+            LOGGER.warning("Could not remove %s: %s", path, str(err))
+
+
+class SpoolMover(object):
+
+    """Move the spooled files to their destinations with *workers* threads.
+
+    Failed transfers are retried *retries* times, waiting *retry_delay*
+    seconds more after each failure. Files that can't be placed are left in
+    the spool.
+    """
+
+    def __init__(self, workers=2, retries=3, retry_delay=10, mode=None):
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.mode = mode
+        self.queue = Queue.Queue()
+        self._loop = True
+        self.threads = []
+        for _ in range(workers):
+            thread = Thread(target=self.run)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def place(self, src, destinations, callback=None):
+        """Copy the spooled file *src* to the *destinations*, a list of
+        (path, data) pairs, and remove it. *callback* is called with the
+        path and data of each destination once the file is in place.
+        """
+        self.queue.put((src, list(destinations), callback))
+
+    def run(self):
+        """Run a mover thread.
+        """
+        while self._loop:
+            try:
+                src, destinations, callback = self.queue.get(True, 1)
+            except Queue.Empty:
+                continue
+            try:
+                self._place(src, destinations, callback)
+            except Exception:
+                LOGGER.exception("Could not move %s", src)
+            finally:
+                self.queue.task_done()
+
+    def _place_one(self, src, dst):
+        """Place *src* at *dst*, retrying on failures. Return True on
+        success.
+        """
+        attempt = 0
+        while True:
+            try:
+                place_file(src, dst, self.mode)
+                LOGGER.debug("Moved %s to %s", src, dst)
+                return True
+            except (IOError, OSError) as err:
+                if attempt >= self.retries:
+                    LOGGER.error("Giving up moving %s to %s: %s",
+                                 src, dst, str(err))
+                    return False
+                attempt += 1
+                delay = self.retry_delay * attempt
+                LOGGER.warning("Could not move %s to %s (%s), retrying "
+                               "in %d s", src, dst, str(err), delay)
+                time.sleep(delay)
+
+    def _place(self, src, destinations, callback):
+        """Place *src* at all the *destinations*, and remove it if all went
+        well.
+        """
+        complete = True
+        for dst, data in destinations:
+            if not self._place_one(src, dst):
+                complete = False
+            elif callback is not None:
+                callback(dst, data)
+
+        if complete:
+            os.remove(src)
+        else:
+            LOGGER.warning("%s left in the spool", src)
+
+    def join(self):
+        """Wait for the pending files to be moved.
+        """
+        self.queue.join()
+
+    def stop(self):
+        """Stop the movers.
+        """
+        if not self.queue.empty():
+            LOGGER.warning("Stopping the movers with %d files still in the "
+                           "spool", self.queue.qsize())
+        self._loop = False
@@ -31,7 +31,19 @@ from trollduction.tests import (test_helper_functions,
                                 test_xml_read,
                                 test_scisys,
                                 test_trigger,
-                                test_producer)
+                                test_producer,
+                                test_image_writer,
+                                test_netcdf_writer,
+                                test_pass_index,
+                                test_listener,
+                                test_overlays,
+                                test_spool,
+                                test_area_cache,
+                                test_region_collector,
+                                test_region_index,
+                                test_orbits,
+                                test_snapshot,
+                                test_segment_gatherer)
 
 
 def suite():
@@ -47,5 +59,17 @@ def suite():
     mysuite.addTests(test_scisys.suite())
     mysuite.addTests(test_trigger.suite())
     mysuite.addTests(test_producer.suite())
+    mysuite.addTests(test_image_writer.suite())
+    mysuite.addTests(test_netcdf_writer.suite())
+    mysuite.addTests(test_pass_index.suite())
+    mysuite.addTests(test_listener.suite())
+    mysuite.addTests(test_overlays.suite())
+    mysuite.addTests(test_spool.suite())
+    mysuite.addTests(test_area_cache.suite())
+    mysuite.addTests(test_region_collector.suite())
+    mysuite.addTests(test_region_index.suite())
+    mysuite.addTests(test_orbits.suite())
+    mysuite.addTests(test_snapshot.suite())
+    mysuite.addTests(test_segment_gatherer.suite())
 
     return mysuite
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the area_cache.py module
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from mock import patch
+
+from trollduction import area_cache
+
+AREAS = """REGION: euro {
+        NAME:           Euro
+        PCS_ID:         ps60n
+        PCS_DEF:        proj=stere,ellps=bessel,lat_0=90,lon_0=14,lat_ts=60
+        XSIZE:          20
+        YSIZE:          20
+        AREA_EXTENT:    (-2717181.7304994687,-5571048.1403121399,1378818.2695005313,-1475048.1403121399)
+};
+"""
+
+
+class TestAreaCache(unittest.TestCase):
+
+    def setUp(self):
+        fd_, self.area_file = tempfile.mkstemp()
+        os.write(fd_, AREAS)
+        os.close(fd_)
+        self.patcher = patch("trollduction.area_cache.get_area_file",
+                             return_value=self.area_file)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        os.remove(self.area_file)
+
+    def test_get_area_def(self):
+        with patch("trollduction.area_cache.parse_area_file",
+                   wraps=area_cache.parse_area_file) as parse:
+            area_def = area_cache.get_area_def("euro")
+            self.assertEqual(area_def.x_size, 20)
+            self.assertTrue(area_cache.get_area_def("euro") is area_def)
+            self.assertEqual(parse.call_count, 1)
+
+            mtime = os.stat(self.area_file).st_mtime
+            os.utime(self.area_file, (mtime + 10, mtime + 10))
+            self.assertFalse(area_cache.get_area_def("euro") is area_def)
+            self.assertEqual(parse.call_count, 2)
+
+    def test_warm_up(self):
+        self.assertEqual(area_cache.warm_up(["euro", "nowhere"],
+                                            lonlats=True), ["euro"])
+        area_def = area_cache.get_area_def("euro")
+        self.assertTrue(hasattr(area_def, "poly"))
+        self.assertTrue(area_cache.get_boundary(area_def) is area_def.poly)
+        lons, lats = area_cache.get_lonlats(area_def)
+        self.assertEqual(lons.shape, (20, 20))
+        self.assertTrue(area_cache.get_lonlats(area_def)[0] is lons)
+
+    def test_disk_lonlats(self):
+        lonlat_dir = tempfile.mkdtemp()
+        try:
+            area_cache.set_lonlat_dir(lonlat_dir)
+            area_def = area_cache.get_area_def("euro")
+            lons, lats = area_cache.get_lonlats(area_def)
+            self.assertTrue(isinstance(lons, np.memmap))
+            self.assertEqual(lats.dtype, np.float32)
+            self.assertEqual(len(os.listdir(lonlat_dir)), 2)
+            ref_lons, ref_lats = area_def.get_lonlats()
+            self.assertTrue(np.allclose(lons, ref_lons))
+            self.assertTrue(np.allclose(lats, ref_lats))
+
+            # The grids are mapped copy-on-write for each user
+            lons[0, 0] = 1000
+            area_cache.attach_lonlats(area_def)
+            self.assertTrue(isinstance(area_def.lons, np.memmap))
+            self.assertTrue(np.allclose(area_def.lons, ref_lons))
+            self.assertTrue(np.allclose(
+                area_cache.get_lonlats(area_def)[0], ref_lons))
+        finally:
+            area_cache.set_lonlat_dir(None)
+            shutil.rmtree(lonlat_dir)
+
+
+def suite():
+    """The suite for test_area_cache
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(TestAreaCache))
+
+    return mysuite
@@ -24,7 +24,10 @@
 """
 
 import unittest
-from trollduction.helper_functions import overlapping_timeinterval
+from trollduction.helper_functions import (overlapping_timeinterval,
+                                           get_grid_offset,
+                                           get_downsampling_ratio)
+from pyresample.geometry import AreaDefinition
 from datetime import datetime, timedelta
 
 
@@ -74,12 +77,82 @@ class TestTimeUtilities(unittest.TestCase):
         pass
 
 
+class TestGridOffset(unittest.TestCase):
+
+    def setUp(self):
+        self.proj_dict = {"proj": "stere", "ellps": "WGS84",
+                          "lat_0": "90", "lon_0": "14", "lat_ts": "60"}
+        self.parent = AreaDefinition("euro", "euro", "stere", self.proj_dict,
+                                     1000, 800,
+                                     (-2000000, -4000000, 2000000, -800000))
+
+    def test_sub_window(self):
+        """Test grid-aligned sub-windows"""
+        child = AreaDefinition("scan", "scan", "stere", self.proj_dict,
+                               250, 200,
+                               (-1000000, -2000000, 0, -1200000))
+        self.assertEqual(get_grid_offset(self.parent, child), (100, 250))
+        self.assertEqual(get_grid_offset(self.parent, self.parent), (0, 0))
+        self.assertTrue(get_grid_offset(child, self.parent) is None)
+        # along the edge of the parent
+        child = AreaDefinition("scan", "scan", "stere", self.proj_dict,
+                               250, 200,
+                               (1000000, -2000000, 2000000, -1200000))
+        self.assertEqual(get_grid_offset(self.parent, child), (100, 750))
+
+    def test_not_aligned(self):
+        """Test areas that are not grid-aligned sub-windows"""
+        # half a pixel off
+        child = AreaDefinition("scan", "scan", "stere", self.proj_dict,
+                               250, 200,
+                               (-998000, -2000000, 2000, -1200000))
+        self.assertTrue(get_grid_offset(self.parent, child) is None)
+        # other resolution
+        child = AreaDefinition("scan", "scan", "stere", self.proj_dict,
+                               500, 400,
+                               (-1000000, -2000000, 0, -1200000))
+        self.assertTrue(get_grid_offset(self.parent, child) is None)
+        # other projection
+        proj_dict = self.proj_dict.copy()
+        proj_dict["lon_0"] = "15"
+        child = AreaDefinition("scan", "scan", "stere", proj_dict,
+                               250, 200,
+                               (-1000000, -2000000, 0, -1200000))
+        self.assertTrue(get_grid_offset(self.parent, child) is None)
+        # outside
+        child = AreaDefinition("scan", "scan", "stere", self.proj_dict,
+                               250, 200,
+                               (1004000, -2000000, 2004000, -1200000))
+        self.assertTrue(get_grid_offset(self.parent, child) is None)
+
+    def test_downsampling_ratio(self):
+        """Test the detection of lower resolution areas"""
+        child = AreaDefinition("euro4", "euro4", "stere", self.proj_dict,
+                               250, 200,
+                               (-2000000, -4000000, 2000000, -800000))
+        self.assertEqual(get_downsampling_ratio(self.parent, child), 4)
+        self.assertTrue(get_downsampling_ratio(child, self.parent) is None)
+        self.assertTrue(get_downsampling_ratio(self.parent,
+                                               self.parent) is None)
+        # not the same ratio in both directions
+        child = AreaDefinition("euro4", "euro4", "stere", self.proj_dict,
+                               250, 400,
+                               (-2000000, -4000000, 2000000, -800000))
+        self.assertTrue(get_downsampling_ratio(self.parent, child) is None)
+        # not the same extent
+        child = AreaDefinition("euro4", "euro4", "stere", self.proj_dict,
+                               250, 200,
+                               (-2000000, -4000000, 2000000, -900000))
+        self.assertTrue(get_downsampling_ratio(self.parent, child) is None)
+
+
 def suite():
     """The suite for test_trollduction
     """
     loader = unittest.TestLoader()
     mysuite = unittest.TestSuite()
     mysuite.addTest(loader.loadTestsFromTestCase(TestTimeUtilities))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestGridOffset))
 
     return mysuite
 
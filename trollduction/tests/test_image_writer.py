@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the image_writer.py module
+"""
+
+import unittest
+
+import numpy as np
+from mock import MagicMock
+
+from trollduction.image_writer import finalize_rows, get_band_count
+
+
+class TestFinalizeRows(unittest.TestCase):
+
+    def setUp(self):
+        data = np.linspace(0, 1.2, 20).reshape((4, 5))
+        mask = np.zeros((4, 5), dtype=bool)
+        mask[3, :] = True
+        self.chn = np.ma.array(data, mask=mask)
+
+    def test_l_with_alpha(self):
+        img = MagicMock(mode="L", fill_value=None, channels=[self.chn])
+        self.assertEqual(get_band_count(img), 2)
+        bands = finalize_rows(img, 2, 4)
+        self.assertEqual(len(bands), 2)
+        self.assertEqual(bands[0].dtype, np.uint8)
+        self.assertEqual(bands[0].shape, (2, 5))
+        self.assertTrue(np.all(bands[0] ==
+                               (self.chn.data[2:4].clip(0, 1) *
+                                255).astype(np.uint8)))
+        self.assertTrue(np.all(bands[1][0, :] == 255))
+        self.assertTrue(np.all(bands[1][1, :] == 0))
+
+    def test_rgb_with_fill_value(self):
+        img = MagicMock(mode="RGB", fill_value=(0, 0, 1.0),
+                        channels=[self.chn, self.chn, self.chn])
+        self.assertEqual(get_band_count(img), 3)
+        bands = finalize_rows(img, 0, 4)
+        self.assertEqual(len(bands), 3)
+        self.assertTrue(np.all(bands[0][3, :] == 0))
+        self.assertTrue(np.all(bands[2][3, :] == 255))
+
+    def test_rgba(self):
+        alpha = np.ma.array(np.ones((4, 5)) * 0.5,
+                            mask=np.zeros((4, 5), dtype=bool))
+        alpha.mask[0, 0] = True
+        img = MagicMock(mode="RGBA", fill_value=None,
+                        channels=[self.chn, self.chn, self.chn, alpha])
+        self.assertEqual(get_band_count(img), 4)
+        bands = finalize_rows(img, 0, 4)
+        self.assertEqual(len(bands), 4)
+        self.assertEqual(bands[3][0, 0], 0)
+        self.assertEqual(bands[3][0, 1], 127)
+        self.assertTrue(np.all(bands[3][3, :] == 0))
+
+
+def suite():
+    """The suite for test_image_writer
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(TestFinalizeRows))
+
+    return mysuite
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the listener.py module
+"""
+
+import unittest
+from datetime import datetime, timedelta
+
+from mock import MagicMock
+
+from trollduction.listener import PriorityMessageQueue
+
+
+def make_message(subject, minutes_ago):
+    """Make a message for data from *minutes_ago*.
+    """
+    start_time = datetime.utcnow() - timedelta(minutes=minutes_ago)
+    return MagicMock(subject=subject, data={"start_time": start_time})
+
+
+class TestPriorityMessageQueue(unittest.TestCase):
+
+    def test_newest_first(self):
+        queue = PriorityMessageQueue()
+        old = make_message("/hrpt", 30)
+        new = make_message("/hrpt", 10)
+        queue.put(old)
+        queue.put(new)
+        self.assertIs(queue.get(), new)
+        self.assertIs(queue.get(), old)
+        self.assertTrue(queue.empty())
+
+    def test_priorities(self):
+        queue = PriorityMessageQueue(priorities=[("/segment/*", 5),
+                                                 ("/hrpt*", -1)])
+        segment = make_message("/segment/SDR", 1)
+        hrpt = make_message("/hrpt", 30)
+        other = make_message("/other", 20)
+        for msg in [segment, other, hrpt]:
+            queue.put(msg)
+        self.assertEqual([queue.get() for _ in range(3)],
+                         [hrpt, other, segment])
+
+    def test_stale_messages(self):
+        # staleness comes from the data time, so the stale message gets the
+        # higher priority to be served first without the defer policy
+        priorities = [("/segment/*", -1)]
+        stale = make_message("/segment/SDR", 90)
+        fresh = make_message("/hrpt", 0)
+
+        queue = PriorityMessageQueue(priorities=priorities)
+        queue.put(stale)
+        queue.put(fresh)
+        self.assertIs(queue.get(), stale)
+        self.assertIs(queue.get(), fresh)
+
+        queue = PriorityMessageQueue(priorities=priorities,
+                                     max_age=timedelta(minutes=60))
+        queue.put(stale)
+        queue.put(fresh)
+        self.assertEqual(queue.qsize(), 2)
+        self.assertIs(queue.get(), fresh)
+        self.assertIs(queue.get(), stale)
+
+        queue = PriorityMessageQueue(priorities=priorities,
+                                     max_age=timedelta(minutes=60),
+                                     stale_policy="drop")
+        queue.put(stale)
+        queue.put(fresh)
+        self.assertEqual(queue.qsize(), 1)
+        self.assertIs(queue.get(), fresh)
+        self.assertTrue(queue.empty())
+
+
+def suite():
+    """The suite for test_listener
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(TestPriorityMessageQueue))
+
+    return mysuite
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the netcdf_writer.py module
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+from datetime import datetime
+
+import numpy as np
+from mock import MagicMock
+from netCDF4 import Dataset
+from pyresample.geometry import AreaDefinition
+
+from trollduction import netcdf_writer
+from trollduction.netcdf_writer import (FILL_VALUE, ChunkedCFWriter,
+                                        compress_chunk, get_scaling,
+                                        iter_chunks, pack)
+
+
+class TestPacking(unittest.TestCase):
+
+    def setUp(self):
+        data = np.linspace(-10, 30, 35).reshape((5, 7))
+        mask = np.zeros((5, 7), dtype=bool)
+        mask[0, :] = True
+        self.data = np.ma.array(data, mask=mask)
+
+    def test_scaling(self):
+        scale, offset = get_scaling(self.data)
+        packed = pack(self.data, (scale, offset), np.int16)
+        self.assertTrue(np.all(packed[0, :] == FILL_VALUE))
+        self.assertFalse(np.any(packed[1:, :] == FILL_VALUE))
+        unpacked = packed[1:, :] * scale + offset
+        self.assertTrue(np.allclose(unpacked, self.data[1:, :],
+                                    atol=scale))
+
+    def test_all_masked(self):
+        self.data.mask[:] = True
+        self.assertEqual(get_scaling(self.data), (1, 0))
+
+    def test_chunks(self):
+        offsets = list(iter_chunks(self.data.shape, (2, 4)))
+        self.assertEqual(offsets, [(0, 0), (0, 4), (2, 0), (2, 4),
+                                   (4, 0), (4, 4)])
+        scaling = get_scaling(self.data)
+        offset, chunk = compress_chunk((self.data, (4, 4), (2, 4), scaling,
+                                        np.int16, 6))
+        self.assertEqual(offset, (4, 4))
+        block = np.fromstring(zlib.decompress(chunk),
+                              dtype=np.int16).reshape((2, 4))
+        expected = pack(self.data[4:, 4:], scaling, np.int16)
+        self.assertTrue(np.all(block[0, :3] == expected[0]))
+        self.assertTrue(np.all(block[1, :] == 0))
+        self.assertTrue(np.all(block[:, 3] == 0))
+
+
+class TestChunkedCFWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        area = AreaDefinition("euro", "euro", "ps60n",
+                              {"proj": "stere",
+                               "ellps": "bessel",
+                               "lat_0": "90",
+                               "lon_0": "14",
+                               "lat_ts": "60"},
+                              30, 20,
+                              (-2717181.7304994687, -5571048.1403121399,
+                               1378818.2695005313, -1475048.1403121399))
+        self.scene = MagicMock()
+        self.scene.info = {"time": datetime(2016, 1, 1, 12)}
+        self.scene.fullname = "noaa19"
+        self.scene.instrument_name = "avhrr/3"
+        self.scene.time_slot = datetime(2016, 1, 1, 12)
+        self.scene.area = area
+        self.data = {}
+        channels = []
+        for idx, name in enumerate(["1", "4"]):
+            chn = MagicMock()
+            chn.name = name
+            chn.is_loaded.return_value = True
+            chn.area = area
+            chn.info = {"units": "%"}
+            chn.wavelength_range = (0.5, 0.6 + idx, 0.7 + idx)
+            chn.resolution = 1000
+            data = np.ma.array(np.linspace(idx, 100 + idx, 600).reshape(20,
+                                                                        30))
+            data[0, 0] = np.ma.masked
+            chn.data = data
+            self.data[name] = data
+            channels.append(chn)
+        self.scene.channels = channels
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check_file(self, filename):
+        rootgrp = Dataset(filename)
+        try:
+            for name, data in self.data.items():
+                var = rootgrp.variables["channel_" + name]
+                self.assertEqual(var.dimensions, ("y0", "x0"))
+                values = var[:]
+                self.assertTrue(values.mask[0, 0])
+                scale = var.scale_factor
+                self.assertTrue(np.allclose(values[1:], data[1:],
+                                            atol=scale))
+            self.assertTrue("time" in rootgrp.variables)
+            self.assertTrue("grid_mapping_0" in rootgrp.variables)
+        finally:
+            rootgrp.close()
+
+    def check_retry(self, writer):
+        """Check that *writer* can retry a failed save, and releases the data
+        once saved."""
+        self.assertRaises(IOError, writer.save,
+                          os.path.join(self.tmpdir, "missing", "first.nc"),
+                          compression=4)
+        filename = os.path.join(self.tmpdir, "second.nc")
+        writer.save(filename, compression=4)
+        self.check_file(filename)
+        self.assertTrue(all(chn["data"] is None
+                            for chn in writer._channels))
+        self.assertRaises(IOError, writer.save,
+                          os.path.join(self.tmpdir, "third.nc"))
+
+    def test_retry(self):
+        self.check_retry(ChunkedCFWriter(self.scene, chunks=(8, 16)))
+
+    @unittest.skipIf(netcdf_writer.h5py is None, "h5py is not installed")
+    def test_retry_h5py(self):
+        self.check_retry(ChunkedCFWriter(self.scene, chunks=(8, 16),
+                                         nthreads=3))
+
+
+def suite():
+    """The suite for test_netcdf_writer
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(TestPacking))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestChunkedCFWriter))
+
+    return mysuite
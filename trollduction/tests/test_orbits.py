@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the orbits.py module
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from mock import patch
+from pyorbital.orbital import Orbital
+
+from trollduction import orbits
+
+LINE1 = "1 33591U 09005A   16001.49547283  .00000081  00000-0  69658-4 0  9992"
+LINE2 = "2 33591  99.1180  17.5307 0014134 205.6106 154.4384 14.12207466356924"
+NEW_LINE1 = ("1 33591U 09005A   16002.49547283  .00000081  00000-0  "
+             "69658-4 0  9993")
+
+
+class TestOrbits(unittest.TestCase):
+
+    def setUp(self):
+        self.tle_dir = tempfile.mkdtemp()
+        self.patcher = patch.object(orbits, "DIR_CHECK_INTERVAL",
+                                    timedelta(0))
+        self.patcher.start()
+        orbits.set_tle_dir(self.tle_dir)
+
+    def tearDown(self):
+        self.patcher.stop()
+        orbits.set_tle_dir(None)
+        shutil.rmtree(self.tle_dir)
+
+    def write_tle(self, filename, line1, mtime):
+        filename = os.path.join(self.tle_dir, filename)
+        with open(filename, "w") as fd_:
+            fd_.write("\n".join(["NOAA 18", LINE1.replace("33591", "28654"),
+                                 "NOAA 19", line1, LINE2]) + "\n")
+        os.utime(filename, (mtime, mtime))
+
+    def test_get_orbital(self):
+        now = time.time()
+        self.assertRaises(KeyError, orbits.get_orbital, "NOAA-19")
+
+        self.write_tle("tle1.txt", LINE1, now - 20)
+        orb = orbits.get_orbital("NOAA-19")
+        self.assertEqual(orb.tle.line1, LINE1)
+        self.assertTrue(orbits.get_orbital("NOAA-19") is orb)
+
+        # a newer file with the same TLE keeps the orbital
+        self.write_tle("tle2.txt", LINE1, now - 10)
+        self.assertTrue(orbits.get_orbital("NOAA-19") is orb)
+
+        # a newer TLE replaces it
+        self.write_tle("tle3.txt", NEW_LINE1, now)
+        new_orb = orbits.get_orbital("NOAA-19")
+        self.assertFalse(new_orb is orb)
+        self.assertEqual(new_orb.tle.line1, NEW_LINE1)
+
+    def test_get_orbit_number(self):
+        orb = Orbital("NOAA 19", line1=LINE1, line2=LINE2)
+        start = datetime(2016, 1, 1, 5, 0)
+        for minutes in range(0, 120, 7):
+            utc_time = start + timedelta(minutes=minutes, seconds=13)
+            self.assertEqual(orbits.get_orbit_number(orb, utc_time),
+                             orb.get_orbit_number(utc_time))
+
+        with patch.object(orb, "get_orbit_number",
+                          wraps=orb.get_orbit_number) as get_orbit_number:
+            orbits.get_orbit_number(orb, start + timedelta(seconds=3))
+            orbits.get_orbit_number(orb, start + timedelta(seconds=7))
+            self.assertEqual(get_orbit_number.call_count, 2)
+
+
+def suite():
+    """The suite for test_orbits
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(TestOrbits))
+
+    return mysuite
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the overlays.py module
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from mock import MagicMock, patch
+
+from pyresample import geometry
+from trollduction.overlays import OverlayCache, blend
+
+AREA = geometry.AreaDefinition("areaD", "Europe (3km, HRV, VTC)", "areaD",
+                               {"a": "6378144.0", "b": "6356759.0",
+                                "lat_0": "50.00", "lat_ts": "50.00",
+                                "lon_0": "8.00", "proj": "stere"},
+                               4, 3,
+                               [-1370912.72, -909968.64,
+                                1029087.28, 1490031.36])
+
+
+def make_layer():
+    """Make a layer with a red, half transparent, first row.
+    """
+    layer = np.zeros((3, 4, 4), dtype=np.uint8)
+    layer[0, :, 0] = 255
+    layer[0, :, 3] = 127
+    return layer
+
+
+class TestBlend(unittest.TestCase):
+
+    def test_rgb(self):
+        chn = np.ma.array(np.ones((3, 4)) * 0.5,
+                          mask=np.zeros((3, 4), dtype=bool))
+        chn.mask[2, 2] = True
+        img = MagicMock(mode="RGB", fill_value=None,
+                        channels=[chn.copy(), chn.copy(), chn.copy()])
+        blend(img, make_layer())
+        self.assertTrue(np.allclose(img.channels[0][0, :],
+                                    0.5 * 128 / 255. + 127 / 255.))
+        self.assertTrue(np.allclose(img.channels[1][0, :], 0.5 * 128 / 255.))
+        self.assertTrue(np.allclose(img.channels[2][1, :], 0.5))
+        self.assertEqual(img.channels[2][2, 2], 0)
+        self.assertFalse(np.ma.is_masked(img.channels[2]))
+
+    def test_l(self):
+        img = MagicMock(mode="L", fill_value=None,
+                        channels=[np.ma.zeros((3, 4))])
+        blend(img, make_layer())
+        self.assertEqual(len(img.channels), 1)
+        self.assertTrue(np.allclose(img.channels[0][0, :],
+                                    0.299 * 127 / 255.))
+
+
+class TestOverlayCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    @patch("trollduction.overlays.render_coasts")
+    def test_get_layer(self, render_coasts):
+        render_coasts.return_value = make_layer()
+        cache = OverlayCache(self.cache_dir)
+        layer = cache.get_layer(AREA, "#FF0000", (255, 0, 0))
+        self.assertTrue(np.all(layer == make_layer()))
+        cache.get_layer(AREA, "#FF0000", (255, 0, 0))
+        self.assertEqual(render_coasts.call_count, 1)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        # a new cache reads the layer from disk
+        cache = OverlayCache(self.cache_dir)
+        layer = cache.get_layer(AREA, "#FF0000", (255, 0, 0))
+        self.assertEqual(render_coasts.call_count, 1)
+        self.assertTrue(np.all(layer == make_layer()))
+
+        # other colors are rendered separately
+        cache.get_layer(AREA, "#00FF00", (0, 255, 0))
+        self.assertEqual(render_coasts.call_count, 2)
+
+    @patch("trollduction.overlays.render_coasts")
+    def test_max_layers(self, render_coasts):
+        render_coasts.return_value = make_layer()
+        cache = OverlayCache(max_layers=1)
+        cache.get_layer(AREA, "#FF0000", (255, 0, 0))
+        cache.get_layer(AREA, "#00FF00", (0, 255, 0))
+        cache.get_layer(AREA, "#FF0000", (255, 0, 0))
+        self.assertEqual(render_coasts.call_count, 3)
+
+
+def suite():
+    """The suite for test_overlays
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(TestBlend))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestOverlayCache))
+
+    return mysuite
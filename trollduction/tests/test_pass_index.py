@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the pass_index.py module
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from trollduction.pass_index import PassIndex
+
+
+class TestPassIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "processed.db")
+        self.start_time = datetime.utcnow() - timedelta(hours=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_mark_done(self):
+        index = PassIndex(self.filename)
+        self.assertFalse(index.is_done("NOAA-19", self.start_time))
+        index.mark_done("NOAA-19", self.start_time, "euron1", "overview")
+        self.assertTrue(index.is_done("NOAA-19", self.start_time,
+                                      "euron1", "overview"))
+        self.assertFalse(index.is_done("NOAA-19", self.start_time,
+                                       "euron1", "green_snow"))
+        self.assertFalse(index.is_pass_done("NOAA-19", self.start_time))
+        index.mark_pass_done("NOAA-19", self.start_time, "euron1")
+        self.assertTrue(index.is_pass_done("NOAA-19", self.start_time,
+                                           "euron1"))
+        self.assertFalse(index.is_pass_done("NOAA-19", self.start_time))
+        self.assertFalse(index.is_done("NOAA-19", self.start_time,
+                                       "euron1"))
+        index.close()
+
+        # survives a restart
+        index = PassIndex(self.filename)
+        self.assertTrue(index.is_pass_done("NOAA-19", self.start_time,
+                                           "euron1"))
+        self.assertTrue(index.is_done("NOAA-19", self.start_time,
+                                      "euron1", "overview"))
+        index.close()
+
+    def test_pending_products(self):
+        index = PassIndex(self.filename)
+        products = [("NOAA-19", self.start_time, "euron1", "overview"),
+                    ("NOAA-19", self.start_time, "euron1", "green_snow")]
+        index.mark_done(*products[0])
+        index.mark_pass_done("NOAA-19", self.start_time, products=products)
+        self.assertFalse(index.is_pass_done("NOAA-19", self.start_time))
+        index.mark_done(*products[1])
+        self.assertTrue(index.is_pass_done("NOAA-19", self.start_time))
+
+        # a pass still waiting is not recorded
+        index.mark_pass_done("NOAA-19", self.start_time, "euron1",
+                             products=[("NOAA-19", self.start_time,
+                                        "euron1", "cloudtop")])
+        index.close()
+        index = PassIndex(self.filename)
+        self.assertTrue(index.is_pass_done("NOAA-19", self.start_time))
+        self.assertFalse(index.is_pass_done("NOAA-19", self.start_time,
+                                            "euron1"))
+        index.close()
+
+    def test_retention(self):
+        index = PassIndex(self.filename, retention=timedelta(hours=2))
+        old_time = self.start_time - timedelta(hours=2)
+        index.mark_done("NOAA-19", old_time, "euron1", "overview")
+        index.mark_pass_done("NOAA-19", old_time)
+        index.mark_pass_done("NOAA-19", self.start_time)
+        self.assertTrue(index.is_pass_done("NOAA-19", old_time))
+        index.cleanup()
+        self.assertFalse(index.is_pass_done("NOAA-19", old_time))
+        self.assertFalse(index.is_done("NOAA-19", old_time, "euron1",
+                                       "overview"))
+        self.assertTrue(index.is_pass_done("NOAA-19", self.start_time))
+        index.close()
+
+
+def suite():
+    """The suite for test_pass_index
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(TestPassIndex))
+
+    return mysuite
@@ -25,10 +25,20 @@
 
 
 from trollduction.producer import coverage, get_polygons_positions
-from trollduction.producer import check_uri
+from trollduction.producer import check_uri, get_segment_numbers
+from trollduction.producer import crop_scene, downsample
+from trollduction.producer import DataWriter
+from trollduction.producer import raster_coverage, get_coarse_area
+from trollduction.producer import DataProcessor, Trollduction
+from trollduction.producer import get_pass_key
+from trollduction.pass_index import PassIndex
+from trollduction.xml_read import ProductList
+from trollduction.tests.test_xml_read import xmlstuff
+from StringIO import StringIO
+from datetime import datetime
 import numpy as np
 import unittest
-from mock import MagicMock
+from mock import MagicMock, patch
 from pyresample.geometry import AreaDefinition
 
 
@@ -130,6 +140,122 @@ class TestPolygonCoverage(unittest.TestCase):
         self.assertEquals(0.44009280754700542, coverage(scene, mali))
 
 
+class TestRasterCoverage(unittest.TestCase):
+
+    def setUp(self):
+        self.mali = AreaDefinition("mali_area",
+                                   "mali_area",
+                                   "merc",
+                                   {"proj": "merc",
+                                    "ellps": "WGS84",
+                                    "lon_0": "-1.0",
+                                    "lat_0": "19.0"},
+                                   1024,
+                                   1024,
+                                   (-1224514.3987260093, 1111475.1028522244,
+                                    1224514.3987260093, 3228918.5790461157))
+
+    def test_coarse_area(self):
+        coarse = get_coarse_area(self.mali, 100)
+        self.assertEqual((coarse.x_size, coarse.y_size), (94, 94))
+        self.assertEqual(tuple(coarse.area_extent),
+                         tuple(self.mali.area_extent))
+        self.assertTrue(get_coarse_area(self.mali, 1024) is self.mali)
+
+    def test_raster_coverage(self):
+        chn = MagicMock()
+        chn.is_loaded.return_value = True
+        chn.shape = 3712, 3712
+        mask = np.zeros(chn.shape, dtype=bool)
+        mask[:1250, :] = True
+        mask[2500:, :] = True
+        mask[:, :1250] = True
+        mask[:, 2500:] = True
+        chn.data = np.ma.array(np.ones(chn.shape), mask=mask)
+        chn.area = AreaDefinition("chn_area",
+                                  "chn_area",
+                                  "geos 0.0",
+                                  {"proj": "geos",
+                                   "lon_0": "0.0",
+                                   "a": "6378169.00",
+                                   "b": "6356583.80",
+                                   "h": "35785831.0"},
+                                  3712,
+                                  3712,
+                                  [-5567248.074173444, -5570248.4773392612,
+                                   5570248.4773392612, 5567248.074173444])
+        scene = MagicMock()
+        scene.channels = (chn, )
+
+        # the polygon intersection gives 0.44
+        self.assertAlmostEqual(raster_coverage(scene, self.mali), 0.44,
+                               places=2)
+
+
+class TestSegmentNumbers(unittest.TestCase):
+
+    def setUp(self):
+        self.seviri = AreaDefinition("seviri",
+                                     "seviri",
+                                     "geos 0.0",
+                                     {"proj": "geos",
+                                      "lon_0": "0.0",
+                                      "a": "6378169.00",
+                                      "b": "6356583.80",
+                                      "h": "35785831.0"},
+                                     3712,
+                                     3712,
+                                     [-5570248.4773392612, -5567248.074173444,
+                                      5567248.074173444, 5570248.4773392612])
+        self.scan = AreaDefinition("scan",
+                                   "scan",
+                                   "stere",
+                                   {"proj": "stere",
+                                    "ellps": "WGS84",
+                                    "lat_0": "90",
+                                    "lon_0": "14",
+                                    "lat_ts": "60"},
+                                   512,
+                                   512,
+                                   (-1000000, -4500000, 1000000, -2500000))
+        self.mali = AreaDefinition("mali_area",
+                                   "mali_area",
+                                   "merc",
+                                   {"proj": "merc",
+                                    "ellps": "WGS84",
+                                    "lon_0": "-1.0",
+                                    "lat_0": "19.0"},
+                                   1024,
+                                   1024,
+                                   (-1224514.3987260093, 1111475.1028522244,
+                                    1224514.3987260093, 3228918.5790461157))
+
+    def test_get_segment_numbers(self):
+        self.assertEqual(get_segment_numbers([self.scan], self.seviri, 8),
+                         set([8]))
+        self.assertEqual(get_segment_numbers([self.scan], self.seviri, 24),
+                         set([22, 23, 24]))
+        self.assertEqual(get_segment_numbers([self.scan], self.seviri, 8,
+                                             north_first=True),
+                         set([1]))
+        self.assertEqual(get_segment_numbers([self.scan, self.mali],
+                                             self.seviri, 8),
+                         set([5, 6, 7, 8]))
+
+    def test_get_segment_numbers_outside_disk(self):
+        pole = AreaDefinition("pole",
+                              "pole",
+                              "stere",
+                              {"proj": "stere",
+                               "ellps": "WGS84",
+                               "lat_0": "90",
+                               "lon_0": "0"},
+                              100,
+                              100,
+                              (-3000000, -3000000, 3000000, 3000000))
+        self.assertTrue(get_segment_numbers([pole], self.seviri, 8) is None)
+
+
 class TestCheckUri(unittest.TestCase):
 
     def test_check_uri(self):
@@ -144,12 +270,238 @@ class TestCheckUri(unittest.TestCase):
             retv, "/san1/pps/import/PPS_data/source/metop01_20151016_1007_15964/hrpt_metop01_20151016_1007_15964.l1b")
 
 
+class TestCropScene(unittest.TestCase):
+
+    def test_crop_scene(self):
+        from datetime import datetime
+        from mpop.satellites import GenericFactory
+        proj_dict = {"proj": "stere", "ellps": "WGS84",
+                     "lat_0": "90", "lon_0": "14", "lat_ts": "60"}
+        parent = AreaDefinition("euro", "euro", "stere", proj_dict,
+                                10, 8, (-2000000, -4000000, 2000000, -800000))
+        child = AreaDefinition("scan", "scan", "stere", proj_dict,
+                               5, 4, (-1200000, -2800000, 800000, -1200000))
+        scene = GenericFactory.create_scene("meteosat", "10", "seviri",
+                                            datetime(2016, 1, 1), None)
+        scene.area = parent
+        scene["VIS006"] = np.ma.arange(80.0).reshape((8, 10))
+        scene["VIS006"].area = parent
+        scene.sun_zen = np.zeros((8, 10))
+
+        res = crop_scene(scene, child, (3, 2))
+        self.assertTrue(res.area is child)
+        self.assertTrue(res["VIS006"].area is child)
+        self.assertEqual(res["VIS006"].data.shape, (4, 5))
+        self.assertEqual(res["VIS006"].data[0, 0], 32)
+        self.assertFalse(hasattr(res, "sun_zen"))
+        # the data is shared
+        self.assertTrue(res["VIS006"].data.base is not None)
+        self.assertTrue(scene.area is parent)
+        self.assertTrue(scene["VIS006"].area is parent)
+        self.assertEqual(scene["VIS006"].data.shape, (8, 10))
+
+
+class TestDownsample(unittest.TestCase):
+
+    def setUp(self):
+        self.data = np.ma.arange(16.0).reshape((4, 4))
+        self.data[0, 0] = np.ma.masked
+        self.data[2:, 2:] = np.ma.masked
+
+    def test_decimate(self):
+        res = downsample(self.data, 2, "decimate")
+        self.assertTrue(np.all(res == [[5, 7], [13, 15]]))
+        self.assertTrue(res.mask[1, 1])
+
+    def test_average(self):
+        res = downsample(self.data, 2, "average")
+        self.assertEqual(res.shape, (2, 2))
+        self.assertAlmostEqual(res[0, 0], 10 / 3.0)
+        self.assertAlmostEqual(res[0, 1], 4.5)
+        self.assertAlmostEqual(res[1, 0], 10.5)
+        self.assertTrue(res.mask[1, 1])
+        self.assertFalse(res.mask[0, 0])
+
+        res = downsample(np.arange(16).reshape((4, 4)), 2, "average")
+        self.assertEqual(res.dtype, np.arange(1).dtype)
+        self.assertEqual(res[0, 0], 2)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, downsample, self.data, 2, "bicubic")
+
+
+class TestBacklogCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = DataWriter()
+        self.params = {"backlog_compression": "1",
+                       "backlog_size": "2",
+                       "backlog_age": "60"}
+
+    def test_no_backlog_option(self):
+        self.assertEqual(self.writer.get_compression({}, {}), 6)
+        self.assertEqual(self.writer.get_compression({"compression": "9"},
+                                                     {}), 9)
+        self.assertEqual(self.writer.get_compression({"compression": "x"},
+                                                     {}), 6)
+
+    def test_queue_size(self):
+        self.assertEqual(self.writer.get_compression({}, self.params), 6)
+        self.writer.prod_queue.put(None)
+        self.writer.prod_queue.put(None)
+        self.assertEqual(self.writer.get_compression({}, self.params), 1)
+        self.writer.prod_queue.get()
+        self.assertEqual(self.writer.get_compression({}, self.params), 6)
+
+    def test_age(self):
+        import time
+        self.params["queued_time"] = time.time() - 120
+        self.assertEqual(self.writer.get_compression({"compression": "0"},
+                                                     self.params), 0)
+        self.assertEqual(self.writer.get_compression({"compression": "9"},
+                                                     self.params), 1)
+
+
+class TestSpooledIndex(unittest.TestCase):
+
+    def test_placed(self):
+        writer = DataWriter(pass_index=PassIndex(":memory:"))
+        pub = MagicMock()
+        key = ("NOAA-19", datetime(2016, 1, 1), "euro", "overview")
+        pending = [2]
+        writer._placed(pub, key, pending, "/tmp/a.png", "msg a")
+        self.assertFalse(writer.pass_index.is_done(*key))
+        writer._placed(pub, key, pending, "/tmp/b.png", "msg b")
+        self.assertTrue(writer.pass_index.is_done(*key))
+        self.assertEqual(pub.send.call_count, 2)
+        writer.pass_index.close()
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def test_resume(self):
+        dproc = DataProcessor.__new__(DataProcessor)
+        dproc.product_config = ProductList(StringIO(xmlstuff))
+        dproc.writer = MagicMock()
+        dproc._product_keys = []
+        dproc.global_data = MagicMock(info={"platform_name": "NOAA-19",
+                                            "time": datetime(2016, 1, 1)})
+        dproc.local_data = MagicMock()
+        dproc.check_satellite = MagicMock(return_value=True)
+        dproc.check_sunzen = MagicMock(return_value=True)
+        checkpoint = PassIndex(":memory:")
+        dproc.set_pass_index(checkpoint)
+        self.assertTrue(dproc.writer.pass_index is checkpoint)
+
+        area = dproc.product_config.groups[0].data[0]
+        checkpoint.mark_done("NOAA-19", datetime(2016, 1, 1),
+                             "Europe_large", "overview")
+        with patch("trollduction.producer.get_area_def"):
+            dproc.draw_images(area)
+        written = [call[0][1].attrib["id"]
+                   for call in dproc.writer.write.call_args_list]
+        self.assertEqual(len(written), 6)
+        self.assertFalse("overview" in written)
+        self.assertEqual(len(dproc._product_keys), 6)
+        checkpoint.close()
+
+
+class TestPassKey(unittest.TestCase):
+
+    def setUp(self):
+        # Recent, to be kept by the cleanup of the pass index
+        self.start_time = datetime.utcnow().replace(microsecond=0)
+        self.mda = {"platform_name": "NOAA-19",
+                    "sensor": "avhrr/3",
+                    "start_time": self.start_time,
+                    "collection_area_id": "euro",
+                    "collection": [{"uri": "/tmp/hrpt_noaa19.l1b"}]}
+
+    def test_get_pass_key(self):
+        self.assertEqual(get_pass_key(self.mda),
+                         ("NOAA-19", self.start_time, "euro"))
+        del self.mda["collection_area_id"]
+        self.assertEqual(get_pass_key(self.mda),
+                         ("NOAA-19", self.start_time, None))
+        del self.mda["start_time"]
+        self.assertTrue(get_pass_key(self.mda) is None)
+
+    def make_trollduction(self, msg):
+        """Make a Trollduction getting *msg* from its listener."""
+        tdn = Trollduction.__new__(Trollduction)
+        tdn.td_config = {"instruments": "avhrr/3",
+                         "product_config_file": "product_config.xml"}
+        tdn.update_product_config = MagicMock()
+        tdn.product_config = None
+        tdn._previous_pass = {}
+        tdn.pass_index = PassIndex(":memory:")
+        tdn.listener = MagicMock()
+        tdn.listener.queue.get.side_effect = [msg, KeyboardInterrupt]
+        tdn.stop = MagicMock()
+        tdn.data_processor = MagicMock()
+        tdn._loop = True
+        return tdn
+
+    def test_skipped_collection(self):
+        msg = MagicMock(type="collection", data=self.mda)
+        dproc = DataProcessor.__new__(DataProcessor)
+        dproc.get_area_def_names = MagicMock(return_value=["scan"])
+        self.assertTrue(dproc.run(None, msg) is None)
+
+        tdn = self.make_trollduction(msg)
+        tdn.data_processor.run.side_effect = dproc.run
+        self.assertRaises(KeyboardInterrupt, tdn.run_single)
+        self.assertFalse(
+            tdn.pass_index.is_pass_done(*get_pass_key(self.mda)))
+
+        # nothing left to make
+        tdn.data_processor.run.side_effect = None
+        tdn.data_processor.run.return_value = []
+        tdn.listener.queue.get.side_effect = [msg, KeyboardInterrupt]
+        self.assertRaises(KeyboardInterrupt, tdn.run_single)
+        self.assertTrue(tdn.pass_index.is_pass_done(*get_pass_key(self.mda)))
+        self.assertFalse(tdn.pass_index.is_done(self.mda["platform_name"],
+                                                self.mda["start_time"],
+                                                "euro"))
+        tdn.pass_index.close()
+
+    def test_pending_products(self):
+        msg = MagicMock(type="collection", data=self.mda)
+        tdn = self.make_trollduction(msg)
+        product_keys = [("NOAA-19", self.start_time, "Europe", "overview"),
+                        ("NOAA-19", self.start_time, "Europe", "green_snow")]
+        tdn.data_processor.run.return_value = product_keys
+        self.assertRaises(KeyboardInterrupt, tdn.run_single)
+        pass_key = get_pass_key(self.mda)
+        self.assertFalse(tdn.pass_index.is_pass_done(*pass_key))
+
+        # the pass is processed again while a product is missing
+        tdn.listener.queue.get.side_effect = [msg, KeyboardInterrupt]
+        tdn.pass_index.mark_done(*product_keys[0])
+        self.assertRaises(KeyboardInterrupt, tdn.run_single)
+        self.assertEqual(tdn.data_processor.run.call_count, 2)
+        self.assertFalse(tdn.pass_index.is_pass_done(*pass_key))
+
+        # and is done once the last one is saved
+        tdn.pass_index.mark_done(*product_keys[1])
+        self.assertTrue(tdn.pass_index.is_pass_done(*pass_key))
+        tdn.pass_index.close()
+
+
 def suite():
     """The suite for test_xml_read
     """
     loader = unittest.TestLoader()
     mysuite = unittest.TestSuite()
     mysuite.addTest(loader.loadTestsFromTestCase(TestPolygonCoverage))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestRasterCoverage))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestSegmentNumbers))
     mysuite.addTest(loader.loadTestsFromTestCase(TestCheckUri))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestCropScene))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestDownsample))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestBacklogCompression))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestSpooledIndex))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestCheckpoint))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestPassKey))
 
     return mysuite
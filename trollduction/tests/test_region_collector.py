@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the region_collector.py module
+"""
+
+import cPickle as pickle
+import unittest
+from datetime import datetime, timedelta
+
+from mock import patch
+from pyorbital.orbital import Orbital
+from pyresample.geometry import AreaDefinition
+
+from trollduction.collectors import region_collector
+
+LINE1 = "1 33591U 09005A   16001.49547283  .00000081  00000-0  69658-4 0  9992"
+LINE2 = "2 33591  99.1180  17.5307 0014134 205.6106 154.4384 14.12207466356924"
+
+
+class TestPredictGranules(unittest.TestCase):
+
+    def setUp(self):
+        self.orb = Orbital("NOAA 19", line1=LINE1, line2=LINE2)
+        self.patcher = patch.object(region_collector, "get_orbital",
+                                    return_value=self.orb)
+        self.patcher.start()
+        self.euro = AreaDefinition("euro", "euro", "ps60n",
+                                   {"proj": "stere",
+                                    "ellps": "bessel",
+                                    "lat_0": "90",
+                                    "lon_0": "14",
+                                    "lat_ts": "60"},
+                                   100, 100,
+                                   (-2717181.7304994687, -5571048.1403121399,
+                                    1378818.2695005313, -1475048.1403121399))
+        region_collector._PLANS.clear()
+        region_collector._SWATHS.clear()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_predict(self):
+        start_time = datetime(2016, 1, 1, 5, 43)
+        duration = timedelta(minutes=1)
+        planned = region_collector.predict_granules("NOAA-19", "avhrr/3",
+                                                    self.euro, start_time,
+                                                    duration)
+        self.assertEqual(sorted(planned),
+                         [datetime(2016, 1, 1, 5, 34) + idx * duration
+                          for idx in range(12)])
+
+        # the prediction is reused for the same pass
+        with patch.object(region_collector,
+                          "iter_covering_granules") as iter_covering:
+            self.assertEqual(region_collector.predict_granules(
+                "NOAA-19", "avhrr/3", self.euro,
+                datetime(2016, 1, 1, 5, 35), duration), planned)
+            self.assertFalse(iter_covering.called)
+
+    def test_granule_durations(self):
+        start_time = datetime(2016, 1, 1, 5, 40)
+        planned = region_collector.predict_granules("NOAA-19", "avhrr/3",
+                                                    self.euro, start_time,
+                                                    timedelta(minutes=1))
+        self.assertEqual(len(planned), 12)
+
+        # granules of another length get their own plan
+        planned = region_collector.predict_granules("NOAA-19", "avhrr/3",
+                                                    self.euro, start_time,
+                                                    timedelta(minutes=3))
+        self.assertEqual(sorted(planned),
+                         [datetime(2016, 1, 1, 5, 34) + idx *
+                          timedelta(minutes=3) for idx in range(4)])
+
+    def test_collect(self):
+        collector = region_collector.RegionCollector(self.euro)
+        mda = {"platform_name": "NOAA-19",
+               "sensor": "avhrr/3",
+               "uri": "/tmp/granule",
+               "start_time": datetime(2016, 1, 1, 5, 43),
+               "end_time": datetime(2016, 1, 1, 5, 44)}
+        self.assertTrue(collector(mda) is None)
+        self.assertEqual(len(collector.planned_granule_times), 12)
+        self.assertEqual(collector.timeout,
+                         datetime(2016, 1, 1, 5, 46) +
+                         timedelta(seconds=600))
+
+        mda = mda.copy()
+        mda["start_time"] = datetime(2016, 1, 1, 6, 43)
+        mda["end_time"] = datetime(2016, 1, 1, 6, 44)
+        self.assertTrue(collector(mda) is None)
+        self.assertEqual(len(collector.granules), 1)
+
+    def test_complete(self):
+        collector = region_collector.RegionCollector(self.euro)
+        duration = timedelta(minutes=1)
+        first = datetime(2016, 1, 1, 5, 34)
+        order = [9, 3, 11, 0, 10, 1, 2, 4, 5, 6, 7, 8]
+        for nb, idx in enumerate(order):
+            # the granules are matched within a tolerance
+            start_time = first + idx * duration + timedelta(seconds=nb % 2)
+            mda = {"platform_name": "NOAA-19",
+                   "sensor": "avhrr/3",
+                   "uri": "/tmp/granule%d" % idx,
+                   "start_time": start_time,
+                   "end_time": start_time + duration}
+            res = collector(mda)
+            if nb < len(order) - 1:
+                self.assertTrue(res is None)
+            if nb == 2:
+                # the timeout follows the latest missing granule
+                self.assertEqual(collector.timeout,
+                                 first + 11 * duration + timedelta(seconds=600))
+            if nb == 4:
+                self.assertEqual(collector.timeout,
+                                 first + 9 * duration + timedelta(seconds=600))
+        self.assertEqual(len(res), 12)
+        self.assertEqual(collector.planned_granule_times, [])
+
+    def test_concurrent(self):
+        collector = region_collector.RegionCollector(self.euro)
+        duration = timedelta(minutes=1)
+        first = datetime(2016, 1, 1, 5, 34)
+        for idx in range(12):
+            for platform in ["NOAA-19", "NOAA-18"]:
+                if platform == "NOAA-18" and idx == 11:
+                    continue
+                mda = {"platform_name": platform,
+                       "sensor": "avhrr/3",
+                       "uri": "/tmp/%s_granule%d" % (platform, idx),
+                       "start_time": first + idx * duration,
+                       "end_time": first + (idx + 1) * duration}
+                res = collector(mda)
+                if idx < 11:
+                    self.assertTrue(res is None)
+        self.assertEqual(len(res), 12)
+        self.assertTrue(all(granule["platform_name"] == "NOAA-19"
+                            for granule in res))
+
+        # the other pass is still being collected
+        self.assertEqual(len(collector.collections), 1)
+        self.assertEqual(len(collector.granules), 11)
+        self.assertEqual(collector.timeout,
+                         first + 11 * duration + duration +
+                         timedelta(seconds=600))
+        res = collector.finish()
+        self.assertEqual(len(res), 11)
+        self.assertTrue(collector.timeout is None)
+
+    def test_misaligned(self):
+        collector = region_collector.RegionCollector(self.euro)
+        duration = timedelta(minutes=1)
+        first = datetime(2016, 1, 1, 5, 34)
+        for start_time in [first, first + timedelta(seconds=30),
+                           first + timedelta(minutes=6, seconds=30)]:
+            mda = {"platform_name": "NOAA-19",
+                   "sensor": "avhrr/3",
+                   "uri": "/tmp/granule",
+                   "start_time": start_time,
+                   "end_time": start_time + duration}
+            self.assertTrue(collector(mda) is None)
+        # the misaligned granules go to the collection of the pass
+        self.assertEqual(len(collector.collections), 1)
+        self.assertEqual(len(collector.granules), 3)
+
+    def test_restore(self):
+        collector = region_collector.RegionCollector(self.euro)
+        duration = timedelta(minutes=1)
+        first = datetime(2016, 1, 1, 5, 34)
+        granules = [{"platform_name": "NOAA-19",
+                     "sensor": "avhrr/3",
+                     "uri": "/tmp/granule%d" % idx,
+                     "start_time": first + idx * duration,
+                     "end_time": first + (idx + 1) * duration}
+                    for idx in range(12)]
+        for granule in granules[:6]:
+            collector(granule)
+
+        collections = pickle.loads(pickle.dumps(collector.collections))
+        restored = region_collector.RegionCollector(
+            self.euro, timeliness=timedelta(seconds=60))
+        restored.restore(collections)
+        self.assertEqual(restored.timeout,
+                         first + 12 * duration + timedelta(seconds=60))
+        for granule in granules[6:11]:
+            self.assertTrue(restored(granule) is None)
+        self.assertEqual(len(restored(granules[11])), 12)
+
+
+def suite():
+    """The suite for test_region_collector
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(TestPredictGranules))
+
+    return mysuite
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the region_index.py module
+"""
+
+import unittest
+from datetime import datetime
+
+from mock import MagicMock, patch
+from pyorbital.orbital import Orbital
+from pyresample.geometry import AreaDefinition
+
+from trollduction.collectors import region_collector, region_index
+
+LINE1 = "1 33591U 09005A   16001.49547283  .00000081  00000-0  69658-4 0  9992"
+LINE2 = "2 33591  99.1180  17.5307 0014134 205.6106 154.4384 14.12207466356924"
+
+
+def make_collector(region, granules=None):
+    """Make a fake collector of *region*.
+    """
+    collector = MagicMock()
+    collector.region = region
+    collector.granules = granules or []
+    return collector
+
+
+class TestRegionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.orb = Orbital("NOAA 19", line1=LINE1, line2=LINE2)
+        self.patcher = patch.object(region_collector, "get_orbital",
+                                    return_value=self.orb)
+        self.patcher.start()
+        region_collector._SWATHS.clear()
+        self.euro = AreaDefinition("euro", "euro", "ps60n",
+                                   {"proj": "stere",
+                                    "ellps": "bessel",
+                                    "lat_0": "90",
+                                    "lon_0": "14",
+                                    "lat_ts": "60"},
+                                   100, 100,
+                                   (-2717181.7304994687, -5571048.1403121399,
+                                    1378818.2695005313, -1475048.1403121399))
+        self.pacific = AreaDefinition("pacific", "pacific", "pacific",
+                                      {"proj": "eqc", "ellps": "WGS84",
+                                       "lon_0": "180"},
+                                      100, 100,
+                                      (-2226389.8, -2226389.8,
+                                       2226389.8, 2226389.8))
+        self.arctic = AreaDefinition("arctic", "arctic", "arctic",
+                                     {"proj": "stere", "ellps": "WGS84",
+                                      "lat_0": "90", "lon_0": "0"},
+                                     100, 100,
+                                     (-1000000, -1000000, 1000000, 1000000))
+        self.mda = {"platform_name": "NOAA-19",
+                    "sensor": ["avhrr/3"],
+                    "uri": "/tmp/granule",
+                    "start_time": datetime(2016, 1, 1, 5, 40),
+                    "end_time": datetime(2016, 1, 1, 5, 41)}
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_lon_intervals(self):
+        self.assertEqual(region_index.get_lon_intervals([10, 20, 15]),
+                         [(10, 20)])
+        self.assertEqual(region_index.get_lon_intervals([170, -170, 175]),
+                         [(170, 180), (-180, -170)])
+        self.assertEqual(region_index.get_lon_intervals(range(-180, 180, 3),
+                                                        2),
+                         [(-180, 180)])
+
+    def test_boxes(self):
+        index = region_index.RegionIndex([self.euro, self.pacific,
+                                          self.arctic])
+        pacific = index.boxes["pacific"]
+        self.assertEqual(len(pacific.lon_intervals), 2)
+        self.assertFalse(pacific.intersects(index.boxes["euro"]))
+        arctic = index.boxes["arctic"]
+        self.assertEqual(arctic.lat_max, 90)
+        self.assertEqual(arctic.lon_intervals, [(-180, 180)])
+        self.assertTrue(arctic.intersects(index.boxes["euro"]))
+
+    def test_select(self):
+        index = region_index.RegionIndex([self.euro, self.pacific,
+                                          self.arctic])
+        euro = make_collector(self.euro)
+        pacific = make_collector(self.pacific)
+        arctic = make_collector(self.arctic)
+        collectors = [euro, pacific, arctic]
+        self.assertEqual(index.select(collectors, self.mda), [euro])
+
+        # collectors already collecting always get the granules
+        pacific.granules.append(self.mda)
+        self.assertEqual(index.select(collectors, self.mda),
+                         [euro, pacific])
+
+        # without footprint, all the collectors get the granules
+        mda = self.mda.copy()
+        del mda["end_time"]
+        self.assertEqual(index.select(collectors, mda), collectors)
+
+    def test_single_propagation(self):
+        scandinavia = AreaDefinition("scan", "scan", "ps60n",
+                                     self.euro.proj_dict, 100, 100,
+                                     (-1000000, -4000000, 1000000, -2000000))
+        index = region_index.RegionIndex([self.euro, scandinavia])
+        collectors = [region_collector.RegionCollector(self.euro),
+                      region_collector.RegionCollector(scandinavia)]
+        with patch.object(region_collector, "get_swath_points",
+                          wraps=region_collector.get_swath_points) as points:
+            selected = index.select(collectors, self.mda)
+            self.assertEqual(len(selected), 2)
+            for collector in selected:
+                collector(self.mda.copy())
+            # the planning propagates the orbit too, but the granule
+            # itself is only computed once
+            calls = [call for call in points.call_args_list
+                     if call[0][2] == self.mda["start_time"]]
+            self.assertEqual(len(calls), 1)
+        for collector in collectors:
+            self.assertEqual(len(collector.collections), 1)
+
+
+def suite():
+    """The suite for test_region_index
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(TestRegionIndex))
+
+    return mysuite
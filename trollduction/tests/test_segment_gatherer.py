@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the bin/segment_gatherer.py script
+"""
+
+import datetime as dt
+import imp
+import os
+import Queue
+import shutil
+import tempfile
+import unittest
+from ConfigParser import RawConfigParser
+from StringIO import StringIO
+
+from mock import MagicMock, patch
+
+segment_gatherer = imp.load_source(
+    "segment_gatherer",
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                 "bin", "segment_gatherer.py"))
+
+CONFIG = """[msg]
+pattern = H-000-{orig_platform_name:4s}__-{orig_platform_name:4s}________-{channel_name:_<9s}-{segment:_<9s}-{start_time:%Y%m%d%H%M}-{compression:1s}_
+critical_files = :EPI,:PRO
+wanted_files = VIS006:1-8,:PRO,:EPI,IR_108:8
+all_files = VIS006:1-8,IR_108:3-8,:PRO,:EPI
+variable_tags = compression
+time_name = start_time
+timeliness = 600
+topics = /foo/bar
+publish_topic = /dataset/msg
+"""
+
+FILENAME = "H-000-MSG3__-MSG3________-VIS006___-000003___-201601011200-C_"
+
+
+def old_compose_filenames(parser, metadata, itm_str, variable_tags):
+    """Compose the filenames from the item string as the segment gatherer
+    used to, parsing the string for each slot."""
+    result = set()
+    meta = metadata.copy()
+    for key in variable_tags:
+        meta.pop(key, None)
+    for itm in itm_str.split(','):
+        channel_name, segments = itm.split(':')
+        segments = segments.split('-')
+        if len(segments) > 1:
+            segments = ['%d' % i for i in range(int(segments[0]),
+                                                int(segments[-1]) + 1)]
+        meta['channel_name'] = channel_name
+        for seg in segments:
+            meta['segment'] = seg
+            result.add(parser.globify(meta))
+    return result
+
+
+def make_gatherer(config_str=CONFIG, snapshot_file=None):
+    """Make a segment gatherer from *config_str*, without connecting it."""
+    config = RawConfigParser()
+    config.readfp(StringIO(config_str))
+    with patch.object(segment_gatherer, "ListenerContainer"), \
+            patch.object(segment_gatherer, "publisher"):
+        return segment_gatherer.SegmentGatherer(config, "msg", snapshot_file)
+
+
+class TestParseItems(unittest.TestCase):
+
+    def test_segments(self):
+        self.assertEqual(segment_gatherer._parse_items(":PRO,:EPI"),
+                         [("", "PRO"), ("", "EPI")])
+        self.assertEqual(segment_gatherer._parse_items("VIS006:8,IR_108:3"),
+                         [("VIS006", "8"), ("IR_108", "3")])
+
+    def test_ranges(self):
+        self.assertEqual(segment_gatherer._parse_items("VIS008:1-3,:PRO"),
+                         [("VIS008", "1"), ("VIS008", "2"),
+                          ("VIS008", "3"), ("", "PRO")])
+        self.assertEqual(segment_gatherer._parse_items("HRV:5-5"),
+                         [("HRV", "5")])
+
+    def test_malformed(self):
+        self.assertRaises(ValueError, segment_gatherer._parse_items,
+                          "VIS006")
+        self.assertRaises(ValueError, segment_gatherer._parse_items,
+                          "VIS006:1-a")
+        self.assertRaises(ValueError, segment_gatherer._parse_items,
+                          "VIS006:1:2")
+
+    def test_config(self):
+        gatherer = make_gatherer()
+        self.assertEqual(gatherer._critical_items, [("", "EPI"), ("", "PRO")])
+        self.assertEqual(len(gatherer._wanted_items), 11)
+        self.assertEqual(len(gatherer._all_items), 16)
+        self.assertEqual(gatherer._variable_tags, ["compression"])
+
+        gatherer = make_gatherer(CONFIG.replace("critical_files = :EPI,:PRO",
+                                                "critical_files = ")
+                                 .replace("variable_tags = compression\n",
+                                          ""))
+        self.assertEqual(gatherer._critical_items, [])
+        self.assertEqual(gatherer._variable_tags, [])
+
+
+class TestSlots(unittest.TestCase):
+
+    def setUp(self):
+        self.gatherer = make_gatherer()
+        self.mda = self.gatherer._parser.parse(FILENAME)
+        self.msg = MagicMock()
+        self.msg.data = {"uid": FILENAME,
+                         "uri": "/data/" + FILENAME,
+                         "platform_name": "Meteosat-10",
+                         "sensor": "seviri"}
+
+    def test_init_data(self):
+        self.gatherer._init_data(self.msg, self.mda)
+        time_slot = str(self.mda["start_time"])
+        slot = self.gatherer.slots[time_slot]
+
+        parser = self.gatherer._parser
+        metadata = slot["metadata"]
+        for key in ["critical_files", "wanted_files", "all_files"]:
+            expected = old_compose_filenames(parser, metadata,
+                                             self.gatherer._config.get(
+                                                 "msg", key),
+                                             ["compression"])
+            self.assertEqual(slot[key], expected)
+        self.assertEqual(len(slot["all_files"]), 16)
+        self.assertTrue(slot["critical_files"].issubset(slot["all_files"]))
+        for fname in slot["all_files"]:
+            self.assertTrue(fname.endswith("-?_"))
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.snapshot_file = os.path.join(self.tmpdir, "slots.pickle")
+        self.gatherer = make_gatherer(snapshot_file=self.snapshot_file)
+        self.msg = MagicMock()
+        self.msg.data = {"uid": FILENAME,
+                         "uri": "/data/" + FILENAME,
+                         "platform_name": "Meteosat-10",
+                         "sensor": "seviri"}
+        self.gatherer._init_data(self.msg,
+                                 self.gatherer._parser.parse(FILENAME))
+        self.time_slot = self.gatherer.slots.keys()[0]
+        self.timeout = dt.datetime(2016, 1, 1, 12, 15)
+        self.gatherer.slots[self.time_slot]['timeout'] = self.timeout
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        self.gatherer.save_snapshot()
+
+        restored = make_gatherer(snapshot_file=self.snapshot_file)
+        restored.load_snapshot()
+        self.assertEqual(restored.slots, self.gatherer.slots)
+
+        # A longer timeliness delays the restored timeouts accordingly
+        restored = make_gatherer(CONFIG.replace("timeliness = 600",
+                                                "timeliness = 900"),
+                                 snapshot_file=self.snapshot_file)
+        restored.load_snapshot()
+        slot = restored.slots[self.time_slot]
+        self.assertEqual(slot['timeout'],
+                         self.timeout + dt.timedelta(seconds=300))
+        self.assertEqual(slot['all_files'],
+                         self.gatherer.slots[self.time_slot]['all_files'])
+
+    def test_no_snapshot(self):
+        restored = make_gatherer(snapshot_file=self.snapshot_file)
+        restored.load_snapshot()
+        self.assertEqual(len(restored.slots), 0)
+
+    def test_saved_on_exit(self):
+        gatherer = self.gatherer
+
+        def stop(*args):
+            """Stop the gatherer, as from another thread."""
+            del args
+            gatherer.stop()
+            self.assertFalse(os.path.exists(self.snapshot_file))
+            raise Queue.Empty
+
+        gatherer._listener.queue.get.side_effect = stop
+        gatherer.slots[self.time_slot]['timeout'] = \
+            dt.datetime.utcnow() + dt.timedelta(hours=1)
+        slots = gatherer.slots.copy()
+        gatherer.run()
+
+        restored = make_gatherer(snapshot_file=self.snapshot_file)
+        restored.load_snapshot()
+        self.assertEqual(restored.slots, slots)
+
+
+def suite():
+    """The suite for test_segment_gatherer
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(TestParseItems))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestSlots))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestSnapshot))
+
+    return mysuite
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the snapshot.py module
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from trollduction import snapshot
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "gatherer.snapshot")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_load(self):
+        self.assertTrue(snapshot.load(self.filename) is None)
+        state = {"slots": {"2016-01-01 12:00:00":
+                           {"received_files": set(["a", "b"]),
+                            "timeout": datetime(2016, 1, 1, 12, 20)}}}
+        self.assertTrue(snapshot.save(self.filename, state))
+        self.assertEqual(snapshot.load(self.filename), state)
+        self.assertEqual(os.listdir(self.tmpdir), ["gatherer.snapshot"])
+
+    def test_failures(self):
+        snapshot.save(self.filename, {"a": 1})
+        # unpicklable states leave the previous snapshot
+        self.assertFalse(snapshot.save(self.filename, {"a": lambda: 1}))
+        self.assertEqual(snapshot.load(self.filename), {"a": 1})
+        self.assertEqual(os.listdir(self.tmpdir), ["gatherer.snapshot"])
+
+        with open(self.filename, "wb") as fd_:
+            fd_.write("garbage")
+        self.assertTrue(snapshot.load(self.filename) is None)
+
+
+def suite():
+    """The suite for test_snapshot
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(TestSnapshot))
+
+    return mysuite
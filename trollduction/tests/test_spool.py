@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2016
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the spool.py module
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from trollduction.spool import SpoolMover, clean_spool, place_file
+
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.spool = os.path.join(self.tmpdir, "spool")
+        os.mkdir(self.spool)
+        self.src = os.path.join(self.spool, "image.png")
+        with open(self.src, "wb") as fd_:
+            fd_.write("data")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_place_file(self):
+        dst = os.path.join(self.tmpdir, "out.png")
+        place_file(self.src, dst, int("640", 8))
+        with open(dst, "rb") as fd_:
+            self.assertEqual(fd_.read(), "data")
+        self.assertEqual(os.stat(dst).st_mode & int("777", 8),
+                         int("640", 8))
+        self.assertTrue(os.path.exists(self.src))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ["out.png", "spool"])
+
+    def test_mover(self):
+        dst1 = os.path.join(self.tmpdir, "out1.png")
+        dst2 = os.path.join(self.tmpdir, "out2.png")
+        placed = []
+        mover = SpoolMover(workers=1)
+        mover.place(self.src, [(dst1, 1), (dst2, 2)],
+                    lambda fname, data: placed.append((fname, data)))
+        mover.join()
+        mover.stop()
+        self.assertEqual(placed, [(dst1, 1), (dst2, 2)])
+        self.assertTrue(os.path.exists(dst1))
+        self.assertTrue(os.path.exists(dst2))
+        self.assertFalse(os.path.exists(self.src))
+
+    def test_give_up(self):
+        dst1 = os.path.join(self.tmpdir, "missing", "out1.png")
+        dst2 = os.path.join(self.tmpdir, "out2.png")
+        placed = []
+        mover = SpoolMover(workers=1, retries=1, retry_delay=0)
+        mover.place(self.src, [(dst1, 1), (dst2, 2)],
+                    lambda fname, data: placed.append((fname, data)))
+        mover.join()
+        mover.stop()
+        self.assertEqual(placed, [(dst2, 2)])
+        self.assertTrue(os.path.exists(self.src))
+
+    def test_clean_spool(self):
+        os.mkdir(os.path.join(self.spool, "subdir"))
+        clean_spool(self.spool)
+        self.assertEqual(os.listdir(self.spool), ["subdir"])
+
+
+def suite():
+    """The suite for test_spool
+    """
+    loader = unittest.TestLoader()
+    mysuite = unittest.TestSuite()
+    mysuite.addTest(loader.loadTestsFromTestCase(TestSpool))
+
+    return mysuite
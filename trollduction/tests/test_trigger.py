@@ -24,8 +24,9 @@
 """
 
 import unittest
-from mock import patch
-from trollduction.collectors.trigger import PostTrollTrigger
+from mock import MagicMock, patch
+from trollduction.collectors.trigger import (PostTrollTrigger, FileTrigger,
+                                             TimeoutScheduler, PatternMatcher)
 from datetime import datetime, timedelta
 import time
 
@@ -62,6 +63,111 @@ class TestPostTrollTrigger(unittest.TestCase):
         ptt.stop()
         self.assertTrue(collector.timeout is None)
 
+    @patch('trollduction.collectors.trigger.NSSubscriber')
+    def test_batch(self, nssub):
+        collector = FakeCollector(None)
+        batches = []
+        ptt = PostTrollTrigger([collector], None, None, None,
+                               publish_topic=None, max_batch=10)
+        ptt.scheduler = MagicMock()
+        add_files = ptt.add_files
+
+        def _add_files(msgs):
+            batches.append(len(msgs))
+            add_files(msgs)
+        ptt.msgproc.process_batch = _add_files
+
+        # all the messages are waiting before the processing starts
+        now = datetime.utcnow()
+        timeouts = [now + timedelta(seconds=10 + i) for i in range(25)]
+        for timeout in timeouts:
+            ptt.msgproc._queue.put(FakeMessage({"timeout": timeout}))
+        ptt.msgproc._queue.put(None)
+        ptt.msgproc._read = lambda: None
+
+        ptt.start()
+        ptt.msgproc.join(1)
+        ptt.stop()
+        self.assertEqual(batches, [10, 10, 5])
+        self.assertEqual(collector.timeout, timeouts[-1])
+        # the collector is rescheduled once per batch, not once per message
+        self.assertEqual(ptt.scheduler.schedule.call_count, len(batches))
+        ptt.scheduler.schedule.assert_called_with(ptt, collector)
+
+
+class FakeCollector(object):
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.region = None
+
+    def __call__(self, mda):
+        self.timeout = mda["timeout"]
+
+    def finish(self):
+        self.timeout = None
+        return ["finished"]
+
+
+class TestTimeoutScheduler(unittest.TestCase):
+
+    def test_shared(self):
+        scheduler = TimeoutScheduler()
+        now = datetime.utcnow()
+        finished = []
+
+        def terminator(obj, publish_topic=None):
+            finished.append(publish_topic)
+
+        col1 = FakeCollector(now + timedelta(seconds=10))
+        col2 = FakeCollector(now + timedelta(seconds=.1))
+        trig1 = FileTrigger([col1], terminator, lambda mda: mda,
+                            publish_topic="trig1", scheduler=scheduler)
+        trig2 = FileTrigger([col2], terminator, lambda mda: mda,
+                            publish_topic="trig2", scheduler=scheduler)
+        trig1.start()
+        trig2.start()
+        self.assertTrue(trig1.is_alive())
+
+        # the first collector adjusts its timeout
+        trig1.add_file({"timeout": now + timedelta(seconds=.2)})
+        time.sleep(.5)
+        self.assertEqual(finished, ["trig2", "trig1"])
+        self.assertTrue(col1.timeout is None)
+
+        # a cleared timeout isn't handled
+        trig2.add_file({"timeout": datetime.utcnow() +
+                        timedelta(seconds=.1)})
+        col2.timeout = None
+        time.sleep(.3)
+        self.assertEqual(len(finished), 2)
+
+        trig1.stop()
+        trig1.join()
+        self.assertFalse(trig1.is_alive())
+        self.assertTrue(trig2.is_alive())
+        trig2.stop()
+        trig2.join(1)
+        self.assertFalse(trig2.is_alive())
+
+
+class TestPatternMatcher(unittest.TestCase):
+
+    def test_match(self):
+        matcher = PatternMatcher(["/data/avhrr/hrpt_*.l1b",
+                                  "/data/avhrr/*_noaa1[89].hrp",
+                                  "/data/viirs/SV???_npp_*.h5",
+                                  "/data/npp_????/*.h5"])
+        self.assertEqual(matcher.dirs, ["/data/avhrr", "/data/viirs",
+                                        "/data/npp_????"])
+        self.assertTrue(matcher.match("/data/avhrr/hrpt_noaa19.l1b"))
+        self.assertTrue(matcher.match("/data/avhrr/avhrr_noaa18.hrp"))
+        self.assertFalse(matcher.match("/data/avhrr/avhrr_noaa17.hrp"))
+        self.assertFalse(matcher.match("/data/viirs/hrpt_noaa19.l1b"))
+        self.assertTrue(matcher.match("/data/viirs/SVM01_npp_1.h5"))
+        self.assertFalse(matcher.match("/data/other/SVM01_npp_1.h5"))
+        self.assertTrue(matcher.match("/data/npp_0001/SVM01_npp_1.h5"))
+
 
 def suite():
     """The suite for test_trigger
@@ -69,6 +175,8 @@ def suite():
     loader = unittest.TestLoader()
     mysuite = unittest.TestSuite()
     mysuite.addTest(loader.loadTestsFromTestCase(TestPostTrollTrigger))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestTimeoutScheduler))
+    mysuite.addTest(loader.loadTestsFromTestCase(TestPatternMatcher))
 
     return mysuite
 
@@ -90,7 +90,10 @@ xmlstuff = """<?xml version="1.0" encoding='utf-8'?>
 </product_config>
 """
 
-from trollduction.xml_read import ProductList
+import os
+import tempfile
+
+from trollduction.xml_read import ProductList, get_product_list
 from StringIO import StringIO
 
 
@@ -106,7 +109,40 @@ class TestProductList(unittest.TestCase):
     #     dump_item = pconfig.prodlist.findall('./dump/file')[0]
     #     self.assertEquals(dump_item.attrib["output_dir"],
     #                      '/local_disk/data/out/sir')
-    pass
+
+    def test_plan(self):
+        pconfig = ProductList(StringIO(xmlstuff))
+        self.assertEqual(pconfig.area_ids, ("eurol", ))
+        self.assertEqual(len(pconfig.groups), 1)
+        self.assertEqual(pconfig.groups[0].id, "_rest")
+        area = pconfig.groups[0].data[0]
+        self.assertTrue(area is pconfig.areas["eurol"][0])
+
+        plan = pconfig.get_plan(area)
+        self.assertEqual(plan.name, "Europe_large")
+        self.assertTrue(plan.srch_radius is None)
+        self.assertEqual(len(plan.products), 7)
+        self.assertTrue(pconfig.get_plan(area[0]) is plan.products[0])
+        natural = plan.products[1]
+        self.assertEqual(natural.id, "natural")
+        self.assertEqual(natural.name, "dnc")
+        self.assertEqual(natural.sunzen, (("sunzen_day_maximum", 90.0),))
+        self.assertEqual(natural.sunzen_lonlat, (25.0, 60.0))
+        self.assertTrue(natural.sunzen_xy_loc is None)
+        self.assertEqual(plan.products[4].sunzen, ())
+
+    def test_get_product_list(self):
+        fd_, fname = tempfile.mkstemp()
+        try:
+            os.write(fd_, xmlstuff)
+            os.close(fd_)
+            pconfig = get_product_list(fname)
+            self.assertTrue(get_product_list(fname) is pconfig)
+            mtime = os.stat(fname).st_mtime
+            os.utime(fname, (mtime + 10, mtime + 10))
+            self.assertFalse(get_product_list(fname) is pconfig)
+        finally:
+            os.remove(fname)
 
 
 def suite():
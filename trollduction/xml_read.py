@@ -27,9 +27,14 @@
 import xml.etree.ElementTree as etree
 import os
 import logging
+from collections import namedtuple
 
 LOGGER = logging.getLogger(__name__)
 
+AreaPlan = namedtuple("AreaPlan", ["id", "name", "srch_radius", "products"])
+ProductPlan = namedtuple("ProductPlan", ["id", "name", "tag", "sunzen",
+                                         "sunzen_xy_loc", "sunzen_lonlat"])
+
 
 class InfoObject(object):
     """InfoObject class.
@@ -85,6 +90,9 @@ class ProductList(object):
         self.vars = {}
         self.aliases = {}
         self.groups = []
+        self.areas = {}
+        self.area_ids = ()
+        self.plans = {}
         self.parse()
 
     def insert_vars(self):
@@ -99,17 +107,13 @@ class ProductList(object):
         """Check area groups.
         """
         # create the "rest" group
+        grouped = set(area_id for group in self.groups
+                      for area_id in group.data)
         last_group = []
         for area in self.prodlist:
-            assigned = False
-            for group in self.groups:
-                if len(area.attrib.keys()) == 0:
-                    assigned = True
-                    continue
-                if area.attrib["id"] in group.data:
-                    assigned = True
-                    break
-            if not assigned:
+            if area.tag != "area":
+                continue
+            if area.attrib["id"] not in grouped:
                 last_group.append(area.attrib["id"])
         if last_group:
             self.groups.append(Dataset(last_group, id="_rest"))
@@ -119,18 +123,44 @@ class ProductList(object):
         for group in self.groups:
             new_group = Dataset([], **group.info)
             for area_id in group.data:
-                assigned = False
-                for area in self.prodlist:
-                    if area.attrib["id"] == area_id:
-                        new_group.data.append(area)
-                        assigned = True
-                        break
-                if not assigned:
+                try:
+                    new_group.data.append(self.areas[area_id][0])
+                except KeyError:
                     LOGGER.warning("Couldn't find area %s in product list",
                                    area_id)
             groups.append(new_group)
         self.groups = groups
 
+    def compile(self):
+        """Index the areas by id, and parse the attributes of the areas and
+        products once and for all.
+        """
+        self.areas = {}
+        self.plans = {}
+        for area in self.prodlist:
+            if area.tag != "area":
+                continue
+            self.areas.setdefault(area.attrib["id"], []).append(area)
+            products = []
+            for product in area:
+                self.plans[product] = _compile_product(product)
+                products.append(self.plans[product])
+            srch_radius = area.attrib.get("srch_radius")
+            if srch_radius is not None:
+                srch_radius = int(srch_radius)
+            self.plans[area] = AreaPlan(area.attrib["id"],
+                                        area.attrib.get("name"),
+                                        srch_radius,
+                                        tuple(products))
+        self.area_ids = tuple(area.attrib["id"]
+                              for area in self.prodlist
+                              if area.tag == "area")
+
+    def get_plan(self, item):
+        """Get the compiled attributes of the area or product *item*.
+        """
+        return self.plans[item]
+
     def parse(self):
         """Parse product list XML file.
         """
@@ -163,9 +193,49 @@ class ProductList(object):
                         alias.tag,
                         {})[alias.attrib["src"]] = alias.attrib['dst']
         self.insert_vars()
+        self.compile()
         self.check_groups()
 
 
+def _compile_product(product):
+    """Parse the attributes of the *product* item. The sun zenith angle
+    limits are kept as (key, value) pairs, as the plan is shared.
+    """
+    sunzen = tuple((key, float(product.attrib[key]))
+                   for key in ["sunzen_day_maximum", "sunzen_night_minimum"]
+                   if key in product.attrib)
+    xy_loc = lonlat = None
+    if "sunzen_xy_loc" in product.attrib:
+        xy_loc = tuple(int(val) for val
+                       in product.attrib["sunzen_xy_loc"].split(","))
+    elif "sunzen_lonlat" in product.attrib:
+        lonlat = tuple(float(val) for val
+                       in product.attrib["sunzen_lonlat"].split(","))
+    return ProductPlan(product.attrib.get("id"),
+                       product.attrib.get("name", product.attrib.get("id")),
+                       product.tag, sunzen, xy_loc, lonlat)
+
+
+_PRODUCT_LISTS = {}
+
+
+def get_product_list(fname):
+    """Get the product list of *fname*, parsing it again only when the file
+    has changed.
+    """
+    key = os.path.abspath(fname)
+    mtime = os.stat(fname).st_mtime
+    try:
+        prodlist, prev_mtime = _PRODUCT_LISTS[key]
+        if prev_mtime == mtime:
+            return prodlist
+    except KeyError:
+        pass
+    prodlist = ProductList(fname)
+    _PRODUCT_LISTS[key] = prodlist, mtime
+    return prodlist
+
+
 def get_root(fname):
     '''Read XML file and return the root tree.
     '''